@@ -13,6 +13,7 @@ function Room() {
   const localVideoRef = useRef(null);
   const remoteVideoRef = useRef(null);
   const webRTCClientRef = useRef(null);
+  const sttDataHandlerRef = useRef(null);
   const [remoteUserId, setRemoteUserId] = useState(null); // State for remote user ID
   const [isMuted, setIsMuted] = useState(true);
   const [isVideoOff, setIsVideoOff] = useState(false);
@@ -25,6 +26,7 @@ function Room() {
       () => setRemoteUserId(null) // onUserLeft callback
     );
     console.log("created WebRTCClient");
+    let left = false; // The cleanup ran - init may still be awaiting
 
     async function init() {
       await webRTCClientRef.current.initialize();
@@ -36,8 +38,10 @@ function Room() {
       const audioTrack = webRTCClientRef.current.localStream.getAudioTracks()[0];
       const videoTrack = webRTCClientRef.current.localStream.getVideoTracks()[0];
 
-      const sttDataHandler = new SttDataHandler(audioTrack, 1000);
-      sttDataHandler.init();
+      if (!left) {
+        sttDataHandlerRef.current = new SttDataHandler(audioTrack, 1000, true, 250);
+        sttDataHandlerRef.current.init();
+      }
 
       setIsMuted(!audioTrack.enabled);
       setIsVideoOff(!videoTrack.enabled);
@@ -46,6 +50,9 @@ function Room() {
     init();
 
     return () => {
+      left = true;
+      sttDataHandlerRef.current?.stop(); // Stops the recorder & closes the STT connection
+      sttDataHandlerRef.current = null;
       webRTCClientRef.current.disconnect();
       signalingClient.disconnect();
     };
@@ -1,14 +1,27 @@
 export class SttDataHandler {
-    constructor(audioTrack, recordLen) {
-        this.recordLen = recordLen
+    constructor(audioTrack, recordLen, streaming = false, streamTimeslice = 250) {
+        this.recordLen = recordLen // Length of every POSTed chunk (ms) - also used when streaming falls back to POST
+        this.streaming = streaming // One continuous recording sent over a WebSocket instead of a file per chunk
+        this.streamTimeslice = streamTimeslice // ms between the parts sent over the WebSocket
         this.totalRecordingsNum = 0
         this.mediaStream = new MediaStream([audioTrack]);// live audio stream reference
         this.mimeType = MediaRecorder.isTypeSupported('audio/webm') ? 'audio/webm' : 'audio/ogg'; // Checks if the browser support webm, iff not switches to ogg
-        this.setupRecorder();
+        this.stopped = false; // Set by stop() - no new recordings or reconnects after it
+        if (this.streaming && !MediaRecorder.isTypeSupported('audio/webm')) {
+            this.streaming = false; // The streaming endpoint only takes webm (e.g. Safari records mp4) - chunks are POSTed instead
+        }
+        if (this.streaming) {
+            this.setupStreamingRecorder();
+        } else {
+            this.setupRecorder();
+        }
     }
 
     setupRecorder() {
-        this.mediaRecorder = new MediaRecorder(this.mediaStream, { mimeType: this.mimeType });// records from the media stream and saves clises as blobs - chunks of binary data
+        // records from the media stream and saves clises as blobs - chunks of binary data
+        // Without webm or ogg support the browser records in its own format
+        const options = MediaRecorder.isTypeSupported(this.mimeType) ? { mimeType: this.mimeType } : {};
+        this.mediaRecorder = new MediaRecorder(this.mediaStream, options);
         this.mediaRecorder.ondataavailable = async (event) => {
             if (event.data.size > 0) {
                 await this.sendAudio({
@@ -18,18 +31,86 @@ export class SttDataHandler {
             }
         };
         this.mediaRecorder.onstop = () => {
-            this.startRecording(); // Restart recording for the next chunk
+            if (!this.stopped) {
+                this.startRecording(); // Restart recording for the next chunk
+            }
+        };
+    }
+
+    setupStreamingRecorder() {
+        this.mimeType = 'audio/webm'; // The streaming endpoint demuxes a single webm stream
+        this.mediaRecorder = new MediaRecorder(this.mediaStream, { mimeType: this.mimeType });
+        this.mediaRecorder.ondataavailable = (event) => {
+            if (event.data.size > 0 && this.ws?.readyState === WebSocket.OPEN) {
+                this.ws.send(event.data); // Each part continues the same recording - no new headers
+            }
+        };
+        this.mediaRecorder.onstop = () => {
+            if (this.ws?.readyState === WebSocket.OPEN) {
+                this.ws.send('end'); // Ask the server for the final transcript
+            }
         };
     }
 
     init() {
-        this.startRecording();
+        if (this.streaming) {
+            this.startStreaming();
+        } else {
+            this.startRecording();
+        }
+    }
+
+    startStreaming() {
+        this.ws = new WebSocket('ws://localhost:5000/stream-audio');
+        this.ws.onopen = () => {
+            this.streamStartTime = Date.now();
+            this.mediaRecorder.start(this.streamTimeslice); // Emits a part every streamTimeslice ms without stopping
+        };
+        this.ws.onmessage = (event) => {
+            const result = JSON.parse(event.data);
+            const delay = ((Date.now() - this.streamStartTime) / 1000).toFixed(2);
+            console.log(`Stream time: ${delay} | Server response:`, result);
+            if (result.final) {
+                this.ws.close(); // Nothing comes after the final transcript
+            }
+        };
+        this.ws.onerror = (err) => console.error("Error streaming audio:", err);
+        this.ws.onclose = () => {
+            if (this.stopped) {
+                return;
+            }
+            if (this.mediaRecorder.state === 'recording') {
+                this.mediaRecorder.stop(); // The server went away - the rest of this recording can't be sent
+            }
+            if (this.streamStartTime === undefined) {
+                // Never connected (e.g. the server has no streaming route) - send chunks with POST instead
+                console.warn("Streaming unavailable, sending audio chunks instead");
+                this.streaming = false;
+                this.setupRecorder();
+                this.startRecording();
+            }
+        };
+    }
+
+    stop() {
+        // Stops recording & closes the connection - call when leaving the room
+        this.stopped = true;
+        if (this.mediaRecorder.state === 'recording') {
+            this.mediaRecorder.stop(); // When streaming, the recorder's onstop asks for the final transcript
+        }
+        if (this.streaming && this.ws) {
+            if (this.ws.readyState === WebSocket.OPEN) {
+                setTimeout(() => this.ws.close(), 5000); // In case the final transcript never comes
+            } else {
+                this.ws.close();
+            }
+        }
     }
 
     startRecording() {
         this.currentStartRecordTime = Date.now();
 
-        if (this.mediaRecorder.state !== 'recording') {
+        if (!this.stopped && this.mediaRecorder.state !== 'recording') {
             this.mediaRecorder.start(this.recordLen);
             setTimeout(() => {
                 if (this.mediaRecorder.state === 'recording') {
@@ -1,15 +1,42 @@
-from flask import Flask, request, jsonify
+import json
+import os
+import time
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
+from flask_sock import Sock, ConnectionClosed
 import processor as stt
+import metrics
+import profiling
 
 app = Flask(__name__) # Initialize the flask server
     
 CORS(app, origins=["http://localhost:5173"]) # Define the CORS
 
+sock = Sock(app) # WebSocket routes for the streaming audio
+
 stt.load_hmm() # Uninitialize the hmm
+stt.load_lexicon() # Word transcripts when the compiled lexicon exists
+
+# Micro-batching of the Viterbi decoding across concurrent requests - off when the window is 0
+BATCH_WINDOW_MS = float(os.environ.get("STT_BATCH_WINDOW_MS", 0))
+BATCH_MAX_SIZE = int(os.environ.get("STT_BATCH_MAX_SIZE", 32))
+if BATCH_WINDOW_MS > 0:
+    stt.enable_batching(BATCH_WINDOW_MS, BATCH_MAX_SIZE)
 
 @app.route('/get-audio', methods=['POST'])
 def get_audio_data():
+    # Request metrics around the handler - every return path is counted with its status
+    metrics.in_flight.inc()
+    start = time.perf_counter()
+    try:
+        response = _get_audio_data()
+    finally:
+        metrics.in_flight.dec()
+    metrics.request_seconds.observe(time.perf_counter() - start)
+    metrics.requests.inc(label=str(response[1]))
+    return response
+
+def _get_audio_data():
     try:
         # 1. Validate request
         if 'audio_segment' not in request.files:
@@ -17,28 +44,44 @@ def get_audio_data():
         
         audio_file = request.files['audio_segment']
 
-        # 2. Decode audio to frames
-        audio_frames, sample_rate = stt.get_audio_frames(audio_file)
-
-        if audio_frames is None:
-            return jsonify({'error': 'Audio decoding failed'}), 500
-        
-        if not audio_frames:
-            return jsonify({'message': 'No frames decoded', 'text': ''}), 200
+        # 2. Decode, MFCCs & Viterbi - profiled when the request asks for it (?profile=1 or X-Profile: 1)
+        profile = profiling.requested(request.args.get('profile') or request.headers.get('X-Profile'))
+        with profiling.maybe_profile(profile, "get-audio"):
+            body, status = stt.transcribe(audio_file)
+        return jsonify(body), status
 
-        # 3. Convert frames to MFCCs
-        mfccs = stt.audio_frames_to_mfccs(audio_frames, sample_rate)
-        if mfccs is None:
-            return jsonify({'message': 'MFCC extraction failed', 'text': ''}), 200
+    except Exception as e:
+        metrics.errors.inc(label="request")
+        app.logger.error(f"Exception /get-audio route: {e}", exc_info=True)
+        return jsonify({'error': 'An unexpected server error occurred'}), 500
 
-        # 4. Decode MFCCs and return text
-        recognized_text = stt.decode_sequence(mfccs)
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Prometheus scrape target - stage histograms, request counters & gauges
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
-        return jsonify({'message': 'Audio processed successfully', 'text': recognized_text}), 200
+@sock.route('/stream-audio')
+def stream_audio(ws):
+    # One connection per speaker - binary messages are the parts of a single continuous webm recording
+    # A text message or closing the connection ends the stream
+    def receive():
+        try:
+            return ws.receive()
+        except ConnectionClosed:
+            return None
 
+    session = stt.StreamSession()
+    metrics.streams.inc()
+    try:
+        for text, is_final in session.run(receive):
+            ws.send(json.dumps({'text': text, 'final': is_final}))
+    except ConnectionClosed:
+        pass # Client left before the final transcript
     except Exception as e:
-        app.logger.error(f"Exception /get-audio route: {e}", exc_info=True)
-        return jsonify({'error': 'An unexpected server error occurred'}), 500
+        metrics.errors.inc(label="stream")
+        app.logger.error(f"Exception /stream-audio route: {e}", exc_info=True)
+    finally:
+        metrics.streams.dec()
 
 if __name__ == '__main__':
     if stt.hmm_model is None:
@@ -0,0 +1,232 @@
+import asyncio
+import json
+import math
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from quart import Quart, request, websocket, jsonify, Response
+from quart_cors import cors
+import processor as stt
+import shared_model
+import metrics
+import profiling
+
+# Async serving mode - requests are handled on the event loop & the CPU bound pipeline
+# (decode, MFCC, Viterbi) runs in a bounded worker pool
+# Run with: python async_app.py  (or: hypercorn async_app:app)
+
+POOL_TYPE = os.environ.get("STT_POOL", "process") # "process" or "thread"
+NUM_WORKERS = int(os.environ.get("STT_WORKERS", os.cpu_count() or 1))
+MAX_QUEUE = int(os.environ.get("STT_MAX_QUEUE", 2 * NUM_WORKERS)) # Chunks waiting for a free worker
+DEADLINE_MS = float(os.environ.get("STT_DEADLINE_MS", 2000)) # Default time a chunk has from arrival to its result
+# Micro-batching of the decoding across concurrent chunks (see app.py) - only with the thread pool,
+# the chunks of a process pool are in different processes
+BATCH_WINDOW_MS = float(os.environ.get("STT_BATCH_WINDOW_MS", 0))
+BATCH_MAX_SIZE = int(os.environ.get("STT_BATCH_MAX_SIZE", 32))
+MAX_STREAMS = int(os.environ.get("STT_MAX_STREAMS", 32)) # Open /stream-audio connections - one thread each
+
+app = Quart(__name__) # Initialize the quart server
+
+app = cors(app, allow_origin="http://localhost:5173") # Define the CORS
+
+pool = None
+shared_block = None # Shared memory with the model parameters of the process workers
+shared_descriptor = None # What the process workers attach to - kept to start a new pool
+jobs_in_pool = 0 # Running + queued chunks & the uploads that reserved a place - everything that didn't finish yet
+stream_threads = None # A stream keeps its decoder state for the whole connection - it runs in a thread of this process
+streams_open = 0
+
+def _make_pool():
+    if POOL_TYPE == "thread":
+        return ThreadPoolExecutor(max_workers=NUM_WORKERS) # Threads share the model of this process
+    return ProcessPoolExecutor(max_workers=NUM_WORKERS, initializer=stt.load_shared_hmm, initargs=(shared_descriptor,))
+
+def _replace_broken_pool(broken):
+    # A worker process that died (crash, OOM kill) breaks its pool for good - every later submit fails
+    # The jobs of the broken pool fail with BrokenProcessPool & release their places through _job_done
+    global pool
+    if pool is broken:
+        app.logger.error("STT: worker pool broken, starting a new one")
+        pool = _make_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+@app.before_serving
+async def start_pool():
+    global pool, shared_block, shared_descriptor, stream_threads
+    if POOL_TYPE not in ("process", "thread"):
+        raise ValueError(f"unknown STT_POOL '{POOL_TYPE}', expected 'process' or 'thread'")
+
+    stt.load_hmm()
+    if stt.hmm_model is None:
+        raise RuntimeError("HMM model failed initiailizing- Cant open the server")
+    stt.load_lexicon() # The process workers load it again next to the shared model
+
+    if POOL_TYPE == "thread" and BATCH_WINDOW_MS > 0:
+        stt.enable_batching(BATCH_WINDOW_MS, BATCH_MAX_SIZE)
+    elif BATCH_WINDOW_MS > 0:
+        print("STT: STT_BATCH_WINDOW_MS is ignored with the process pool")
+
+    if POOL_TYPE == "process":
+        # Loaded once here - the workers only attach to the published arrays
+        shared_block, shared_descriptor = shared_model.publish_model(stt.hmm_model)
+    pool = _make_pool()
+    stream_threads = ThreadPoolExecutor(max_workers=MAX_STREAMS, thread_name_prefix="stt-stream")
+    print(f"STT: {POOL_TYPE} pool with {NUM_WORKERS} workers, max queue {MAX_QUEUE}, deadline {DEADLINE_MS:.0f}ms")
+
+@app.after_serving
+async def stop_pool():
+    pool.shutdown(wait=True, cancel_futures=True)
+    stream_threads.shutdown(wait=True)
+    if shared_block is not None:
+        shared_block.close()
+        shared_block.unlink()
+
+def _job_done(loop):
+    # Called from the pool's thread when a job ends in any way - even after its request gave up on it
+    def release(future):
+        global jobs_in_pool
+        jobs_in_pool -= 1
+        # Stage metrics the worker captured - recorded here so the jobs of timed out requests count too
+        if not future.cancelled() and future.exception() is None:
+            metrics.replay(future.result()[2])
+    return lambda future: loop.call_soon_threadsafe(release, future)
+
+@app.route('/get-audio', methods=['POST'])
+async def get_audio_data():
+    # Request metrics around the handler - every return path is counted with its status
+    arrival = time.time()
+    metrics.in_flight.inc()
+    try:
+        response = await _get_audio_data(arrival)
+    finally:
+        metrics.in_flight.dec()
+    metrics.request_seconds.observe(time.time() - arrival)
+    metrics.requests.inc(label=str(response[1]))
+    return response
+
+def _submit(*args):
+    # pool.submit that replaces a pool broken by an earlier job & tries once more
+    current = pool
+    try:
+        return current.submit(stt.transcribe_bytes, *args)
+    except BrokenProcessPool:
+        _replace_broken_pool(current)
+        return pool.submit(stt.transcribe_bytes, *args)
+
+async def _get_audio_data(arrival):
+    global jobs_in_pool
+
+    # 1. Backpressure - reject right away instead of queueing behind work we can't finish in time
+    # The place is reserved before the first await so the uploads still receiving their body count too
+    if jobs_in_pool >= NUM_WORKERS + MAX_QUEUE:
+        return jsonify({'error': 'Server busy'}), 503, {'Retry-After': '1'}
+    jobs_in_pool += 1
+    future = None
+    try:
+        # 2. Validate request
+        files = await request.files
+        if 'audio_segment' not in files:
+            return jsonify({'error': 'No audio file'}), 400
+        webm_data = files['audio_segment'].read()
+
+        # The client can ask for a shorter/longer deadline for its chunk
+        try:
+            deadline_ms = float(request.headers.get('X-Deadline-Ms', DEADLINE_MS))
+        except ValueError:
+            deadline_ms = math.nan
+        if not math.isfinite(deadline_ms) or deadline_ms <= 0:
+            return jsonify({'error': 'X-Deadline-Ms must be a positive number of milliseconds'}), 400
+        deadline = arrival + deadline_ms / 1000
+        # Profiled in the worker when the request asks for it (?profile=1 or X-Profile: 1)
+        profile = profiling.requested(request.args.get('profile') or request.headers.get('X-Profile'))
+
+        # 3. Run the pipeline in the pool & wait for it without blocking the loop
+        future = _submit(webm_data, deadline, profile)
+        submitted_to = pool
+        future.add_done_callback(_job_done(asyncio.get_running_loop())) # Releases the place from now on
+    finally:
+        if future is None:
+            jobs_in_pool -= 1
+
+    try:
+        body, status, _ = await asyncio.wait_for(asyncio.wrap_future(future), timeout=max(0.0, deadline - time.time()))
+    except asyncio.TimeoutError:
+        # Stale chunk - cancelled if it didn't start yet, otherwise the worker drops it at the next stage
+        return jsonify({'error': 'Deadline exceeded'}), 504
+    except BrokenProcessPool as e:
+        # The worker of this chunk (or another one of the pool) died - the next chunks get a new pool
+        metrics.errors.inc(label="request")
+        app.logger.error(f"Exception /get-audio route: {e}")
+        _replace_broken_pool(submitted_to)
+        return jsonify({'error': 'An unexpected server error occurred'}), 500
+    except Exception as e:
+        metrics.errors.inc(label="request")
+        app.logger.error(f"Exception /get-audio route: {e}", exc_info=True)
+        return jsonify({'error': 'An unexpected server error occurred'}), 500
+
+    return jsonify(body), status
+
+@app.websocket('/stream-audio')
+async def stream_audio():
+    # Same protocol as the flask server - binary messages are the parts of a single continuous webm recording,
+    # a text message or closing the connection ends the stream
+    # The blocking StreamSession runs in a thread, this handler passes the messages & the transcripts
+    global streams_open
+    if streams_open >= MAX_STREAMS:
+        await websocket.close(1013) # Try again later - the client falls back to the POST chunks
+        return
+
+    loop = asyncio.get_running_loop()
+    messages = queue.Queue() # From the client, read by the session's thread - None ends the stream
+    results = asyncio.Queue() # (text, is_final) from the session's thread - None when it ended
+    session = stt.StreamSession()
+
+    def run():
+        try:
+            for result in session.run(messages.get):
+                loop.call_soon_threadsafe(results.put_nowait, result)
+        finally:
+            loop.call_soon_threadsafe(results.put_nowait, None)
+
+    async def receive():
+        while True:
+            message = await websocket.receive()
+            messages.put(message)
+            if not message or isinstance(message, str):
+                return
+
+    streams_open += 1
+    metrics.streams.inc()
+    session_done = loop.run_in_executor(stream_threads, run)
+    receiver = asyncio.ensure_future(receive())
+    try:
+        while (result := await results.get()) is not None:
+            text, is_final = result
+            await websocket.send(json.dumps({'text': text, 'final': is_final}))
+        await session_done
+    except asyncio.CancelledError:
+        raise # Client left - the session ends with the None below
+    except Exception as e:
+        metrics.errors.inc(label="stream")
+        app.logger.error(f"Exception /stream-audio route: {e}", exc_info=True)
+    finally:
+        receiver.cancel()
+        messages.put(None)
+        streams_open -= 1
+        metrics.streams.dec()
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    # Prometheus scrape target - the pipeline stages of the workers are replayed into this process
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"0.0.0.0:{os.environ.get('STT_PORT', 5000)}"]
+    print("\nStarting async STT server...")
+    asyncio.run(serve(app, config))
@@ -0,0 +1,89 @@
+import threading
+import time
+from concurrent.futures import Future
+import metrics
+
+# Micro-batching in front of the HMM decoder - many small decode jobs arriving from different
+# request threads are collected for a short window & decoded together with a single batched call
+
+
+class MicroBatcher:
+    # decode_batch(list of items) -> list of results in the same order, e.g. HMM.viterbi_decode_batch
+    # A batch is sent once window_ms passed since its first item arrived, or when it has max_batch_size items
+    # name - the batcher label of the batch size & queue delay metrics
+    def __init__(self, decode_batch, window_ms=5.0, max_batch_size=32, name="decode"):
+        self.decode_batch = decode_batch
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.name = name
+
+        self._queue = [] # (item, future, time queued)
+        self._condition = threading.Condition()
+        self._closed = False
+
+        self._worker = threading.Thread(target=self._run, name="stt-micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, item):
+        # Queues an item & returns a Future of its result
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._queue.append((item, future, time.perf_counter()))
+            self._condition.notify()
+        return future
+
+    def decode(self, item):
+        # Blocking - waits for the batch the item ended up in
+        return self.submit(item).result()
+
+    def close(self):
+        # Decodes what is already queued & stops the worker thread
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._worker.join()
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._queue and not self._closed:
+                self._condition.wait()
+            if not self._queue:
+                return None # Closed & nothing left
+
+            # The window starts when the first item of the batch arrived
+            window_end = self._queue[0][2] + self.window
+            while len(self._queue) < self.max_batch_size and not self._closed:
+                remaining = window_end - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch = self._queue[:self.max_batch_size]
+            del self._queue[:self.max_batch_size]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            start = time.perf_counter()
+            self._record(batch, start)
+            try:
+                results = self.decode_batch([item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def _record(self, batch, start):
+        # Batch size & the time every item waited for its batch
+        metrics.batch_size.observe(len(batch), self.name)
+        for _, _, queued in batch:
+            metrics.batch_queue_seconds.observe(start - queued, self.name)
@@ -0,0 +1,246 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import av
+import phonemes as ph
+import processor
+from hmm import HMM
+from mfcc import frame_lengths
+
+# Benchmark suite of the STT pipeline - every stage at a few audio lengths & model sizes
+# Reports the wall time (min / median / mean of the repeats - fewer repeats for cases slower than TIME_BUDGET),
+# the real time factor (median wall time / seconds of audio, < 1 is faster than real time) & the peak of the
+# memory allocated during one run (tracemalloc, numpy arrays included) as JSON so two commits can be compared:
+#   python benchmark.py --output before.json
+#   python benchmark.py --output after.json
+#   python benchmark.py compare before.json after.json
+# The audio fixtures are webm/Opus files like the browser sends, generated from a fixed seed
+# The audio stages are the ones /get-audio runs (decode_audio, the VAD, samples_to_mfccs at 16kHz) & the HMM stages
+# decode the frames they produce
+
+FIXTURE_RATE = 48000 # Opus in webm from the browser is 48kHz
+LENGTHS = (1.0, 5.0, 10.0) # Seconds of audio per case
+STATE_COUNTS = (40, 120) # One state per phoneme (dense) & the 3 state left to right topology (sparse)
+REPEATS = 5
+TIME_BUDGET = 10.0 # Seconds of timed runs per case - slow cases stop repeating after it (at least 1 run)
+TRAINING_SEQUENCES = 2 # Sequences of the given length in the baum welch iteration
+
+
+def _speech_like_signal(seconds, rate, rng):
+    # Voiced segments (harmonics of a gliding pitch, syllable rate envelope) separated by short pauses
+    # & a little noise - something the MFCC & decoders treat like speech, reproducible from the seed
+    t = np.arange(int(seconds * rate)) / rate
+    pitch = 120 + 40 * np.sin(2 * np.pi * 0.5 * t + rng.uniform(0, np.pi))
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    signal = sum(np.sin(k * phase) / k for k in range(1, 8))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t + rng.uniform(0, np.pi)), 0, None)
+    pauses = (np.sin(2 * np.pi * 0.3 * t) > -0.8).astype(np.float64)
+    signal = 0.2 * signal * syllables * pauses + 0.003 * rng.normal(size=len(t))
+    return signal.astype(np.float32)
+
+def make_fixture(filepath, seconds, seed=0):
+    # Writes a mono webm/Opus file
+    rng = np.random.default_rng(seed)
+    samples = _speech_like_signal(seconds, FIXTURE_RATE, rng)
+    with av.open(filepath, "w", format="webm") as container:
+        stream = container.add_stream("libopus", rate=FIXTURE_RATE)
+        stream.layout = "mono"
+        frame_size = 960 # 20ms Opus frames
+        for start in range(0, len(samples), frame_size):
+            frame = av.AudioFrame.from_ndarray(samples[None, start:start + frame_size], format="flt", layout="mono")
+            frame.sample_rate = FIXTURE_RATE
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+
+def fixture_paths(directory, lengths):
+    # {seconds: path} - made once, the next runs reuse them
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for seconds in lengths:
+        path = os.path.join(directory, f"speech_{seconds:g}s.webm")
+        if not os.path.exists(path):
+            make_fixture(path, seconds, seed=int(1000 * seconds)) # Same file for a length whatever the other lengths are
+        paths[seconds] = path
+    return paths
+
+def make_hmm(num_states, seed=0):
+    # Random but well conditioned model - 40 states dense, or the 40 phonemes expanded to num_states / 40
+    # left to right sub states
+    rng = np.random.default_rng(seed)
+    N, D = ph.NUM_STATES, ph.MFCC_DIM
+    transition_matrix = rng.uniform(0.5, 1.0, size=(N, N))
+    np.fill_diagonal(transition_matrix, 3 * N)
+    params = dict(ph.HMM_PARAMS)
+    params.update(
+        initial_probs=np.full(N, 1.0 / N),
+        transition_matrix=transition_matrix / transition_matrix.sum(axis=1, keepdims=True),
+        emission_means=rng.normal(size=(N, D)) * 10,
+        emission_covariances=np.tile(np.diag(rng.uniform(20, 80, size=D)), (N, 1, 1)),
+    )
+    if num_states != N:
+        params = ph.expand_to_left_to_right(params, num_states // N)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return HMM(params)
+
+def measure(function, repeats, time_budget=TIME_BUDGET):
+    # (wall times of the repeats, peak bytes allocated during one more run)
+    function() # Warm up - imports, caches, first touch of the arrays
+    times = []
+    while len(times) < repeats and (not times or sum(times) < time_budget):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return times, peak
+
+def _result(stage, num_states, audio_seconds, frames, times, peak):
+    median = float(np.median(times))
+    return {
+        "stage": stage,
+        "num_states": num_states,
+        "audio_seconds": audio_seconds,
+        "frames": frames,
+        "repeats": len(times),
+        "wall_time_s": {"min": float(np.min(times)), "median": median, "mean": float(np.mean(times))},
+        "rtf": median / audio_seconds,
+        "peak_memory_bytes": int(peak),
+    }
+
+def run(lengths=LENGTHS, state_counts=STATE_COUNTS, repeats=REPEATS, fixtures_dir=None):
+    fixtures_dir = fixtures_dir or os.path.join(tempfile.gettempdir(), "stt_benchmark_fixtures")
+    paths = fixture_paths(fixtures_dir, lengths)
+    models = {num_states: make_hmm(num_states) for num_states in state_counts}
+    processor.hmm_model = models[state_counts[0]] # The MFCC stage reads the dims from the served model
+    results = []
+
+    for seconds in lengths:
+        with open(paths[seconds], "rb") as f:
+            webm_data = f.read()
+
+        # 1. Audio - the path /get-audio serves: decode & resample to TARGET_SAMPLE_RATE, voice activity & MFCCs
+        def decode():
+            return processor.decode_audio(io.BytesIO(webm_data))
+        samples, sample_rate = decode()
+        results.append(_result("decode_audio", None, seconds, None, *measure(decode, repeats)))
+
+        def vad():
+            return processor.vad.trim(samples)
+        speech = vad()
+        results.append(_result("vad_trim", None, seconds, None, *measure(vad, repeats)))
+        if speech is not None: # The fixture has pauses at its ends - decoded like /get-audio does
+            samples = samples[speech[0]:speech[1]]
+
+        def mfccs():
+            return processor.samples_to_mfccs(samples, sample_rate)
+        observations = mfccs()
+        results.append(_result("samples_to_mfccs", None, seconds, len(observations), *measure(mfccs, repeats)))
+
+        # The native rate path (get_audio_frames & audio_frames_to_mfccs) - kept for the library callers
+        def legacy_decode():
+            return processor.get_audio_frames(io.BytesIO(webm_data))
+        audio_frames, native_rate = legacy_decode()
+        results.append(_result("get_audio_frames", None, seconds, None, *measure(legacy_decode, repeats)))
+
+        def legacy_mfccs():
+            return processor.audio_frames_to_mfccs(audio_frames, native_rate)
+        results.append(_result("audio_frames_to_mfccs", None, seconds, len(legacy_mfccs()), *measure(legacy_mfccs, repeats)))
+
+        # Seconds of audio the frames stand for - the HMM stages are measured on the frames /get-audio decodes
+        frame_seconds = len(observations) * frame_lengths(sample_rate)[1] / sample_rate
+        training_sequences = [observations] * TRAINING_SEQUENCES
+
+        # 2. HMM stages at every model size
+        for num_states, hmm in models.items():
+            stages = {
+                "viterbi_decode": lambda: hmm.viterbi_decode(observations),
+                "forward_backward": lambda: hmm.forward_backward(observations, mode="log"),
+                "forward_backward_scaled": lambda: hmm.forward_backward(observations, mode="scaled"),
+            }
+            for stage, function in stages.items():
+                results.append(_result(stage, num_states, frame_seconds, len(observations),
+                                       *measure(function, repeats)))
+
+            def train():
+                # One iteration on a copy so every repeat starts from the same parameters
+                trained = HMM.from_arrays(hmm.export_meta(), {name: np.array(array) for name, array in hmm.export_arrays().items()})
+                with contextlib.redirect_stdout(io.StringIO()):
+                    trained.baum_welch_train(training_sequences, max_iterations=1)
+            results.append(_result("baum_welch_iteration", num_states, TRAINING_SEQUENCES * frame_seconds,
+                                   TRAINING_SEQUENCES * len(observations), *measure(train, repeats)))
+        print(f"benchmark: {seconds:g}s done", file=sys.stderr)
+    return results
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def compare(before_path, after_path):
+    # Median wall time of every case in two result files - speedup > 1 is faster
+    with open(before_path) as f:
+        before = {(r["stage"], r["num_states"], r["audio_seconds"]): r for r in json.load(f)["results"]}
+    with open(after_path) as f:
+        after = json.load(f)["results"]
+    print(f"{'stage':<22}{'states':>7}{'audio s':>9}{'before ms':>11}{'after ms':>10}{'speedup':>9}{'peak MB':>9}")
+    for r in after:
+        old = before.get((r["stage"], r["num_states"], r["audio_seconds"]))
+        if old is None:
+            continue
+        old_time, new_time = old["wall_time_s"]["median"], r["wall_time_s"]["median"]
+        print(f"{r['stage']:<22}{str(r['num_states'] or '-'):>7}{r['audio_seconds']:>9.2f}{1000 * old_time:>11.2f}"
+              f"{1000 * new_time:>10.2f}{old_time / new_time:>8.2f}x{r['peak_memory_bytes'] / 2**20:>9.2f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "compare":
+        compare(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="STT pipeline benchmark (or: benchmark.py compare before.json after.json)")
+    parser.add_argument("--lengths", type=float, nargs="+", default=LENGTHS, help="seconds of audio per case")
+    parser.add_argument("--states", type=int, nargs="+", default=STATE_COUNTS, help="HMM state counts (multiples of 40)")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--fixtures", default=None, help="directory of the generated webm fixtures")
+    parser.add_argument("--output", default=None, help="JSON file - printed to stdout without it")
+    args = parser.parse_args()
+    if any(num_states % ph.NUM_STATES for num_states in args.states):
+        parser.error(f"state counts must be multiples of {ph.NUM_STATES}")
+
+    report = {
+        "environment": environment(),
+        "config": {"lengths": list(args.lengths), "states": list(args.states), "repeats": args.repeats},
+        "results": run(args.lengths, args.states, args.repeats, args.fixtures),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"benchmark: results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
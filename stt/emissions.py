@@ -0,0 +1,468 @@
+import numpy as np
+
+LOG_2PI = np.log(2 * np.pi)
+
+# "full" - one full covariance gaussian per state, "diag" - one diagonal gaussian per state,
+# "tied" - one gaussian per state with a single covariance shared by all of them,
+# "gmm_diag" / "gmm_full" - a mixture of K diagonal / full covariance gaussians per state
+EMISSION_TYPES = ("full", "diag", "tied", "gmm_diag", "gmm_full")
+
+MIN_VARIANCE = 1e-6 # Floor of the re-estimated diagonal variances
+MIN_WEIGHT = 1e-5 # Floor of the re-estimated mixture weights
+epsilon = 1e-10
+
+def _logsumexp_components(table):
+    # logsumexp of a (T, K, N) table over its K axis - each reduction step is a whole (T, N) slice so it stays
+    # fast for a few components (scipy's logsumexp over a short last axis is much slower)
+    # Where every component is impossible it stays -inf
+    table_max = np.max(table, axis=1)
+    shift = np.where(np.isfinite(table_max), table_max, 0.0)
+    with np.errstate(divide="ignore"):
+        return np.log(np.sum(np.exp(table - shift[:, None, :]), axis=1)) + shift
+
+def _factorize_covariance(cov):
+    # Returns (cholesky, whitener, log_det, null_space) for a single covariance matrix
+    # The whitener W is the inverse of the cholesky factor transposed so - maha(x) = ||(x - mean) @ W||^2
+    # Same rank decision as scipy's allow_singular=True - eigenvalues up to 1e6 * float eps * the largest one
+    # are dropped. Cholesky succeeds on many of those (condition ~1e11 after a few Baum-Welch iterations)
+    # so the eigenvalues are always checked, not only when cholesky fails
+    eigvals, eigvecs = np.linalg.eigh(cov)
+    eps = 1e6 * np.finfo(np.float64).eps * np.max(np.abs(eigvals))
+    valid = eigvals > eps
+    if valid.all():
+        try:
+            cholesky = np.linalg.cholesky(cov)
+            whitener = np.linalg.inv(cholesky).T
+            log_det = 2.0 * np.sum(np.log(np.diag(cholesky)))
+            return cholesky, whitener, log_det, None
+        except np.linalg.LinAlgError:
+            pass # Not symmetric enough for cholesky - the eigen decomposition below has the same result
+
+    # Singular matrix - same pseudo inverse & pseudo determinant scipy uses with allow_singular=True
+    inv_sqrt = np.zeros_like(eigvals)
+    inv_sqrt[valid] = 1.0 / np.sqrt(eigvals[valid])
+    whitener = eigvecs * inv_sqrt # scales each eigenvector column
+    cholesky = eigvecs * np.sqrt(np.clip(eigvals, 0.0, None))
+    log_det = np.sum(np.log(eigvals[valid]))
+    # Observations with a component in the null space are outside the support (zero prob)
+    null_space = (eigvecs[:, ~valid], 1e3 * eps) if not valid.all() else None
+    return cholesky, whitener, log_det, null_space
+
+
+class GaussianEmissions:
+    # Full covariance gaussian per state, all factorizations are done once when the model is built
+    emission_type = "full"
+
+    def __init__(self, means, covariances):
+        self.means = np.asarray(means, dtype=np.float64)
+        self.covariances = np.asarray(covariances, dtype=np.float64)
+        self.N, self.D = self.means.shape
+
+        self.choleskys = np.empty((self.N, self.D, self.D))
+        self.whiteners = np.empty((self.N, self.D, self.D))
+        self.log_dets = np.empty(self.N)
+        self.log_norms = np.empty(self.N) # -0.5 * (rank * log(2pi) + log|cov|)
+        self.null_spaces = {} # Only for the singular covariances
+
+        for i in range(self.N):
+            cholesky, whitener, log_det, null_space = _factorize_covariance(self.covariances[i])
+            self.choleskys[i] = cholesky
+            self.whiteners[i] = whitener
+            self.log_dets[i] = log_det
+            rank = self.D
+            if null_space is not None:
+                self.null_spaces[i] = null_space
+                rank -= null_space[0].shape[1]
+            self.log_norms[i] = -0.5 * (rank * LOG_2PI + log_det)
+
+        # The whitened means so the mean subtraction happens after the projection
+        self.white_means = np.einsum('nd,nde->ne', self.means, self.whiteners)
+
+    def log_likelihood(self, observations, states=None):
+        # Returns the (T, N) table of log N(o_t; mean_j, cov_j) for all frames & states
+        # states - optional index array, only those states are evaluated & the table is (T, len(states))
+        observations = np.asarray(observations, dtype=np.float64)
+        if states is None:
+            whiteners, white_means, log_norms = self.whiteners, self.white_means, self.log_norms
+        else:
+            whiteners, white_means, log_norms = self.whiteners[states], self.white_means[states], self.log_norms[states]
+
+        # (1, T, D) @ (N, D, D) -> (N, T, D) whitened observations for every state
+        projected = np.matmul(observations[None, :, :], whiteners)
+        projected -= white_means[:, None, :]
+        maha = np.einsum('ntd,ntd->tn', projected, projected)
+        log_likelihood = log_norms - 0.5 * maha
+
+        for i, (basis, tolerance) in self.null_spaces.items():
+            if states is None:
+                column = i
+            else:
+                columns = np.flatnonzero(states == i)
+                if len(columns) == 0:
+                    continue
+                column = columns[0]
+            residual = np.linalg.norm((observations - self.means[i]) @ basis, axis=-1)
+            log_likelihood[residual >= tolerance, column] = -np.inf
+
+        return log_likelihood
+
+    def accumulate(self, observations, gamma):
+        # Baum-Welch sufficient statistics of one sequence given its (T, N) state posteriors gamma
+        # Summed over all the sequences before reestimate
+        # Denominator Sum_t gamma_t(j)
+        gamma_sum = np.sum(gamma, axis=0)
+        # Numerator Sum_t (gamma_t(j) * O_t) - the weighted sum of seeing state j at ot by the expected j num
+        gamma_obs_sum = gamma.T @ observations
+        # Sum_t (gamma_t(j) * outer(O_t, O_t)) - the covariances are taken around the new means in the M-step
+        gamma_outer_sum = np.einsum('tn,td,te->nde', gamma, observations, observations, optimize=True)
+        return gamma_sum, gamma_obs_sum, gamma_outer_sum
+
+    def reestimate(self, statistics):
+        # M-step - new emission model from the accumulated statistics
+        # States that were never expected to be visited keep their old parameters
+        gamma_sum, gamma_obs_sum, gamma_outer_sum = statistics
+        visited = gamma_sum > epsilon
+        new_means = self.means.copy()
+        new_covariances = self.covariances.copy()
+
+        # new mean = accumulated weighted sum / accumulated sum of weights
+        new_means[visited] = gamma_obs_sum[visited] / gamma_sum[visited, None]
+        # new cov = E[O O^T] - mean mean^T, both weighted by gamma - plus a small diagonal value for numerical stability
+        new_covariances[visited] = (gamma_outer_sum[visited] / gamma_sum[visited, None, None]
+                                    - np.einsum('nd,ne->nde', new_means[visited], new_means[visited])
+                                    + np.identity(self.D) * epsilon)
+        return GaussianEmissions(new_means, new_covariances)
+
+    def export_arrays(self):
+        # Everything computed in __init__ as plain arrays - from_arrays rebuilds the model from them
+        # The null spaces of the singular covariances are zero padded to (D, D)
+        null_space_states = sorted(self.null_spaces)
+        null_space_bases = np.zeros((len(null_space_states), self.D, self.D))
+        null_space_tolerances = np.zeros(len(null_space_states))
+        for k, i in enumerate(null_space_states):
+            basis, tolerance = self.null_spaces[i]
+            null_space_bases[k, :, :basis.shape[1]] = basis
+            null_space_tolerances[k] = tolerance
+
+        return {
+            "means": self.means,
+            "covariances": self.covariances,
+            "choleskys": self.choleskys,
+            "whiteners": self.whiteners,
+            "log_dets": self.log_dets,
+            "log_norms": self.log_norms,
+            "white_means": self.white_means,
+            "null_space_states": np.array(null_space_states, dtype=np.int64),
+            "null_space_bases": null_space_bases,
+            "null_space_tolerances": null_space_tolerances,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        # Builds the model without factorizing anything - the arrays are used as is (can be read only views)
+        emissions = cls.__new__(cls)
+        for name in ("means", "covariances", "choleskys", "whiteners", "log_dets", "log_norms", "white_means"):
+            setattr(emissions, name, arrays[name])
+        emissions.N, emissions.D = emissions.means.shape
+
+        emissions.null_spaces = {}
+        for k, i in enumerate(arrays["null_space_states"]):
+            emissions.null_spaces[int(i)] = (arrays["null_space_bases"][k], arrays["null_space_tolerances"][k])
+        return emissions
+
+
+class DiagonalGaussianEmissions:
+    # Diagonal covariance gaussian per state - the whole (T, N) table is 2 matrix products
+    # maha = Sum_d (o_d - mean_d)^2 / var_d = o^2 @ (1 / var) - 2 * o @ (mean / var) + Sum_d mean_d^2 / var_d
+    emission_type = "diag"
+
+    def __init__(self, means, variances):
+        self.means = np.asarray(means, dtype=np.float64)
+        variances = np.asarray(variances, dtype=np.float64)
+        if variances.ndim == self.means.ndim + 1: # Full covariances - keep their diagonals
+            variances = np.diagonal(variances, axis1=-2, axis2=-1)
+        self.covariances = np.maximum(variances, MIN_VARIANCE) # (N, D) variances
+        self.N, self.D = self.means.shape
+
+        self.precisions = 1.0 / self.covariances
+        self.scaled_means = self.means * self.precisions
+        self.log_norms = -0.5 * (self.D * LOG_2PI + np.sum(np.log(self.covariances), axis=1)
+                                 + np.sum(self.means * self.scaled_means, axis=1))
+
+    def log_likelihood(self, observations, states=None):
+        # Returns the (T, N) table of log N(o_t; mean_j, diag(var_j)), or (T, len(states)) for some states
+        observations = np.asarray(observations, dtype=np.float64)
+        if states is None:
+            precisions, scaled_means, log_norms = self.precisions, self.scaled_means, self.log_norms
+        else:
+            precisions, scaled_means, log_norms = self.precisions[states], self.scaled_means[states], self.log_norms[states]
+        return log_norms + observations @ scaled_means.T - 0.5 * ((observations ** 2) @ precisions.T)
+
+    def accumulate(self, observations, gamma):
+        # (Sum_t gamma_t, Sum_t gamma_t * O_t, Sum_t gamma_t * O_t^2)
+        return np.sum(gamma, axis=0), gamma.T @ observations, gamma.T @ (observations ** 2)
+
+    def reestimate(self, statistics):
+        gamma_sum, gamma_obs_sum, gamma_sq_sum = statistics
+        visited = gamma_sum > epsilon
+        new_means = self.means.copy()
+        new_variances = self.covariances.copy()
+        new_means[visited] = gamma_obs_sum[visited] / gamma_sum[visited, None]
+        new_variances[visited] = gamma_sq_sum[visited] / gamma_sum[visited, None] - new_means[visited] ** 2
+        return DiagonalGaussianEmissions(new_means, new_variances) # The variances get floored there
+
+    def export_arrays(self):
+        return {
+            "means": self.means,
+            "covariances": self.covariances,
+            "precisions": self.precisions,
+            "scaled_means": self.scaled_means,
+            "log_norms": self.log_norms,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        emissions = cls.__new__(cls)
+        for name in ("means", "covariances", "precisions", "scaled_means", "log_norms"):
+            setattr(emissions, name, arrays[name])
+        emissions.N, emissions.D = emissions.means.shape
+        return emissions
+
+
+class TiedGaussianEmissions:
+    # One gaussian per state, all with the same full covariance - a single whitening of the frames then
+    # maha_j(o) = ||o W - m_j W||^2 = ||o W||^2 - 2 (o W) . (m_j W) + ||m_j W||^2 so the whole (T, N) table
+    # is one (T, D) @ (D, D) whitening & one (T, D) @ (D, N) product
+    emission_type = "tied"
+
+    def __init__(self, means, covariance):
+        self.means = np.asarray(means, dtype=np.float64)
+        self.covariance = np.asarray(covariance, dtype=np.float64)
+        self.N, self.D = self.means.shape
+        self.covariances = np.broadcast_to(self.covariance, (self.N, self.D, self.D)) # Per state view, no copies
+
+        self.cholesky, self.whitener, self.log_det, null_space = _factorize_covariance(self.covariance)
+        rank = self.D
+        self.null_space = null_space
+        if null_space is not None:
+            rank -= null_space[0].shape[1]
+        self.white_means = self.means @ self.whitener
+        self.log_norms = -0.5 * (rank * LOG_2PI + self.log_det + np.sum(self.white_means ** 2, axis=1))
+
+    @classmethod
+    def from_untied(cls, means, covariances):
+        # Ties the per state covariances to their average
+        return cls(means, np.mean(np.asarray(covariances, dtype=np.float64), axis=0))
+
+    def log_likelihood(self, observations, states=None):
+        # Returns the (T, N) table of log N(o_t; mean_j, cov), or (T, len(states)) for some states
+        observations = np.asarray(observations, dtype=np.float64)
+        white_means, log_norms = (self.white_means, self.log_norms) if states is None else (self.white_means[states], self.log_norms[states])
+
+        whitened = observations @ self.whitener
+        log_likelihood = log_norms + whitened @ white_means.T - 0.5 * np.sum(whitened ** 2, axis=1)[:, None]
+
+        if self.null_space is not None:
+            basis, tolerance = self.null_space
+            means = self.means if states is None else self.means[states]
+            residual = np.linalg.norm((observations @ basis)[:, None, :] - (means @ basis)[None, :, :], axis=-1)
+            log_likelihood[residual >= tolerance] = -np.inf
+        return log_likelihood
+
+    def accumulate(self, observations, gamma):
+        # (Sum_t gamma_t, Sum_t gamma_t * O_t, Sum_t (Sum_j gamma_t(j)) * O_t O_t^T) - the outer products are pooled
+        # over the states so they're a single (D, D) sum
+        gamma_sum = np.sum(gamma, axis=0)
+        gamma_obs_sum = gamma.T @ observations
+        frame_weights = np.sum(gamma, axis=1)
+        pooled_outer_sum = (observations * frame_weights[:, None]).T @ observations
+        return gamma_sum, gamma_obs_sum, pooled_outer_sum
+
+    def reestimate(self, statistics):
+        # Pooled M-step - cov = (Sum O O^T - Sum_j n_j mean_j mean_j^T) / Sum_j n_j
+        gamma_sum, gamma_obs_sum, pooled_outer_sum = statistics
+        visited = gamma_sum > epsilon
+        new_means = self.means.copy()
+        new_means[visited] = gamma_obs_sum[visited] / gamma_sum[visited, None]
+
+        total = np.sum(gamma_sum)
+        if total <= epsilon:
+            return TiedGaussianEmissions(new_means, self.covariance)
+        between = (new_means * gamma_sum[:, None]).T @ new_means
+        new_covariance = (pooled_outer_sum - between) / total + np.identity(self.D) * epsilon
+        return TiedGaussianEmissions(new_means, new_covariance)
+
+    def export_arrays(self):
+        basis, tolerance = self.null_space if self.null_space is not None else (np.zeros((self.D, 0)), 0.0)
+        return {
+            "means": self.means,
+            "covariance": self.covariance,
+            "whitener": self.whitener,
+            "white_means": self.white_means,
+            "log_norms": self.log_norms,
+            "null_space_basis": basis,
+            "null_space_tolerance": np.array([tolerance]),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        emissions = cls.__new__(cls)
+        for name in ("means", "covariance", "whitener", "white_means", "log_norms"):
+            setattr(emissions, name, arrays[name])
+        emissions.N, emissions.D = emissions.means.shape
+        emissions.covariances = np.broadcast_to(emissions.covariance, (emissions.N, emissions.D, emissions.D))
+        basis = arrays["null_space_basis"]
+        emissions.null_space = (basis, arrays["null_space_tolerance"][0]) if basis.shape[1] > 0 else None
+        return emissions
+
+
+class GaussianMixtureEmissions:
+    # Mixture of K gaussians per state - weights (N, K), means (N, K, D) & covariances (N, K, D) diagonal
+    # or (N, K, D, D) full. The K * N components are one flat gaussian model (component k of state j is k * N + j)
+    # so a whole sequence is a single batched (T, K, N) evaluation & a single logsumexp over the K axis
+    def __init__(self, weights, means, covariances, covariance_type="diag"):
+        if covariance_type not in ("diag", "full"):
+            raise ValueError(f"unknown mixture covariance type '{covariance_type}', expected 'diag' or 'full'")
+        self.covariance_type = covariance_type
+        self.emission_type = "gmm_" + covariance_type
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.log_weights = np.log(np.maximum(self.weights, epsilon))
+        self.means = np.asarray(means, dtype=np.float64)
+        self.N, self.K, self.D = self.means.shape
+
+        covariances = np.asarray(covariances, dtype=np.float64)
+        component_class = DiagonalGaussianEmissions if covariance_type == "diag" else GaussianEmissions
+        self.components = component_class(self._flatten(self.means), self._flatten(covariances))
+        self.covariances = self._unflatten(self.components.covariances)
+
+    def _flatten(self, per_state):
+        # (N, K, ...) -> (K * N, ...) in the component order
+        return np.swapaxes(per_state, 0, 1).reshape((self.K * self.N,) + per_state.shape[2:])
+
+    def _unflatten(self, flat):
+        # (K * N, ...) -> (N, K, ...)
+        return np.swapaxes(flat.reshape((self.K, self.N) + flat.shape[1:]), 0, 1)
+
+    @classmethod
+    def from_single(cls, means, covariances, num_components, covariance_type="diag"):
+        # Mixture splitting - each single gaussian becomes K equally weighted components whose means are
+        # spread along the standard deviations, the covariances start as copies
+        means = np.asarray(means, dtype=np.float64)
+        covariances = np.asarray(covariances, dtype=np.float64)
+        variances = np.diagonal(covariances, axis1=-2, axis2=-1) if covariances.ndim == 3 else covariances
+        offsets = (np.arange(num_components) - (num_components - 1) / 2) * 0.2 # In standard deviations
+        mixture_means = means[:, None, :] + offsets[None, :, None] * np.sqrt(variances)[:, None, :]
+
+        if covariance_type == "diag":
+            mixture_covariances = np.repeat(variances[:, None, :], num_components, axis=1)
+        else:
+            full = covariances if covariances.ndim == 3 else np.einsum('nd,de->nde', variances, np.identity(means.shape[1]))
+            mixture_covariances = np.repeat(full[:, None], num_components, axis=1)
+        weights = np.full((means.shape[0], num_components), 1.0 / num_components)
+        return cls(weights, mixture_means, mixture_covariances, covariance_type)
+
+    def component_log_likelihood(self, observations, states=None):
+        # (T, K, N) table of log w_jk + log N(o_t; mean_jk, cov_jk), or (T, K, len(states)) for some states
+        if states is None:
+            components, log_weights = None, self.log_weights.T
+        else:
+            states = np.asarray(states)
+            components, log_weights = (np.arange(self.K)[:, None] * self.N + states).ravel(), self.log_weights[states].T
+        table = self.components.log_likelihood(observations, components)
+        return table.reshape(table.shape[0], self.K, -1) + log_weights
+
+    def log_likelihood(self, observations, states=None):
+        # Returns the (T, N) table of log Sum_k w_jk N(o_t; mean_jk, cov_jk), or (T, len(states)) for some states
+        return _logsumexp_components(self.component_log_likelihood(observations, states))
+
+    def accumulate(self, observations, gamma):
+        # The state posteriors split over the components - r_tkj = gamma_tj * w_jk N_jk(o_t) / b_j(o_t)
+        # (Sum_t r_t, Sum_t r_t * O_t, Sum_t r_t * O_t^2 or Sum_t r_t * O_t O_t^T) in the flat component order
+        observations = np.asarray(observations, dtype=np.float64)
+        component_table = self.component_log_likelihood(observations)
+        log_b = _logsumexp_components(component_table)[:, None, :]
+        with np.errstate(invalid="ignore"): # -inf - -inf for frames a state can't emit
+            responsibilities = np.exp(component_table - log_b)
+        responsibilities = np.nan_to_num(responsibilities) * gamma[:, None, :]
+        flat = responsibilities.reshape(len(observations), self.K * self.N)
+
+        r_sum = np.sum(flat, axis=0)
+        r_obs_sum = flat.T @ observations
+        if self.covariance_type == "diag":
+            r_second_sum = flat.T @ (observations ** 2)
+        else:
+            r_second_sum = np.einsum('tc,td,te->cde', flat, observations, observations, optimize=True)
+        return r_sum, r_obs_sum, r_second_sum
+
+    def reestimate(self, statistics):
+        r_sum, r_obs_sum, r_second_sum = statistics
+        visited = r_sum > epsilon
+        flat_means = self.components.means.copy()
+        flat_covariances = self.components.covariances.copy()
+
+        flat_means[visited] = r_obs_sum[visited] / r_sum[visited, None]
+        if self.covariance_type == "diag":
+            flat_covariances[visited] = r_second_sum[visited] / r_sum[visited, None] - flat_means[visited] ** 2
+        else:
+            flat_covariances[visited] = (r_second_sum[visited] / r_sum[visited, None, None]
+                                         - np.einsum('cd,ce->cde', flat_means[visited], flat_means[visited])
+                                         + np.identity(self.D) * epsilon)
+
+        # Weights - the share of each component in its state's expected visits
+        component_sums = r_sum.reshape(self.K, self.N).T # (N, K)
+        state_sums = component_sums.sum(axis=1, keepdims=True)
+        visited_states = state_sums[:, 0] > epsilon
+        new_weights = self.weights.copy()
+        new_weights[visited_states] = np.maximum(component_sums[visited_states] / state_sums[visited_states], MIN_WEIGHT)
+        new_weights /= new_weights.sum(axis=1, keepdims=True)
+
+        return GaussianMixtureEmissions(new_weights, self._unflatten(flat_means), self._unflatten(flat_covariances),
+                                        self.covariance_type)
+
+    def export_arrays(self):
+        arrays = {"weights": self.weights, "log_weights": self.log_weights}
+        for name, array in self.components.export_arrays().items():
+            arrays["component_" + name] = array
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, covariance_type):
+        emissions = cls.__new__(cls)
+        emissions.covariance_type = covariance_type
+        emissions.emission_type = "gmm_" + covariance_type
+        emissions.weights = arrays["weights"]
+        emissions.log_weights = arrays["log_weights"]
+        component_arrays = {name[len("component_"):]: array for name, array in arrays.items() if name.startswith("component_")}
+        component_class = DiagonalGaussianEmissions if covariance_type == "diag" else GaussianEmissions
+        emissions.components = component_class.from_arrays(component_arrays)
+        emissions.N, emissions.K = emissions.weights.shape
+        emissions.D = emissions.components.D
+        emissions.means = emissions._unflatten(emissions.components.means)
+        emissions.covariances = emissions._unflatten(emissions.components.covariances)
+        return emissions
+
+
+def make_emissions(emission_type, means, covariances, num_components=1):
+    # Emission model of a type from one gaussian per state - means (N, D) & covariances (N, D, D)
+    # The mixtures start from the single gaussians split to num_components (see GaussianMixtureEmissions.from_single)
+    if emission_type == "full":
+        return GaussianEmissions(means, covariances)
+    if emission_type == "diag":
+        return DiagonalGaussianEmissions(means, covariances)
+    if emission_type == "tied":
+        return TiedGaussianEmissions.from_untied(means, covariances)
+    if emission_type in ("gmm_diag", "gmm_full"):
+        return GaussianMixtureEmissions.from_single(means, covariances, num_components, emission_type[len("gmm_"):])
+    raise ValueError(f"unknown emission type '{emission_type}', expected one of {EMISSION_TYPES}")
+
+def emissions_from_arrays(emission_type, arrays):
+    # Inverse of export_arrays for any emission type
+    if emission_type == "full":
+        return GaussianEmissions.from_arrays(arrays)
+    if emission_type == "diag":
+        return DiagonalGaussianEmissions.from_arrays(arrays)
+    if emission_type == "tied":
+        return TiedGaussianEmissions.from_arrays(arrays)
+    if emission_type in ("gmm_diag", "gmm_full"):
+        return GaussianMixtureEmissions.from_arrays(arrays, emission_type[len("gmm_"):])
+    raise ValueError(f"unknown emission type '{emission_type}', expected one of {EMISSION_TYPES}")
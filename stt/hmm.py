@@ -1,47 +1,160 @@
 import numpy as np
-from scipy.stats import multivariate_normal
+from concurrent.futures import ProcessPoolExecutor
 from scipy.special import logsumexp
+from emissions import make_emissions, emissions_from_arrays, TiedGaussianEmissions
+from topology import SparseTransitions
 
 epsilon = 1e-10
 LOG_ZERO = -np.inf # for paths transitions that not possible
 
+# "log" - the log domain alpha & beta tables, "scaled" - linear domain with per frame scaling (Rabiner)
+FORWARD_BACKWARD_MODES = ("log", "scaled")
+
+XI_BLOCK_SIZE = 256 # Time steps handled together when summing xi
+
+BEAM_WIDTH = 10.0 # Default log prob beam of viterbi_decode_beam
+
+def _backpointer_dtype(num_states):
+    # Smallest int type that can hold a state index - int8 is enough for the 40 phonemes
+    for dtype in (np.int8, np.int16, np.int32):
+        if num_states <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.int64
+
+def _backtrack(backpointers, last_state):
+    # Follows the backpointers from the last state at T-1 back to t0 into a preallocated array
+    T = backpointers.shape[0]
+    best_path = np.empty(T, dtype=np.intp)
+    best_path[T - 1] = last_state
+
+    # Loop in reverse from the state before last one from T-1 to t1
+    for t in range(T - 1, 0, -1):
+        best_path[t - 1] = backpointers[t, best_path[t]]
+
+    return best_path
+
+def _entry_states(index_map, num_states):
+    # States that start a phoneme - the first of each run of sub states with the same phoneme
+    # (every state in the one state per phoneme model)
+    phonemes = [index_map[i] for i in range(num_states)]
+    return np.array([i == 0 or phonemes[i] != phonemes[i - 1] for i in range(num_states)])
+
+def _sequence_statistics_worker(args):
+    # Runs in a worker process of the parallel E-step
+    hmm, observation_sequences = args
+    return [hmm._sequence_statistics(observations) for observations in observation_sequences]
+
 class HMM:
-    def __init__(self, params):
+    def __init__(self, params, forward_backward_mode="log"):
+        if forward_backward_mode not in FORWARD_BACKWARD_MODES:
+            raise ValueError(f"unknown forward backward mode '{forward_backward_mode}', expected one of {FORWARD_BACKWARD_MODES}")
+        self.forward_backward_mode = forward_backward_mode
+
         self.N = params["num_states"]
         self.mfcc_dim = params["mfcc_dim"]
         self.states_map = params["state_map"]
         self.index_map = params["index_map"]
+        self.entry_states = _entry_states(self.index_map, self.N)
 
         # Storing the params in longs for to avoid underflow when mul small values
         self.log_pi = np.log(params["initial_probs"] + epsilon)
-        self.log_A = np.log(params["transition_matrix"] + epsilon)
-
-        # Building emission model objects for each state
-        self.emission_models = []
-        for i in range(self.N):
-            mean_i = params["emission_means"][i]
-            cov_i = params["emission_covariances"][i]
-
-            model_i = multivariate_normal(mean=mean_i, cov=cov_i, allow_singular=True) # add check for singular matrixes cuz it can be computed
-            self.emission_models.append(model_i)
-
-        print(f"Initialized HMM with {len(self.emission_models)} emission models")
-    
-    def _log_emission_prob(self, observation_vector, state_index):
-        try:
-            log_pdf = self.emission_models[state_index].logpdf(observation_vector)
-            if not np.isfinite(log_pdf):
-                return LOG_ZERO
-            return log_pdf
-        except Exception as e:
-            return LOG_ZERO
-
-    def _calculate_alpha(self, observations):
+        # Dense NxN matrix, or only the possible transitions for the multi state topologies
+        # ("transitions" - (sources, destinations, probs), see phonemes.expand_to_left_to_right)
+        if "transitions" in params:
+            sources, destinations, probs = params["transitions"]
+            self.transitions = SparseTransitions(self.N, sources, destinations, np.log(np.asarray(probs) + epsilon))
+            self.log_A = None
+        else:
+            self.transitions = None
+            self.log_A = np.log(params["transition_matrix"] + epsilon)
+
+        # Building the emission model for all states - factorizes every covariance once
+        # "full", "diag", "tied", "gmm_diag" or "gmm_full" (see emissions.EMISSION_TYPES) - the mixtures start
+        # from the single gaussian params split to num_components
+        self.emissions = make_emissions(params.get("emission_type", "full"), params["emission_means"],
+                                        params["emission_covariances"], params.get("num_components", 1))
+        self.emission_means = self.emissions.means
+        self.emission_covariances = self.emissions.covariances
+
+        print(f"Initialized HMM with {self.emissions.N} emission models")
+
+    def export_meta(self):
+        # The non array part of the model
+        return {
+            "num_states": self.N,
+            "mfcc_dim": self.mfcc_dim,
+            "state_map": self.states_map,
+            "index_map": self.index_map,
+            "emission_type": self.emissions.emission_type,
+        }
+
+    def export_arrays(self):
+        # The decode ready arrays - log probs & the precomputed emission model
+        arrays = {"log_pi": self.log_pi}
+        if self.transitions is None:
+            arrays["log_A"] = self.log_A
+        else:
+            arrays["transition_sources"] = self.transitions.sources
+            arrays["transition_destinations"] = self.transitions.destinations
+            arrays["transition_log_probs"] = self.transitions.log_probs
+        for name, array in self.emissions.export_arrays().items():
+            arrays["emission_" + name] = array
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, meta, arrays, forward_backward_mode="log"):
+        # Builds a model from export_meta & export_arrays without recomputing anything
+        # The arrays are used as is so they can be views of shared or memory mapped data
+        hmm = cls.__new__(cls)
+        hmm.forward_backward_mode = forward_backward_mode
+        hmm.N = meta["num_states"]
+        hmm.mfcc_dim = meta["mfcc_dim"]
+        hmm.states_map = meta["state_map"]
+        hmm.index_map = meta["index_map"]
+        hmm.entry_states = _entry_states(hmm.index_map, hmm.N)
+
+        hmm.log_pi = arrays["log_pi"]
+        if "log_A" in arrays:
+            hmm.transitions = None
+            hmm.log_A = arrays["log_A"]
+        else:
+            hmm.transitions = SparseTransitions(hmm.N, arrays["transition_sources"], arrays["transition_destinations"],
+                                                arrays["transition_log_probs"])
+            hmm.log_A = None
+
+        emission_arrays = {name[len("emission_"):]: array for name, array in arrays.items() if name.startswith("emission_")}
+        hmm.emissions = emissions_from_arrays(meta.get("emission_type", "full"), emission_arrays)
+        hmm.emission_means = hmm.emissions.means
+        hmm.emission_covariances = hmm.emissions.covariances
+        return hmm
+
+    def _log_emission_matrix(self, observations):
+        # Log emission prob of every observation for every state - (T, N) table
+        # Computed once per sequence and shared by viterbi, alpha, beta & xi
+        log_B = self.emissions.log_likelihood(observations)
+        log_B[~np.isfinite(log_B)] = LOG_ZERO
+        return log_B
+
+    def _best_predecessors(self, paths_probs):
+        # Viterbi step for (N,) or (B, N) path probs of the last frame
+        # Returns the best previous state & the best path prob into every state (before its emission)
+        if self.transitions is not None:
+            return self.transitions.best_predecessors(paths_probs)
+        prev_paths_probs = paths_probs[..., :, None] + self.log_A # [.., i, j] is i -> j
+        best_prev_states = np.argmax(prev_paths_probs, axis=-2)
+        if paths_probs.ndim == 1: # Fancy indexing is faster than take_along_axis for a single sequence
+            return best_prev_states, prev_paths_probs[best_prev_states, np.arange(self.N)]
+        best_paths_probs = np.take_along_axis(prev_paths_probs, best_prev_states[..., None, :], axis=-2)[..., 0, :]
+        return best_prev_states, best_paths_probs
+
+    def _calculate_alpha(self, observations, log_B=None):
         T = observations.shape[0]
         if T == 0:
             return None # return if no observations
 
         N = self.N
+        if log_B is None:
+            log_B = self._log_emission_matrix(observations)
 
 
         # 1. Create the alpha table
@@ -50,15 +163,22 @@ class HMM:
 
         # 2. Initialization - the likelihood for all states at t=0
         for j in range(N):
-            log_B_j_O0 = self._log_emission_prob(observations[0], j)
+            log_B_j_O0 = log_B[0, j]
             if log_B_j_O0 > LOG_ZERO:
                 alpha_table[0, j] = self.log_pi[j] + log_B_j_O0
 
 
         # 3. Induction from t1 to T-1
+        if self.transitions is not None:
+            # Sparse topology - one pass over the possible transitions per time step
+            for t in range(1, T):
+                possible = log_B[t] > LOG_ZERO
+                alpha_table[t, possible] = self.transitions.log_forward(alpha_table[t - 1])[possible] + log_B[t, possible]
+            return alpha_table
+
         for t in range(1, T): # For each subsequent time step
             for j in range(N): # For each current state j
-                log_B_j_Ot = self._log_emission_prob(observations[t], j)
+                log_B_j_Ot = log_B[t, j]
 
                 if log_B_j_Ot > LOG_ZERO: # Only if emission is possible for this state
                     # Calculate for all N states, the P of transitioning to j & the P of them being the state in qt-1 given the obs sequence
@@ -73,12 +193,14 @@ class HMM:
 
         return alpha_table # Return the completed alpha table
 
-    def _calculate_beta(self, observations):
+    def _calculate_beta(self, observations, log_B=None):
         T = observations.shape[0]
         if T == 0:
             return None
 
         N = self.N
+        if log_B is None:
+            log_B = self._log_emission_matrix(observations)
 
 
         # 1. Create beta table
@@ -91,10 +213,16 @@ class HMM:
 
 
         # 3. Induction from T-2 to 0
+        if self.transitions is not None:
+            # Sparse topology - one pass over the possible transitions per time step
+            for t in range(T - 2, -1, -1):
+                beta_table[t] = self.transitions.log_backward(log_B[t + 1] + beta_table[t + 1])
+            return beta_table
+
         for t in range(T - 2, -1, -1): # Iterate backwards through time from T-2
+            # All emissions probs for being at state j at t+1 when seeing Ot+1
+            log_B_all_j_Ot1 = log_B[t + 1]
             for i in range(N): # For each state i at qt
-                # Calculate for all emissions probs for being at state j at t+1 when seeing Ot+1
-                log_B_all_j_Ot1 = np.array([self._log_emission_prob(observations[t+1], j) for j in range(N)])
 
                 # For all reachable states from current state i & they emission prob possible 
                 valid_next_steps = (beta_table[t+1, :] > LOG_ZERO) & (log_B_all_j_Ot1 > LOG_ZERO)
@@ -110,6 +238,88 @@ class HMM:
 
         return beta_table # Return the completed beta table
 
+    def _calculate_scaled_alpha_beta(self, observations, log_B=None):
+        # Scaled forward backward in the linear domain - each time step is a single matrix vector product
+        # alpha_hat[t] = alpha[t] / (c_0 * ... * c_t), beta_hat[t] = beta[t] / (c_t+1 * ... * c_T-1)
+        # Returns alpha_hat, beta_hat and log(c_t) so that log P(O|lambda) = sum of log(c_t)
+        T = observations.shape[0]
+        if T == 0:
+            return None
+
+        N = self.N
+        if log_B is None:
+            log_B = self._log_emission_matrix(observations)
+
+
+        # 1. Emissions & transitions back to probs
+        # Each frame is shifted by its max emission so exp doesnt underflow - the shift is added back to the scales
+        frame_max = np.max(log_B, axis=1)
+        if not np.all(np.isfinite(frame_max)):
+            return None # A frame no state can emit - the sequence is imposable
+        B = np.exp(log_B - frame_max[:, None])
+        if self.transitions is None:
+            A = np.exp(self.log_A)
+            A_T = A.T
+        else: # scipy CSR - the products below only touch the possible transitions
+            A = self.transitions.probs
+            A_T = self.transitions.probs_T
+        pi = np.exp(self.log_pi)
+
+        alpha_hat = np.empty((T, N))
+        beta_hat = np.empty((T, N))
+        scales = np.empty(T)
+
+
+        # 2. Forward pass - normalize each alpha row to sum to 1 & keep the normalizer
+        alpha_t = pi * B[0]
+        for t in range(T):
+            if t > 0:
+                alpha_t = (A_T @ alpha_hat[t - 1]) * B[t]
+            scales[t] = np.sum(alpha_t)
+            if scales[t] <= 0.0:
+                return None # No path can reach this frame
+            alpha_hat[t] = alpha_t / scales[t]
+
+
+        # 3. Backward pass - scaled with the same normalizers as alpha
+        beta_hat[T - 1] = 1.0
+        for t in range(T - 2, -1, -1):
+            beta_hat[t] = (A @ (B[t + 1] * beta_hat[t + 1])) / scales[t + 1]
+
+        log_scales = np.log(scales) + frame_max
+        return alpha_hat, beta_hat, log_scales
+
+    def forward_backward(self, observations, log_B=None, mode=None):
+        # Returns log_alpha, log_beta tables & log P(O|lambda) using the selected mode
+        # Both modes give the same log tables so everything after them stays the same
+        mode = mode or self.forward_backward_mode
+        if log_B is None:
+            log_B = self._log_emission_matrix(observations)
+
+        if mode == "log":
+            log_alpha = self._calculate_alpha(observations, log_B)
+            if log_alpha is None:
+                return None, None, LOG_ZERO
+            log_beta = self._calculate_beta(observations, log_B)
+            return log_alpha, log_beta, self._calculate_log_O(log_alpha)
+
+        if mode != "scaled":
+            raise ValueError(f"unknown forward backward mode '{mode}', expected one of {FORWARD_BACKWARD_MODES}")
+
+        scaled = self._calculate_scaled_alpha_beta(observations, log_B)
+        if scaled is None:
+            return None, None, LOG_ZERO
+        alpha_hat, beta_hat, log_scales = scaled
+
+        # Undo the scaling - alpha gets the scales up to t, beta the scales after t
+        cumulative_log_scales = np.cumsum(log_scales)
+        log_prob_O = cumulative_log_scales[-1]
+        with np.errstate(divide="ignore"): # log(0) -> -inf for imposable states
+            log_alpha = np.log(alpha_hat) + cumulative_log_scales[:, None]
+            log_beta = np.log(beta_hat) + (log_prob_O - cumulative_log_scales)[:, None]
+
+        return log_alpha, log_beta, log_prob_O
+
     def _calculate_log_O(self, log_alpha):
         # Helper function to get log P(O|lambda) from the alpha table
 
@@ -157,17 +367,16 @@ class HMM:
 
         # Second Numerical Normalization
         # Makes sure sum over states is exactly 0 for each time step
-        for t in range(T):
-            current_log_sum = logsumexp(log_gamma[t, :])
-            if np.isfinite(current_log_sum): # Make sure not to subtract -inf
-                log_gamma[t, :] -= current_log_sum
+        current_log_sums = logsumexp(log_gamma, axis=1)
+        finite_rows = np.isfinite(current_log_sums) # Make sure not to subtract -inf
+        log_gamma[finite_rows] -= current_log_sums[finite_rows, None]
 
         return log_gamma
 
-        # Inside HMM class in hmm_model.py
-
-    def _calculate_xi(self, observations, log_alpha, log_beta, log_prob_O):
-        #check the tables exist and have valid data
+    def _calculate_xi_sum(self, log_alpha, log_beta, log_prob_O, log_B):
+        # Log of the expected transitions counts Sum_t xi_t(i,j) for t from 0 to T-2
+        # Accumulated straight into an NxN table, one block of time steps at a time
+        # so the memory doesnt grow with the sequence length like a full (T-1, N, N) xi table
         if log_alpha is None or log_beta is None or log_prob_O <= LOG_ZERO:
             print("Xi Error: Invalid alpha, beta, or sequence probability.")
             return None
@@ -178,55 +387,103 @@ class HMM:
              print("Xi Warning: Cannot calculate Xi for sequence length <= 1.")
              return None
 
-
-        # 1. Initialize log Xi table with log(0)
-        # Save the probability of transitining from each state NxN, at each time step at t - xT
-        log_xi = np.full((T - 1, N, N), LOG_ZERO)
-
-
-        # 2. Pre-calculate all emission probabilities
-        # Will create a T-1xN table
-        # Other wise for each state j at time t, we will need to calculate the same emisson for each state i- N times
-        log_next_emission_probs = np.array([
-            [self._log_emission_prob(observations[t + 1], j) for j in range(N)]
-            for t in range(T - 1)
-        ]) 
-
-
-        # 3. Calculate Xi for each time step t from 0 to T-2
-        for t in range(T - 1): # For each time t
-            for i in range(N): # From state i at time t
-                # Get the first component for the xi calculation
-                log_alpha_t_i = log_alpha[t, i]
-                if log_alpha_t_i <= LOG_ZERO:
-                    continue # Skip if the path to i at t is imposable
-
-                for j in range(N): # For each transitioning state j for i
-                    # Get the rest of the needed components for the xi calculation
-                    log_A_ij = self.log_A[i, j] # The prob of transitioning fro state i to j
-                    log_B_j_Ot1 = log_next_emission_probs[t, j] # The prob of seeing state j at Ot
-                    log_beta_t1_j = log_beta[t+1, j] # The prob of being at state j at t+1 knowing the next obs sequence
-
-                    # Check that each of the proboilities valid for the rest of the components
-                    if log_A_ij > LOG_ZERO and log_B_j_Ot1 > LOG_ZERO and log_beta_t1_j > LOG_ZERO:
-                        # All parts of the path segment have non-zero probability
-
-                        # Calculate the likelihood of xi_t_i_j
-                        log_xi_likelihood = log_alpha_t_i + log_A_ij + log_B_j_Ot1 + log_beta_t1_j
-
-                        # Normalize by the chance of O being in the model - P(O|lambda)
-                        # To get the final xi probability
-                        log_xi[t, i, j] = log_xi_likelihood - log_prob_O
-
-        return log_xi
-
-        # Inside HMM class in hmm_model.py
-
-    def baum_welch_train(self, observation_sequences, max_iterations=10, convergence_threshold=1e-4):
+        # xi_t(i,j) = alpha_t(i) * A_ij * B_j(Ot+1) * beta_t+1(j) / P(O|lambda)
+        # So Sum_t xi_t(i,j) = A_ij * Sum_t (alpha_t(i) * [B_j(Ot+1) * beta_t+1(j)]) - a single matrix product for all t
+        # With a sparse topology only the possible transitions are summed - an (E,) vector in CSR order
+        if self.transitions is None:
+            A = np.exp(self.log_A)
+            xi_sum = np.zeros((N, N))
+        else:
+            A = np.exp(self.transitions.log_probs)
+            sources, destinations = self.transitions.sources, self.transitions.destinations
+            xi_sum = np.zeros(self.transitions.num_transitions)
+
+        for start in range(0, T - 1, XI_BLOCK_SIZE):
+            end = min(start + XI_BLOCK_SIZE, T - 1)
+
+            # 1. The part from the past & the part from the future of each transition in the block
+            log_past = log_alpha[start:end]
+            log_future = log_B[start + 1:end + 1] + log_beta[start + 1:end + 1]
+
+            # 2. Back to probs - each time step is shifted by its max & the shifts moved into one weight per step
+            past_max = np.max(log_past, axis=1)
+            future_max = np.max(log_future, axis=1)
+            possible = np.isfinite(past_max) & np.isfinite(future_max) # Skip steps without any possible transition
+            if not np.any(possible):
+                continue
+            past = np.exp(log_past[possible] - past_max[possible, None])
+            future = np.exp(log_future[possible] - future_max[possible, None])
+            weights = np.exp(past_max[possible] + future_max[possible] - log_prob_O)
+
+            # 3. Add the block - Sum_t weight_t * outer(past_t, future_t)
+            if self.transitions is None:
+                xi_sum += (past * weights[:, None]).T @ future
+            else:
+                xi_sum += np.einsum('te,te->e', (past * weights[:, None])[:, sources], future[:, destinations])
+
+        with np.errstate(divide="ignore"): # Transitions that never happen are log(0) = -inf
+            return np.log(xi_sum * A)
+
+    def _sequence_statistics(self, observations):
+        # The E-step sufficient statistics of a single sequence, None if it can't be used for training
+        # (log P(O), log gamma_0, log Sum_t gamma_t up to T-2, log Sum_t xi_t, emission statistics)
+        # The emission statistics depend on the emission type - see accumulate of the emission models
+        # Make sure we are working with a valid obs sequence
+        T = observations.shape[0]
+        if T <= 1: return None # Skip short sequences
+
+        # 1. Calculate necessary all components for this sequence
+        log_B = self._log_emission_matrix(observations) # Emissions computed once for all the components
+        log_alpha, log_beta, log_prob_O = self.forward_backward(observations, log_B)
+        if log_alpha is None or log_beta is None: return None
+        if log_prob_O <= LOG_ZERO: return None
+        log_gamma = self._calculate_gamma(log_alpha, log_beta)
+        if log_gamma is None: return None
+        log_sum_xi = self._calculate_xi_sum(log_alpha, log_beta, log_prob_O, log_B) # Sum xi over all time steps t=0 to T-2
+        if log_sum_xi is None: return None
+
+        # 2. A components - sum gamma up to T-2 for transitions
+        log_sum_gamma = logsumexp(log_gamma[:-1], axis=0)
+
+        # 3. B components
+        # Convert the gamma log back to expo for use with mfcc calculations
+        gamma = np.exp(log_gamma)
+        emission_statistics = self.emissions.accumulate(observations, gamma)
+
+        return log_prob_O, log_gamma[0], log_sum_gamma, log_sum_xi, emission_statistics
+
+    def _reestimate_sparse_transitions(self, acc_log_xi_sum, acc_log_gamma_sum):
+        # M-step of the sparse transitions - same as the dense one for every stored transition i -> j
+        sources = self.transitions.sources
+        possible = (acc_log_gamma_sum[sources] > LOG_ZERO) & (acc_log_xi_sum > LOG_ZERO)
+        new_log_probs = np.full(self.transitions.num_transitions, LOG_ZERO)
+        new_log_probs[possible] = acc_log_xi_sum[possible] - acc_log_gamma_sum[sources[possible]]
+        return self.transitions.with_log_probs(self.transitions.log_normalize(new_log_probs))
+
+    def tie_covariances(self):
+        # Switches a single gaussian per state model to one covariance shared by all the states (their average)
+        emission_type = self.emissions.emission_type
+        if emission_type == "tied":
+            return
+        if emission_type not in ("full", "diag"):
+            raise ValueError(f"can't tie the covariances of '{emission_type}' emissions, only 'full' or 'diag'")
+        covariances = self.emissions.covariances
+        if emission_type == "diag":
+            covariances = np.einsum('nd,de->nde', covariances, np.identity(self.emissions.D))
+        self.emissions = TiedGaussianEmissions.from_untied(self.emissions.means, covariances)
+        self.emission_means = self.emissions.means
+        self.emission_covariances = self.emissions.covariances
+
+    def baum_welch_train(self, observation_sequences, max_iterations=10, convergence_threshold=1e-4, num_workers=1,
+                         tie_covariances=False):
+        # tie_covariances - trains one covariance shared by all the states (pooled M-step), see tie_covariances
         if not observation_sequences:
             print("Training Error: No observation sequences provided.")
             return []
 
+        if tie_covariances:
+            self.tie_covariances()
+
         N = self.N
         # Get D from the first sequence
         if len(observation_sequences[0]) > 0:
@@ -239,262 +496,449 @@ class HMM:
         log_likelihoods_history = []
         prev_total_log_likelihood = -np.inf # Initialize for convergence check
 
+        # Parallel E-step - the sequences are split to chunks that the worker processes handle independently
+        pool = None
+        if num_workers > 1 and len(observation_sequences) > 1:
+            num_chunks = min(len(observation_sequences), num_workers * 4)
+            chunk_size = -(-len(observation_sequences) // num_chunks) # ceil
+            chunks = [observation_sequences[k:k + chunk_size] for k in range(0, len(observation_sequences), chunk_size)]
+            pool = ProcessPoolExecutor(max_workers=num_workers)
+            print(f"Running the E-step on {num_workers} worker processes ({len(chunks)} chunks)")
+
         
-        for iteration in range(max_iterations):
-            print(f"\nBaum-Welch Algorithem, Iteration {iteration + 1}\n")
-
-            # Initialize Accumulators for the M-Step
-            # These will sum expectations across all sequences
-            # For Pi (gamma at t=0)
-            acc_log_pi = np.full(N, LOG_ZERO)
-            # For A (xi and gamma sums)
-            acc_log_xi_sum_t = np.full((N, N), LOG_ZERO)
-            acc_log_gamma_sum_t_A = np.full(N, LOG_ZERO)
-            # For B (gama sums and weighted obs/outer products)
-            acc_gamma_obs_sum = np.zeros((N, D))
-            acc_gamma_sum = np.zeros(N)
-            # Need to store these to re-calculate the cov numerator later
-            all_observations = []
-            all_gammas = [] # Store gamma probs
-
-            current_total_log_likelihood = 0.0
-            num_sequences_processed = 0
-
-
-            # 0. E-Step: Accumulate all needed comonents for the Baum Welch algorithem
-            print("  E-Step: Calculating expectations...")
-            for r, observations in enumerate(observation_sequences):
-                # Make sure we are working with a valid obs sequence
-                T = observations.shape[0]
-                if T <= 1: continue # Skip short sequences
-
-                # 0.1. Calculate necessary all components for this sequence
-                log_alpha = self._calculate_alpha(observations)
-                if log_alpha is None: continue
-                log_prob_O = self._calculate_log_O(log_alpha)
-                if log_prob_O <= LOG_ZERO: continue
-                log_beta = self._calculate_beta(observations)
-                if log_beta is None: continue
-                log_gamma = self._calculate_gamma(log_alpha, log_beta)
-                if log_gamma is None: continue
-                log_xi = self._calculate_xi(observations, log_alpha, log_beta, log_prob_O)
-                if log_xi is None: continue
-
-                # 0.2. Accumulate the likelihoodd
-                current_total_log_likelihood += log_prob_O
-                num_sequences_processed += 1
-
-                # Accumulate Pi
-                acc_log_pi = np.logaddexp(acc_log_pi, log_gamma[0, :])
-
-                # Accumulate A components - (log sums of xi and gamma)
-                # Sum gamma up to T-2 for transitions
-                log_sum_gamma_r = np.array([logsumexp(log_gamma[:-1, i]) for i in range(N)])
-                # Sum xi over all time steps t=0 to T-2
-                log_sum_xi_r = np.array([[logsumexp(log_xi[:, i, j]) for j in range(N)] for i in range(N)])
-
-                # Combine with overall accumulators using logsumexp
-                acc_log_gamma_sum_t_A = np.logaddexp(acc_log_gamma_sum_t_A, log_sum_gamma_r)
-                acc_log_xi_sum_t = np.logaddexp(acc_log_xi_sum_t, log_sum_xi_r)
-
-                # Accumulate B components
-                # Convert the gamma log back to expo for use with mfcc calculations
-                gamma = np.exp(log_gamma)
-                # Denominator Sum_t gamma_t(j)
-                acc_gamma_sum += np.sum(gamma, axis=0) 
-                # Numerator Sum_t (gamma_t(j) * O_t)
-                # The weighted sum of seeing state j at ot by the expected j num
-                for j in range(N):
-                    acc_gamma_obs_sum[j, :] += np.einsum('t,td->d', gamma[:, j], observations) 
-
-                # 0.3. Store individually for B calculation
-                all_observations.append(observations)
-                all_gammas.append(gamma)
-
-
-            # 1. M-Step: Re-estimate parameters using accumulated expectations
-            print("  M-Step: Re-estimating parameters...")
-            # Initialize the new parameters
-            new_log_pi = np.full(N, LOG_ZERO)
-            new_log_A = np.full((N, N), LOG_ZERO)
-            new_emission_means = np.zeros((N, D))
-            new_emission_covariances = np.zeros((N, D, D))
-
-
-            # 1.1. Re-estimate Pi
-            log_total_pi = logsumexp(acc_log_pi) # Each pi sum should add up to 1 so we'll get the number of added pis to normalize with
-            if log_total_pi > LOG_ZERO:
-                new_log_pi = acc_log_pi - log_total_pi
-            else: # Keep old if no starts observed from all sequences
-                new_log_pi = self.log_pi
-
-
-            # 1.2. Re-estimate A
-            # log A_ij = accumulated log( Sum_t xi_t(i,j) ) - accumulated log( Sum_t gamma_t(i) )
-            for i in range(N):
-                # the total expected transitions from state i (accumulated)
-                log_sum_gamma_i_total = acc_log_gamma_sum_t_A[i]
-                if log_sum_gamma_i_total > LOG_ZERO: # Only update if there we expected transitions from i
-                    for j in range(N):
-                        # Numerator: Total expected transitions from i to j (accumulated)
-                        log_sum_xi_ij_total = acc_log_xi_sum_t[i, j]
-                        if log_sum_xi_ij_total > LOG_ZERO: # Only update if we expect a transition from i to j ever expected
-                            new_log_A[i, j] = log_sum_xi_ij_total - log_sum_gamma_i_total
-
-                # Re-normalize each row of log_A to make sure transitions from state i sum to 1 (logsumexp=0)
-                row_log_sum = logsumexp(new_log_A[i, :])
-                if np.isfinite(row_log_sum) and row_log_sum > LOG_ZERO:
-                    new_log_A[i, :] -= row_log_sum
-
-            # 1.3 Re-estimate Emissions Means
-            # Update Mean first
-            for j in range(N): # For each state j
-                # Denominator: Total expected number of times in state j (accumulated)
-                sum_gamma_j = acc_gamma_sum[j]
-                # Avoid division by zero if state j was never expected to be visited
-                if sum_gamma_j > epsilon:
-                    # Numerator: Accumulated Sum_r Sum_t ( gamma_t(j) * O_t )
-                    weighted_sum_obs = acc_gamma_obs_sum[j]
-                    # new mean = accumulated weighted sum / accumulated sum of weights
-                    new_emission_means[j] = weighted_sum_obs / sum_gamma_j
+        try: # The worker processes are shut down even when an iteration fails
+            for iteration in range(max_iterations):
+                print(f"\nBaum-Welch Algorithem, Iteration {iteration + 1}\n")
+
+                # Initialize Accumulators for the M-Step
+                # These will sum expectations across all sequences
+                # For Pi (gamma at t=0)
+                acc_log_pi = np.full(N, LOG_ZERO)
+                # For A (xi and gamma sums)
+                acc_log_xi_sum_t = np.full((N, N) if self.transitions is None else self.transitions.num_transitions, LOG_ZERO)
+                acc_log_gamma_sum_t_A = np.full(N, LOG_ZERO)
+                # For B (gama sums and weighted obs/outer products - their shapes depend on the emission type)
+                acc_emission_statistics = None
+
+                current_total_log_likelihood = 0.0
+                num_sequences_processed = 0
+
+
+                # 0. E-Step: Accumulate all needed comonents for the Baum Welch algorithem
+                print("  E-Step: Calculating expectations...")
+                if pool is None:
+                    all_statistics = [self._sequence_statistics(observations) for observations in observation_sequences]
+                else:
+                    # Each worker gets the current model with its chunk of sequences
+                    chunks_statistics = pool.map(_sequence_statistics_worker, [(self, chunk) for chunk in chunks])
+                    all_statistics = [statistics for chunk_statistics in chunks_statistics for statistics in chunk_statistics]
+
+                # Reduce in the sequences order so the parallel result is identical to the serial one
+                for statistics in all_statistics:
+                    if statistics is None: continue # Skipped sequence
+                    log_prob_O, log_gamma_0, log_sum_gamma_r, log_sum_xi_r, emission_statistics = statistics
+
+                    # 0.1. Accumulate the likelihoodd
+                    current_total_log_likelihood += log_prob_O
+                    num_sequences_processed += 1
+
+                    # 0.2. Accumulate Pi
+                    acc_log_pi = np.logaddexp(acc_log_pi, log_gamma_0)
+
+                    # 0.3. Accumulate A components - combine with overall accumulators using logsumexp
+                    acc_log_gamma_sum_t_A = np.logaddexp(acc_log_gamma_sum_t_A, log_sum_gamma_r)
+                    acc_log_xi_sum_t = np.logaddexp(acc_log_xi_sum_t, log_sum_xi_r)
+
+                    # 0.4. Accumulate B components
+                    if acc_emission_statistics is None:
+                        acc_emission_statistics = [np.array(statistic) for statistic in emission_statistics]
+                    else:
+                        for acc_statistic, statistic in zip(acc_emission_statistics, emission_statistics):
+                            acc_statistic += statistic
+
+
+                # 1. M-Step: Re-estimate parameters using accumulated expectations
+                print("  M-Step: Re-estimating parameters...")
+                # Initialize the new parameters
+                new_log_pi = np.full(N, LOG_ZERO)
+                new_log_A = np.full((N, N), LOG_ZERO) if self.transitions is None else None
+
+
+                # 1.1. Re-estimate Pi
+                log_total_pi = logsumexp(acc_log_pi) # Each pi sum should add up to 1 so we'll get the number of added pis to normalize with
+                if log_total_pi > LOG_ZERO:
+                    new_log_pi = acc_log_pi - log_total_pi
+                else: # Keep old if no starts observed from all sequences
+                    new_log_pi = self.log_pi
+
+
+                # 1.2. Re-estimate A
+                # log A_ij = accumulated log( Sum_t xi_t(i,j) ) - accumulated log( Sum_t gamma_t(i) )
+                if self.transitions is not None:
+                    # Sparse topology - the same for each stored transition, the structure never changes
+                    new_transitions = self._reestimate_sparse_transitions(acc_log_xi_sum_t, acc_log_gamma_sum_t_A)
                 else:
-                    # Keep old parameters if state j had zero expected visits
-                    new_emission_means[j] = self.emission_models[j].mean
-
-            # 1.4 Re-estimate Emissions Covariances
-            acc_gamma_outer_sum = np.zeros((N, D, D)) # Initialize accumulator for outer products
-            for r in range(len(observation_sequences)):
-                gamma = all_gammas[r] # Get stored gamma probabilities
-                observations = all_observations[r] # Get stored observations
-                for j in range(N): # For each state j
-                    if acc_gamma_sum[j] > epsilon: # Only if state j expected
-                        # Calculate deviations using the NEW mean for state j
-                        deviations = observations - new_emission_means[j]
-                        # Accumulate weighted outer product Sum_t (gamma_t(j) * outer(dev, dev))
-                        acc_gamma_outer_sum[j, :, :] += np.einsum('t,ti,tj->ij', gamma[:, j], deviations, deviations)
-
-            # Normlize the accumulated outer sums
-            for j in range(N): # For each state j
-                # Total expected number of times in state j (accumulated)
-                sum_gamma_j = acc_gamma_sum[j]
-                # Avoid division by zero
-                if sum_gamma_j > epsilon:
-                    # new cov = accumulated weighted sum of outer products / accumulated sum of weights
-                    new_emission_covariances[j] = acc_gamma_outer_sum[j, :, :] / sum_gamma_j
-                    # Add small diagonal value for numerical stability
-                    new_emission_covariances[j] += np.identity(D) * epsilon
+                    for i in range(N):
+                        # the total expected transitions from state i (accumulated)
+                        log_sum_gamma_i_total = acc_log_gamma_sum_t_A[i]
+                        if log_sum_gamma_i_total > LOG_ZERO: # Only update if there we expected transitions from i
+                            for j in range(N):
+                                # Numerator: Total expected transitions from i to j (accumulated)
+                                log_sum_xi_ij_total = acc_log_xi_sum_t[i, j]
+                                if log_sum_xi_ij_total > LOG_ZERO: # Only update if we expect a transition from i to j ever expected
+                                    new_log_A[i, j] = log_sum_xi_ij_total - log_sum_gamma_i_total
+
+                        # Re-normalize each row of log_A to make sure transitions from state i sum to 1 (logsumexp=0)
+                        row_log_sum = logsumexp(new_log_A[i, :])
+                        if np.isfinite(row_log_sum) and row_log_sum > LOG_ZERO:
+                            new_log_A[i, :] -= row_log_sum
+
+                # 1.3 Re-estimate the emission model - means & covariances (& mixture weights) of each state
+                # States with zero expected visits keep their old parameters
+                new_emissions = self.emissions.reestimate(acc_emission_statistics) if acc_emission_statistics is not None else self.emissions
+
+
+                # 2. Update the Model's parameters
+                # Update internal log probs
+                self.log_pi = new_log_pi
+                if self.transitions is None:
+                    self.log_A = new_log_A
                 else:
-                    # Keep old parameters if state j had zero expected visits
-                    new_emission_covariances[j] = self.emission_models[j].cov
-
-
-            # 2. Update the Model's parameters
-            # Update internal log probs
-            self.log_pi = new_log_pi
-            self.log_A = new_log_A
-            # Rebuild emission models
-            self.emission_models = []
-            for i in range(N):
-                self.emission_models.append(
-                    multivariate_normal(mean=new_emission_means[i], cov=new_emission_covariances[i], allow_singular=True)
-                )
-            # Also update the stored raw parameters
-            self.emission_means = new_emission_means
-            self.emission_covariances = new_emission_covariances
-
-
-            # 3. Convergence Check
-            log_likelihoods_history.append(current_total_log_likelihood)
-            print(f"Iteration {iteration + 1}: Total Log Likelihood = {current_total_log_likelihood:.4f}")
-            if iteration > 0:
-                improvement = current_total_log_likelihood - prev_total_log_likelihood
-                print(f"  Improvement: {improvement:.4f}")
-
-                # Stop if the likelihood decreases or improvement is very small
-                if improvement < convergence_threshold: # Can be negative if issues occur
-                    if improvement < -epsilon: # Check for likelihood decreasing significantly
-                        print("Warning: Log Likelihood decreased!")
-                    print("Convergence threshold reached.")
-                    break
-            prev_total_log_likelihood = current_total_log_likelihood
+                    self.transitions = new_transitions
+                # Also update the emission model & the stored raw parameters
+                self.emissions = new_emissions
+                self.emission_means = new_emissions.means
+                self.emission_covariances = new_emissions.covariances
+
+
+                # 3. Convergence Check
+                log_likelihoods_history.append(current_total_log_likelihood)
+                print(f"Iteration {iteration + 1}: Total Log Likelihood = {current_total_log_likelihood:.4f}")
+                if iteration > 0:
+                    improvement = current_total_log_likelihood - prev_total_log_likelihood
+                    print(f"  Improvement: {improvement:.4f}")
+
+                    # Stop if the likelihood decreases or improvement is very small
+                    if improvement < convergence_threshold: # Can be negative if issues occur
+                        if improvement < -epsilon: # Check for likelihood decreasing significantly
+                            print("Warning: Log Likelihood decreased!")
+                        print("Convergence threshold reached.")
+                        break
+                prev_total_log_likelihood = current_total_log_likelihood
+        finally:
+            if pool is not None:
+                pool.shutdown()
 
         print(f"Training finished after {iteration + 1} iterations.")
         return log_likelihoods_history
 
-    def viterbi_decode(self, observations):
+    def viterbi_decode(self, observations, log_B=None):
+        # log_B - the emission table of the observations when the caller already has it
         T = observations.shape[0]
         if T == 0:
             return [], LOG_ZERO # return if there are no observations
 
         N = self.N
+        if log_B is None:
+            log_B = self._log_emission_matrix(observations)
 
 
         # 1. create arrays to store the found paths data
-        # 2d array to store the paths probability values
-        paths_probs = np.full((T, N), LOG_ZERO)
         # 2d array to store the last state indexes that transitioning to current state
-        paths_backpointers = np.zeros((T, N), dtype=int)
+        paths_backpointers = np.zeros((T, N), dtype=_backpointer_dtype(N))
 
 
         # 2. Initialize step - first start probabilities for each state
-        for j in range(N):
-            log_B_j_O0 = self._log_emission_prob(observations[0], j)
-            if log_B_j_O0 > LOG_ZERO: # only if possible
-                paths_probs[0, j] = self.log_pi[j] + log_B_j_O0
+        # Only the probs of the last time step are needed - impossible emissions stays -inf
+        paths_probs = self.log_pi + log_B[0]
 
 
         # 3. Inductive step from t1 to T-1
         for t in range(1, T):
-            for j in range(N):
-                log_B_j_Ot = self._log_emission_prob(observations[t], j)
-
-                # If the obs at time t at state j not possible then the path P 0
-                if log_B_j_Ot <= LOG_ZERO:
-                    continue
+            # all state transitions from all states from last time that are end of a path
+            # & the state of the best path & it's P for each current state j
+            best_prev_states, best_paths_probs = self._best_predecessors(paths_probs)
 
-                # calc all state transitions from this state and time and all states from last time that are end of a path
-                prev_paths_probs = paths_probs[t-1, :] + self.log_A[:, j] # log prob calc
-
-                # Find the highest P from all possible paths
-                best_path_prob = np.max(prev_paths_probs)
-                # get the state of the best path
-                best_prev_state = np.argmax(prev_paths_probs)
-
-                # Update the paths data
-                if best_path_prob > LOG_ZERO:
-                    paths_probs[t, j] = best_path_prob + log_B_j_Ot
-                    paths_backpointers[t, j] = best_prev_state
-                # if we didnt find valid path- stays 0
+            # Update the paths data only if the obs at state j & the best path into j are possible
+            valid = (best_paths_probs > LOG_ZERO) & (log_B[t] > LOG_ZERO)
+            paths_probs = np.where(valid, best_paths_probs + log_B[t], LOG_ZERO)
+            paths_backpointers[t] = np.where(valid, best_prev_states, 0) # if we didnt find valid path- stays 0
 
 
         # 4. Termination step
         # after finding all final paths, find the one with the highest probability
-        max_final_log_prob = np.max(paths_probs[T - 1, :])
+        last_state = np.argmax(paths_probs)
+        max_final_log_prob = paths_probs[last_state]
 
         # If all paths have zero probability sequence is impossible
         if max_final_log_prob <= LOG_ZERO:
             return [], LOG_ZERO
 
-        # get the last state of the best path
-        last_state = np.argmax(paths_probs[T - 1, :])
-
 
         # 5. Backtracking
-        # Start building the path from the last state
-        best_path = [last_state]
-
-        # Loop in reverse from the state before last one from T-1 to t1
-        for t in range(T - 1, 0, -1):
-            prev_state = paths_backpointers[t, last_state]
-            best_path.insert(0, prev_state)
-            last_state = prev_state
+        best_path = _backtrack(paths_backpointers, last_state)
 
         return best_path, max_final_log_prob
 
+    def viterbi_decode_beam(self, observations, beam=BEAM_WIDTH, max_active=None, stats=None):
+        # Beam pruned Viterbi - after every frame only the states within `beam` (log prob) of the best
+        # path & at most max_active of them stay active. Paths are extended only out of the active states
+        # & emissions are evaluated only for the states those transitions reach
+        # beam=None & max_active=None keeps every state & gives the exact viterbi_decode result
+        # stats - optional dict that gets the active states per frame & the emission evaluations
+        T = observations.shape[0]
+        if T == 0:
+            return [], LOG_ZERO
+
+        N = self.N
+        observations = np.asarray(observations, dtype=np.float64)
+        paths_backpointers = np.zeros((T, N), dtype=_backpointer_dtype(N))
+        active_counts = np.zeros(T, dtype=np.int64)
+        emission_evaluations = 0
+
+        # 1. Initialize step - emissions only for the possible start states
+        reached = np.flatnonzero(self.log_pi > LOG_ZERO)
+        paths_probs = np.full(N, LOG_ZERO)
+        paths_probs[reached] = self.log_pi[reached] + self._active_log_emissions(observations[0], reached)
+        emission_evaluations += len(reached)
+        active = self._prune_states(paths_probs, beam, max_active)
+        active_counts[0] = len(active)
+
+        # 2. Inductive step - only transitions out of the active states
+        for t in range(1, T):
+            if len(active) == 0:
+                break
+
+            # Best active predecessor of every reached state
+            if self.transitions is None:
+                # (active, N) path probs into every state
+                prev_paths_probs = paths_probs[active, None] + self.log_A[active]
+                best_rows = np.argmax(prev_paths_probs, axis=0)
+                best_paths_probs = prev_paths_probs[best_rows, np.arange(N)]
+                reached = np.flatnonzero(best_paths_probs > LOG_ZERO)
+                best_prev_states = active[best_rows[reached]]
+                best_paths_probs = best_paths_probs[reached]
+            else:
+                # Sparse topology - only the transitions out of the active states, the pruned states can't be left
+                reached, best_prev_states, best_paths_probs = self.transitions.active_best_predecessors(paths_probs, active)
+                possible = best_paths_probs > LOG_ZERO
+                reached, best_prev_states, best_paths_probs = reached[possible], best_prev_states[possible], best_paths_probs[possible]
+
+            paths_probs = np.full(N, LOG_ZERO)
+            paths_probs[reached] = best_paths_probs + self._active_log_emissions(observations[t], reached)
+            paths_backpointers[t, reached] = best_prev_states
+            emission_evaluations += len(reached)
+
+            active = self._prune_states(paths_probs, beam, max_active, reached)
+            active_counts[t] = len(active)
+
+        if stats is not None:
+            stats["active_states"] = active_counts
+            stats["mean_active_states"] = float(active_counts.mean())
+            stats["emission_evaluations"] = emission_evaluations
+
+        # 3. Termination & backtracking
+        if len(active) == 0:
+            return [], LOG_ZERO
+        last_state = active[np.argmax(paths_probs[active])]
+        return _backtrack(paths_backpointers, last_state), paths_probs[last_state]
+
+    @staticmethod
+    def _prune_states(scores, beam, max_active, candidates=None):
+        # Indices of the states kept active after a frame - possible, within the beam & the max_active best
+        # candidates - sorted states that can be possible (the reached ones), all the states when None
+        states = np.flatnonzero(scores > LOG_ZERO) if candidates is None else candidates[scores[candidates] > LOG_ZERO]
+        if len(states) == 0:
+            return states
+        if beam is not None:
+            states = states[scores[states] >= np.max(scores[states]) - beam]
+        if max_active is not None and len(states) > max_active:
+            states = states[np.argpartition(-scores[states], max_active - 1)[:max_active]]
+            states.sort()
+        return states
+
+    def _active_log_emissions(self, observation, states):
+        # Log emission probs of a single frame for some states
+        log_b = self.emissions.log_likelihood(observation[None, :], None if len(states) == self.N else states)[0]
+        log_b[~np.isfinite(log_b)] = LOG_ZERO
+        return log_b
+
+    def log_emission_matrices(self, observation_sequences):
+        # _log_emission_matrix of many sequences with one call - a (T, N) table per sequence
+        lengths = [len(observations) for observations in observation_sequences]
+        if sum(lengths) == 0:
+            return [np.empty((0, self.N)) for _ in observation_sequences]
+        log_B = self._log_emission_matrix(np.concatenate([np.asarray(o, dtype=np.float64) for o in observation_sequences if len(o)]))
+        return np.split(log_B, np.cumsum(lengths)[:-1])
+
+    def viterbi_decode_batch(self, observation_sequences):
+        # Viterbi for many sequences at once - returns a (best_path, log_prob) per sequence
+        # identical to calling viterbi_decode on each of them
+        B = len(observation_sequences)
+        results = [([], LOG_ZERO)] * B
+        if B == 0:
+            return results
+
+        lengths = np.array([observations.shape[0] for observations in observation_sequences])
+        T_max = int(lengths.max())
+        if T_max == 0:
+            return results # return if there are no observations
+
+        N = self.N
+        D = max(observation_sequences, key=len).shape[1]
+
+        # Sort longest first so the sequences still running at time t are always the first ones
+        order = np.argsort(-lengths, kind="stable")
+        sorted_lengths = lengths[order]
+
+
+        # 1. Pad all sequences into a (B, T_max, D) tensor with a mask of the real frames
+        padded = np.zeros((B, T_max, D))
+        for b, r in enumerate(order):
+            padded[b, :sorted_lengths[b]] = observation_sequences[r]
+        mask = np.arange(T_max)[None, :] < sorted_lengths[:, None]
+
+        # Emissions only for the real frames - padded frames stay impossible
+        log_B = np.full((B, T_max, N), LOG_ZERO)
+        log_B[mask] = self._log_emission_matrix(padded[mask])
+
+
+        # 2. create arrays to store the found paths data
+        paths_backpointers = np.zeros((B, T_max, N), dtype=_backpointer_dtype(N))
+        # Number of sequences that still have a frame at time t
+        num_active = np.sum(mask, axis=0)
+
+
+        # 3. Initialize step - first start probabilities for each state of each sequence
+        paths_probs = self.log_pi + log_B[:, 0]
+
+
+        # 4. Inductive step from t1 to T_max-1 - only for the sequences that didnt end yet
+        for t in range(1, T_max):
+            n = num_active[t]
+            best_prev_states, best_paths_probs = self._best_predecessors(paths_probs[:n])
+
+            valid = (best_paths_probs > LOG_ZERO) & (log_B[:n, t] > LOG_ZERO)
+            # Ended sequences keep their final paths probs
+            paths_probs[:n] = np.where(valid, best_paths_probs + log_B[:n, t], LOG_ZERO)
+            paths_backpointers[:n, t] = np.where(valid, best_prev_states, 0)
+
+
+        # 5. Termination & backtracking of each sequence from its own last frame
+        for b, r in enumerate(order):
+            T = sorted_lengths[b]
+            if T == 0:
+                continue
+
+            last_state = np.argmax(paths_probs[b])
+            max_final_log_prob = paths_probs[b, last_state]
+            if max_final_log_prob <= LOG_ZERO:
+                continue
+
+            results[r] = (_backtrack(paths_backpointers[b, :T], last_state), max_final_log_prob)
+
+        return results
+
     def decode_to_phonemes(self, observations):
         """Calls Viterbi and converts state indices to phoneme names."""
         best_path, log_prob = self.viterbi_decode(observations)
-        if best_path:
+        if len(best_path) > 0:
             phoneme_sequence = [self.index_map[idx] for idx in best_path]
             phoneme_sequence = ' -> '.join(phoneme_sequence)
-        return best_path, phoneme_sequence, log_prob
\ No newline at end of file
+        return best_path, phoneme_sequence, log_prob
+
+class StreamingViterbi:
+    # Viterbi over a stream of observation chunks that keeps the decoding state between the chunks
+    # Only the last column of path probs & the backpointers of the frames that aren't final yet are kept
+    # A frame is final once all the surviving paths agree on it (the traceback convergence point)
+    def __init__(self, hmm, max_window=500):
+        self.hmm = hmm
+        self.max_window = max_window # Max frames waiting for convergence before the best path is forced out
+        self._bp_dtype = _backpointer_dtype(hmm.N)
+        self.reset()
+
+    def reset(self):
+        self.paths_probs = None # Path probs of each state at the last frame
+        self.pending_backpointers = [] # Backpointer column of each frame that wasn't emitted yet
+        self.frames_seen = 0
+        self.frames_emitted = 0
+        self.frames_forced = 0 # Frames emitted before convergence because of the window limit
+        self.frames_dropped = 0 # Frames dropped because no path could explain them
+
+    def push(self, observations):
+        # Adds a chunk of observations & returns the newly final states (may be empty)
+        T = observations.shape[0]
+        if T == 0:
+            return np.empty(0, dtype=np.intp)
+
+        log_B = self.hmm._log_emission_matrix(observations)
+        N = self.hmm.N
+        emitted = []
+
+        for t in range(T):
+            self.frames_seen += 1
+
+            # 1. First frame of the stream - start probabilities
+            if self.paths_probs is None:
+                self.paths_probs = self.hmm.log_pi + log_B[t]
+                self.pending_backpointers.append(np.zeros(N, dtype=self._bp_dtype)) # never followed
+            # 2. Same inductive step as viterbi_decode
+            else:
+                best_prev_states, best_paths_probs = self.hmm._best_predecessors(self.paths_probs)
+
+                valid = (best_paths_probs > LOG_ZERO) & (log_B[t] > LOG_ZERO)
+                self.paths_probs = np.where(valid, best_paths_probs + log_B[t], LOG_ZERO)
+                self.pending_backpointers.append(np.where(valid, best_prev_states, 0).astype(self._bp_dtype))
+
+            # No path survived this frame - drop the undecodable part & start over from the next frame
+            if not np.any(self.paths_probs > LOG_ZERO):
+                self.frames_dropped += len(self.pending_backpointers)
+                self.paths_probs = None
+                self.pending_backpointers = []
+
+        # 3. Emit the frames all the surviving paths agree on
+        emitted.append(self._emit_converged())
+
+        # 4. Keep the window bounded - force out the oldest frames with the current best path
+        overflow = len(self.pending_backpointers) - self.max_window
+        if overflow > 0:
+            best_path = self._best_pending_path()
+            self._drop_pending(overflow)
+            self.frames_forced += overflow
+            emitted.append(best_path[:overflow])
+
+        return np.concatenate(emitted)
+
+    def flush(self):
+        # End of stream - emits the rest of the best path and returns it with the final path log prob
+        if self.paths_probs is None:
+            self.reset()
+            return np.empty(0, dtype=np.intp), LOG_ZERO
+
+        best_path = self._best_pending_path()
+        final_log_prob = np.max(self.paths_probs)
+        self.reset()
+        return best_path, final_log_prob
+
+    def _best_pending_path(self):
+        # The pending part of the best path ending at the last frame
+        last_state = np.argmax(self.paths_probs)
+        return _backtrack(np.array(self.pending_backpointers), last_state)
+
+    def _emit_converged(self):
+        # Trace all surviving paths back together until they meet in a single state
+        states = np.flatnonzero(self.paths_probs > LOG_ZERO) if self.paths_probs is not None else []
+        for k in range(len(self.pending_backpointers) - 1, 0, -1):
+            states = np.unique(self.pending_backpointers[k][states])
+            if len(states) == 1:
+                # Every path passes through this state at pending frame k-1 so frames 0 to k-1 are final
+                stable_path = _backtrack(np.array(self.pending_backpointers[:k]), states[0])
+                self._drop_pending(k)
+                return stable_path
+
+        return np.empty(0, dtype=np.intp)
+
+    def _drop_pending(self, num_frames):
+        # The backpointers of the first pending frame after this are never followed - it's before the window
+        del self.pending_backpointers[:num_frames]
+        self.frames_emitted += num_frames
@@ -0,0 +1,260 @@
+import math
+import zlib
+import numpy as np
+from model_format import ModelFormatError, pack_arrays, write_file, map_file, array_views
+
+# Word n-gram language model for the word decoder
+# An ARPA file is compiled into sorted integer arrays - every n-gram of order k > 1 is packed into a single
+# int64 key (index of its k-1 word context in the order k-1 table * vocabulary size + word id) & the keys of
+# each order are sorted, so a lookup is a binary search & an n-gram's index is also its id as a context
+# Missing n-grams back off to the shorter history (Katz backoff as written in the ARPA file)
+#
+# Compiled file (same container as the model file, see model_format):
+#   MAGIC (8 bytes) | header length | JSON header | padding | arrays
+# Compile with: python language_model.py compile lm.arpa lm.sttlm
+
+MAGIC = b"STTLM\x00\x00\x00"
+FORMAT_VERSION = 1
+
+BEGIN_SENTENCE = "<s>"
+END_SENTENCE = "</s>"
+UNKNOWN_WORD = "<unk>"
+OOV_LOG_PROB = -20.0 # Log prob of words outside the vocabulary when the model has no <unk>
+
+SCORE_CACHE_SIZE = 200000 # (history, word) scores kept - cleared when full so it holds the recent pairs
+
+LOG_10 = math.log(10.0) # ARPA log probs are log10
+
+
+def parse_arpa(filepath):
+    # Returns [{(word, ...): (log prob, backoff)} per order], natural log
+    orders = []
+    order = 0
+    with open(filepath, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("ngram "):
+                continue
+            if line.startswith("\\"):
+                # \data\, \N-grams: or \end\
+                order = int(line[1:line.index("-")]) if line.endswith("-grams:") else 0
+                if order:
+                    orders.append({})
+                continue
+            if not order:
+                continue
+            fields = line.split()
+            log_prob = float(fields[0]) * LOG_10
+            backoff = float(fields[order + 1]) * LOG_10 if len(fields) > order + 1 else 0.0
+            orders[order - 1][tuple(fields[1:order + 1])] = (log_prob, backoff)
+    if not orders:
+        raise ModelFormatError(f"{filepath} has no n-gram sections")
+    return orders
+
+
+class LanguageModel:
+    def __init__(self, vocabulary, arrays, order):
+        # arrays - see from_ngrams, may be read only views of a memory mapped file
+        self.order = order
+        self.vocabulary = vocabulary
+        self.word_ids = {word: i for i, word in enumerate(vocabulary)}
+        self.V = len(vocabulary)
+        self.log_probs = [arrays[f"log_probs_{k}"] for k in range(1, order + 1)]
+        self.backoffs = [arrays[f"backoffs_{k}"] for k in range(1, order + 1)]
+        self.keys = [None] + [arrays[f"keys_{k}"] for k in range(2, order + 1)] # Order 1 is indexed by word id
+        self.begin_history = (self.word_ids[BEGIN_SENTENCE],) if BEGIN_SENTENCE in self.word_ids else ()
+        self.unknown_word = self.word_ids.get(UNKNOWN_WORD, -1)
+        self._cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @classmethod
+    def from_ngrams(cls, orders):
+        # orders - parse_arpa output
+        order = len(orders)
+
+        # 1. Vocabulary - the unigrams, ids in file order
+        vocabulary = [ngram[0] for ngram in orders[0]]
+        word_ids = {word: i for i, word in enumerate(vocabulary)}
+        V = len(vocabulary)
+        arrays = {
+            "log_probs_1": np.array([log_prob for log_prob, _ in orders[0].values()]),
+            "backoffs_1": np.array([backoff for _, backoff in orders[0].values()]),
+        }
+
+        # 2. Higher orders - packed keys of (context index, word) sorted, the values in the same order
+        keys = [None]
+        for k in range(2, order + 1):
+            ngrams = [ngram for ngram in orders[k - 1] if all(word in word_ids for word in ngram)]
+            ids = np.array([[word_ids[word] for word in ngram] for ngram in ngrams], dtype=np.int64).reshape(-1, k)
+            contexts = _context_indexes(keys, ids[:, :-1], V)
+            known = contexts >= 0 # n-grams whose context isn't in the file can't be reached
+            if not known.all():
+                print(f"language model: dropped {np.count_nonzero(~known)} {k}-grams without their context")
+            packed = contexts[known] * V + ids[known, -1]
+            order_by_key = np.argsort(packed, kind="stable")
+            values = np.array([orders[k - 1][ngram] for ngram in ngrams]).reshape(-1, 2)[known][order_by_key]
+            keys.append(packed[order_by_key])
+            arrays[f"keys_{k}"] = keys[-1]
+            arrays[f"log_probs_{k}"] = values[:, 0].copy()
+            arrays[f"backoffs_{k}"] = values[:, 1].copy()
+        return cls(vocabulary, arrays, order)
+
+    @classmethod
+    def from_arpa(cls, filepath):
+        return cls.from_ngrams(parse_arpa(filepath))
+
+    def word_id(self, word):
+        # Id of a word, the <unk> id (or -1) outside of the vocabulary
+        return self.word_ids.get(word, self.unknown_word)
+
+    def _index(self, history):
+        # Index of an n-gram (tuple of word ids) in the table of its order, -1 if it's not in the model
+        index = history[0]
+        for k in range(1, len(history)):
+            keys = self.keys[k]
+            key = index * self.V + history[k]
+            position = int(keys.searchsorted(key))
+            if position == len(keys) or keys[position] != key:
+                return -1
+            index = position
+        return index
+
+    def _shorten(self, history):
+        # Longest suffix of history that is a context in the model - the histories that score the same
+        # are the same key, which keeps the decoder's cache small
+        while history and self._index(history) < 0:
+            history = history[1:]
+        return history
+
+    def score(self, history, word):
+        # log P(word | history) & the history after the word - history is a tuple of word ids, oldest first
+        key = (history, word)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached
+        self.cache_misses += 1
+
+        if word < 0:
+            result = (OOV_LOG_PROB, ())
+        else:
+            # Back off until the n-gram is in the model - adds the backoff weight of every history dropped
+            log_prob = 0.0
+            context = history
+            while True:
+                index = self._index(context + (word,))
+                if index >= 0:
+                    log_prob += self.log_probs[len(context)][index]
+                    break
+                context_index = self._index(context)
+                if context_index >= 0:
+                    log_prob += self.backoffs[len(context) - 1][context_index]
+                context = context[1:]
+            result = (float(log_prob), self._shorten((history + (word,))[-(self.order - 1):] if self.order > 1 else ()))
+
+        if len(self._cache) >= SCORE_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[key] = result
+        return result
+
+    def sentence_log_prob(self, words):
+        # log P of a whole sentence with <s> & </s> - for checking a compiled model against the ARPA file
+        history = self.begin_history
+        total = 0.0
+        for word in list(words) + [END_SENTENCE]:
+            log_prob, history = self.score(history, self.word_id(word))
+            total += log_prob
+        return total
+
+    def export_arrays(self):
+        # ARPA words have no whitespace - the vocabulary is stored one word per line
+        arrays = {"vocabulary_text": np.frombuffer("\n".join(self.vocabulary).encode("utf-8"), dtype=np.uint8)}
+        for k in range(1, self.order + 1):
+            if k > 1:
+                arrays[f"keys_{k}"] = self.keys[k - 1]
+            arrays[f"log_probs_{k}"] = self.log_probs[k - 1]
+            arrays[f"backoffs_{k}"] = self.backoffs[k - 1]
+        return arrays
+
+    def save(self, filepath):
+        layout, data = pack_arrays(self.export_arrays())
+        header = {
+            "version": FORMAT_VERSION,
+            "order": self.order,
+            "vocabulary_size": self.V,
+            "ngram_counts": [len(log_probs) for log_probs in self.log_probs],
+            "layout": layout,
+            "data_size": len(data),
+            "checksum": zlib.crc32(data),
+        }
+        size = write_file(filepath, MAGIC, header, data)
+        print(f"language model saved to {filepath} (order {self.order}, {self.V} words, {size / 1024:.1f} KB)")
+
+    @classmethod
+    def load(cls, filepath, verify=True):
+        # Memory maps a compiled model - only the vocabulary is decoded, the n-gram tables are used from the file
+        mapping, header, data_offset = map_file(filepath, MAGIC, "language model", verify)
+        if header["version"] != FORMAT_VERSION:
+            raise ModelFormatError(f"language model format version {header['version']}, expected {FORMAT_VERSION}")
+        arrays = array_views(mapping, header["layout"], data_offset)
+        vocabulary = arrays["vocabulary_text"].tobytes().decode("utf-8").split("\n")
+        if len(vocabulary) != header["vocabulary_size"]:
+            raise ModelFormatError("language model vocabulary doesn't match its header")
+        model = cls(vocabulary, arrays, header["order"])
+        model._mapping = mapping # The views need the mapping for as long as the model lives
+        return model
+
+
+def _context_indexes(keys, contexts, V):
+    # Vectorized LanguageModel._index for (M, k) word ids -> (M,) indexes, -1 when not in the model
+    indexes = contexts[:, 0].copy()
+    for k in range(1, contexts.shape[1]):
+        packed = indexes * V + contexts[:, k]
+        positions = np.minimum(np.searchsorted(keys[k], packed), max(len(keys[k]) - 1, 0))
+        found = (indexes >= 0) & (len(keys[k]) > 0)
+        found[found] = keys[k][positions[found]] == packed[found]
+        indexes = np.where(found, positions, -1)
+    return indexes
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import subprocess
+
+    usage = "usage: python language_model.py compile <lm.arpa> <lm.sttlm> | bench <lm.arpa> <lm.sttlm>"
+    if len(sys.argv) != 4 or sys.argv[1] not in ("compile", "bench"):
+        sys.exit(usage)
+    command, arpa_path, model_path = sys.argv[1], os.path.abspath(sys.argv[2]), os.path.abspath(sys.argv[3])
+
+    if command == "compile":
+        LanguageModel.from_arpa(arpa_path).save(model_path)
+        sys.exit(0)
+
+    # 1. Cold start of each loader in a fresh interpreter (imports excluded)
+    loaders = {
+        "parse arpa": f"language_model.LanguageModel.from_arpa({arpa_path!r})",
+        "compiled": f"language_model.LanguageModel.load({model_path!r})",
+        "compiled, no verify": f"language_model.LanguageModel.load({model_path!r}, verify=False)",
+    }
+    for label, statement in loaders.items():
+        code = ("import io, contextlib, time, language_model\n"
+                f"t = time.perf_counter()\nwith contextlib.redirect_stdout(io.StringIO()): {statement}\n"
+                "print(time.perf_counter() - t)")
+        times = [float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                      cwd=os.path.dirname(os.path.abspath(__file__))).stdout)
+                 for _ in range(3)]
+        print(f"{label:>20}: {1000 * min(times):.2f} ms (best of 3)")
+
+    # 2. Lookups - random (history, word) pairs without & with the cache
+    import time
+    model = LanguageModel.load(model_path, verify=False)
+    rng = np.random.default_rng(0)
+    pairs = [(tuple(int(w) for w in rng.integers(0, model.V, size=model.order - 1)), int(rng.integers(model.V)))
+             for _ in range(20000)]
+    for label in ("uncached", "cached"):
+        start = time.perf_counter()
+        for history, word in pairs:
+            model.score(history, word)
+        print(f"{label:>20}: {1e6 * (time.perf_counter() - start) / len(pairs):.2f} us per score")
@@ -0,0 +1,213 @@
+import re
+import zlib
+import numpy as np
+from model_format import ModelFormatError, pack_arrays, write_file, map_file, array_views
+
+# Pronunciation lexicon as an array backed prefix tree over the phoneme inventory
+# Every node is one phoneme of a pronunciation - words that share their first phonemes share the nodes,
+# so the word decoder scores "K AE T" once for CAT, CATS & CATALOG
+# The nodes are numbered in breadth first order with the children of a node sorted by phoneme, so the
+# children of every node are one contiguous range (child_indptr, same as a CSR matrix)
+#
+# Compiled file (same container as the model file, see model_format):
+#   MAGIC (8 bytes) | header length | JSON header | padding | arrays
+# Compile a CMUdict style file with: python lexicon.py compile cmudict.dict lexicon.sttl
+
+MAGIC = b"STTLEX\x00\x00"
+FORMAT_VERSION = 1
+
+SILENCE_WORD = "<sil>" # Pronounced SIL - lets the decoder put pauses between words, dropped from the transcript
+
+ROOT = 0 # Node of the empty prefix
+
+_ALTERNATE = re.compile(r"\(\d+\)$") # "READ(2)" - second pronunciation of READ
+
+
+def parse_cmudict(filepath, phonemes):
+    # (word, [phoneme indexes]) of every pronunciation in a CMUdict style file
+    # "WORD  PH1 PH2 ..." per line, ;;; comments, the stress digits of the vowels are dropped (AH0 -> AH)
+    # Pronunciations with phonemes outside of the inventory are skipped
+    phoneme_index = {phoneme: i for i, phoneme in enumerate(phonemes)}
+    entries = []
+    skipped = 0
+    with open(filepath, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip() # cmudict.dict puts comments after a #
+            if not line or line.startswith(";;;"):
+                continue
+            word, *pronunciation = line.split()
+            try:
+                indexes = [phoneme_index[phoneme.rstrip("012")] for phoneme in pronunciation]
+            except KeyError:
+                skipped += 1
+                continue
+            if indexes:
+                entries.append((_ALTERNATE.sub("", word).lower(), indexes))
+    if skipped:
+        print(f"lexicon: skipped {skipped} pronunciations with unknown phonemes")
+    return entries
+
+
+class Lexicon:
+    def __init__(self, phonemes, arrays):
+        # arrays - see from_pronunciations, may be read only views of a memory mapped file
+        self.phonemes = list(phonemes)
+        self.node_phonemes = arrays["node_phonemes"] # (M,) phoneme index of every node, -1 for the root
+        self.node_parents = arrays["node_parents"] # (M,) -1 for the root
+        self.child_indptr = arrays["child_indptr"] # (M + 1,) children of node n are child_indptr[n]:child_indptr[n+1]
+        self.word_indptr = arrays["word_indptr"] # (M + 1,) words ending at node n are word_ids[word_indptr[n]:word_indptr[n+1]]
+        self.word_ids = arrays["word_ids"]
+        self.word_offsets = arrays["word_offsets"] # (num words + 1,) word i is word_text[word_offsets[i]:word_offsets[i+1]]
+        self.word_text = arrays["word_text"] # utf-8 of all the words one after the other
+        self.num_nodes = len(self.node_phonemes)
+        self.num_words = len(self.word_offsets) - 1
+
+    @classmethod
+    def from_pronunciations(cls, entries, phonemes, add_silence=True):
+        # entries - (word, [phoneme indexes]) pairs, a word with a few pronunciations has a few entries
+        entries = list(entries)
+        if add_silence and "SIL" in phonemes:
+            entries.append((SILENCE_WORD, [list(phonemes).index("SIL")]))
+
+        # 1. Word ids in first seen order
+        word_index = {}
+        for word, _ in entries:
+            word_index.setdefault(word, len(word_index))
+
+        # 2. Trie of dicts - phoneme -> child
+        trie = {}
+        ends = {} # id(dict node) -> word ids ending there
+        for word, pronunciation in entries:
+            node = trie
+            for phoneme in pronunciation:
+                node = node.setdefault(phoneme, {})
+            ends.setdefault(id(node), []).append(word_index[word])
+
+        # 3. Flatten in breadth first order
+        node_phonemes, node_parents, child_counts, node_words = [-1], [-1], [], [ends.get(id(trie), [])]
+        queue = [trie]
+        for n, node in enumerate(queue):
+            children = sorted(node.items())
+            child_counts.append(len(children))
+            for phoneme, child in children:
+                node_phonemes.append(phoneme)
+                node_parents.append(n)
+                node_words.append(sorted(set(ends.get(id(child), []))))
+                queue.append(child)
+
+        word_bytes = [word.encode("utf-8") for word in word_index]
+        arrays = {
+            "node_phonemes": np.array(node_phonemes, dtype=np.int16),
+            "node_parents": np.array(node_parents, dtype=np.int32),
+            "child_indptr": np.concatenate([[1], 1 + np.cumsum(child_counts)]).astype(np.int32),
+            "word_indptr": np.concatenate([[0], np.cumsum([len(words) for words in node_words])]).astype(np.int32),
+            "word_ids": np.array([word for words in node_words for word in words], dtype=np.int32),
+            "word_offsets": np.concatenate([[0], np.cumsum([len(b) for b in word_bytes])]).astype(np.int64),
+            "word_text": np.frombuffer(b"".join(word_bytes), dtype=np.uint8),
+        }
+        return cls(phonemes, arrays)
+
+    @classmethod
+    def from_cmudict(cls, filepath, phonemes, add_silence=True):
+        return cls.from_pronunciations(parse_cmudict(filepath, phonemes), phonemes, add_silence)
+
+    def word(self, word_id):
+        start, end = self.word_offsets[word_id], self.word_offsets[word_id + 1]
+        return self.word_text[start:end].tobytes().decode("utf-8")
+
+    def words(self):
+        # All the words in id order
+        text = self.word_text.tobytes()
+        offsets = self.word_offsets.tolist()
+        return [text[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(self.num_words)]
+
+    def children(self, node):
+        return np.arange(self.child_indptr[node], self.child_indptr[node + 1])
+
+    def child(self, node, phoneme):
+        # Child of node for a phoneme index, None if no pronunciation continues that way
+        start, end = self.child_indptr[node], self.child_indptr[node + 1]
+        i = start + np.searchsorted(self.node_phonemes[start:end], phoneme)
+        if i < end and self.node_phonemes[i] == phoneme:
+            return int(i)
+        return None
+
+    def words_at(self, node):
+        return [self.word(i) for i in self.word_ids[self.word_indptr[node]:self.word_indptr[node + 1]]]
+
+    def lookup(self, pronunciation):
+        # Words pronounced exactly as the phoneme names (["K", "AE", "T"] -> ["cat"])
+        node = ROOT
+        for phoneme in pronunciation:
+            node = self.child(node, self.phonemes.index(phoneme))
+            if node is None:
+                return []
+        return self.words_at(node)
+
+    def export_arrays(self):
+        return {
+            "node_phonemes": self.node_phonemes,
+            "node_parents": self.node_parents,
+            "child_indptr": self.child_indptr,
+            "word_indptr": self.word_indptr,
+            "word_ids": self.word_ids,
+            "word_offsets": self.word_offsets,
+            "word_text": self.word_text,
+        }
+
+    def save(self, filepath):
+        layout, data = pack_arrays(self.export_arrays())
+        header = {
+            "version": FORMAT_VERSION,
+            "phonemes": self.phonemes,
+            "num_nodes": self.num_nodes,
+            "num_words": self.num_words,
+            "layout": layout,
+            "data_size": len(data),
+            "checksum": zlib.crc32(data),
+        }
+        size = write_file(filepath, MAGIC, header, data)
+        print(f"lexicon saved to {filepath} ({self.num_words} words, {self.num_nodes} nodes, {size / 1024:.1f} KB)")
+
+    @classmethod
+    def load(cls, filepath, expected_phonemes=None, verify=True):
+        # Memory maps a compiled lexicon - the tree is used straight from the file
+        mapping, header, data_offset = map_file(filepath, MAGIC, "lexicon", verify)
+        if header["version"] != FORMAT_VERSION:
+            raise ModelFormatError(f"lexicon format version {header['version']}, expected {FORMAT_VERSION}")
+        if expected_phonemes is not None and header["phonemes"] != list(expected_phonemes):
+            raise ModelFormatError("lexicon phoneme list doesn't match the phoneme set of this server")
+        lexicon = cls(header["phonemes"], array_views(mapping, header["layout"], data_offset))
+        lexicon._mapping = mapping # The views need the mapping for as long as the lexicon lives
+        return lexicon
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import subprocess
+    import phonemes as ph
+
+    usage = "usage: python lexicon.py compile <cmudict> <lexicon.sttl> | bench <cmudict> <lexicon.sttl>"
+    if len(sys.argv) != 4 or sys.argv[1] not in ("compile", "bench"):
+        sys.exit(usage)
+    command, dict_path, lexicon_path = sys.argv[1], os.path.abspath(sys.argv[2]), os.path.abspath(sys.argv[3])
+
+    if command == "compile":
+        Lexicon.from_cmudict(dict_path, ph.PHONEMES).save(lexicon_path)
+        sys.exit(0)
+
+    # Cold start of each loader in a fresh interpreter (imports excluded)
+    loaders = {
+        "parse + build": f"lexicon.Lexicon.from_cmudict({dict_path!r}, phonemes.PHONEMES)",
+        "compiled": f"lexicon.Lexicon.load({lexicon_path!r})",
+        "compiled, no verify": f"lexicon.Lexicon.load({lexicon_path!r}, verify=False)",
+    }
+    for label, statement in loaders.items():
+        code = ("import io, contextlib, time, phonemes, lexicon\n"
+                f"t = time.perf_counter()\nwith contextlib.redirect_stdout(io.StringIO()): {statement}\n"
+                "print(time.perf_counter() - t)")
+        times = [float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                      cwd=os.path.dirname(os.path.abspath(__file__))).stdout)
+                 for _ in range(5)]
+        print(f"{label:>20}: {1000 * min(times):.2f} ms (best of 5)")
@@ -0,0 +1,158 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Service metrics in the Prometheus text format (GET /metrics)
+# Histograms of the time of every pipeline stage, counters & gauges - a lock & a few adds per observation
+# so they stay on in production
+# Worker processes of the async server can't update the metrics of the server process - their pipeline
+# runs inside capture() & the observations are sent back with the result & replayed by the server
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds - from a fraction of a ms (post processing) to the full deadline of a chunk
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+_local = threading.local() # .observations - the list of the running capture() of this thread
+
+
+def _format_labels(label_name, label, extra=""):
+    labels = [f'{label_name}="{label}"'] if label_name else []
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    # One metric with an optional single label (stage, status..) - values per label value
+    def __init__(self, name, help_text, metric_type, label_name=None):
+        self.name = name
+        self.help_text = help_text
+        self.metric_type = metric_type
+        self.label_name = label_name
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry[name] = self
+
+    def _record(self, method, value, label):
+        # Returns True when a capture() of this thread took the observation
+        observations = getattr(_local, "observations", None)
+        if observations is None:
+            return False
+        observations.append((self.name, method, value, label))
+        return True
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            for label, value in sorted(self._values.items(), key=lambda item: str(item[0])):
+                lines.append(f"{self.name}{_format_labels(self.label_name, label)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    def __init__(self, name, help_text, label_name=None):
+        super().__init__(name, help_text, "counter", label_name)
+
+    def inc(self, value=1, label=None):
+        if self._record("inc", value, label):
+            return
+        with self._lock:
+            self._values[label] = self._values.get(label, 0) + value
+
+
+class Gauge(_Metric):
+    # Only used in the server process - not captured
+    def __init__(self, name, help_text, label_name=None):
+        super().__init__(name, help_text, "gauge", label_name)
+        if label_name is None:
+            self._values[None] = 0 # Shown from the start
+
+    def inc(self, value=1, label=None):
+        with self._lock:
+            self._values[label] = self._values.get(label, 0) + value
+
+    def dec(self, value=1, label=None):
+        self.inc(-value, label)
+
+
+class Histogram(_Metric):
+    def __init__(self, name, help_text, label_name=None, buckets=TIME_BUCKETS):
+        super().__init__(name, help_text, "histogram", label_name)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, label=None):
+        if self._record("observe", value, label):
+            return
+        i = bisect.bisect_left(self.buckets, value) # Counts per bucket, made cumulative when rendered
+        with self._lock:
+            counts, total = self._values.get(label) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[i] += 1
+            self._values[label] = (counts, total + value)
+
+    @contextmanager
+    def time(self, label=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, label)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            for label, (counts, total) in sorted(self._values.items(), key=lambda item: str(item[0])):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket_labels = _format_labels(self.label_name, label, 'le="' + le + '"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_name, label)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_name, label)} {cumulative}")
+        return lines
+
+
+_registry = {}
+
+# Pipeline - recorded by processor
+stage_seconds = Histogram("stt_stage_seconds", "Time spent in each stage of the STT pipeline", "stage")
+audio_seconds = Counter("stt_audio_seconds_total", "Seconds of audio decoded", "mode")
+errors = Counter("stt_errors_total", "Failures by the stage they happened in", "stage")
+vad_chunks = Counter("stt_vad_chunks_total", "Chunks checked by the voice activity detection", "result")
+vad_frames = Counter("stt_vad_frames_total", "VAD analysis frames decoded (kept) or left out (skipped)", "result")
+# Micro-batching - recorded by the batcher threads of the server process
+batch_size = Histogram("stt_batch_size", "Items per micro-batch", "batcher", buckets=BATCH_SIZE_BUCKETS)
+batch_queue_seconds = Histogram("stt_batch_queue_seconds", "Time from an item arriving to its batch starting", "batcher")
+# Requests - recorded by the servers
+requests = Counter("stt_requests_total", "Finished /get-audio requests by HTTP status", "status")
+request_seconds = Histogram("stt_request_seconds", "Time from the arrival of a /get-audio request to its response")
+in_flight = Gauge("stt_requests_in_flight", "/get-audio requests being handled")
+streams = Gauge("stt_streams_active", "Open /stream-audio connections")
+
+
+@contextmanager
+def capture():
+    # Observations of this thread are collected into the yielded list instead of the metrics
+    previous = getattr(_local, "observations", None)
+    _local.observations = observations = []
+    try:
+        yield observations
+    finally:
+        _local.observations = previous
+
+def replay(observations):
+    # Applies observations collected by capture() - in the process that serves /metrics
+    for name, method, value, label in observations:
+        getattr(_registry[name], method)(value, label)
+
+def render():
+    lines = []
+    for metric in _registry.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
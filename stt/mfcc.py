@@ -0,0 +1,163 @@
+import numpy as np
+import scipy.fft
+from functools import lru_cache
+
+# Native NumPy MFCCs - the same pipeline as librosa.feature.mfcc with its defaults
+# (hann window, zero padded centered frames, slaney mel filterbank, power in dB clamped to TOP_DB below the
+# loudest band of the chunk, orthonormal DCT-II)
+# All the matrices are cached per configuration so a chunk is only a few matrix products
+# Matches librosa within MFCC_TOLERANCE (float32 rounding) - run this file to compare & benchmark
+# processor passes top_db=None - the clamp depends on the loudest frame of the chunk, so a frame would depend
+# on its neighbours & the streamed MFCCs wouldn't be the ones of the whole recording
+
+# Window & hop in samples at REFERENCE_RATE (librosa's defaults at the browser's 48kHz Opus rate, what the
+# model was trained on) - other rates use the same durations, 42.7ms windows every 10.7ms, see frame_lengths
+N_FFT = 2048
+HOP_LENGTH = 512
+REFERENCE_RATE = 48000
+N_MELS = 128
+AMIN = 1e-10 # Power floor before the log
+TOP_DB = 80.0 # Bands quieter than the chunk's loudest band by more than this are clamped (librosa.power_to_db)
+
+MFCC_TOLERANCE = 1e-4 # Max diff from librosa relative to the coefficient (at least 1) - clamped frames are ~-900
+
+
+def _hz_to_mel(frequencies):
+    # Slaney mel scale - linear below 1 kHz & log above
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    f_sp = 200.0 / 3
+    mels = frequencies / f_sp
+
+    min_log_hz = 1000.0
+    min_log_mel = min_log_hz / f_sp
+    logstep = np.log(6.4) / 27.0
+    log_region = frequencies >= min_log_hz
+    mels[log_region] = min_log_mel + np.log(frequencies[log_region] / min_log_hz) / logstep
+    return mels
+
+def _mel_to_hz(mels):
+    mels = np.asarray(mels, dtype=np.float64)
+    f_sp = 200.0 / 3
+    frequencies = f_sp * mels
+
+    min_log_hz = 1000.0
+    min_log_mel = min_log_hz / f_sp
+    logstep = np.log(6.4) / 27.0
+    log_region = mels >= min_log_mel
+    frequencies[log_region] = min_log_hz * np.exp(logstep * (mels[log_region] - min_log_mel))
+    return frequencies
+
+@lru_cache(maxsize=None)
+def _window(n_fft):
+    # Periodic hann window
+    return (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n_fft) / n_fft)).astype(np.float32)
+
+@lru_cache(maxsize=None)
+def _mel_filterbank(sample_rate, n_fft, n_mels):
+    # (n_mels, n_fft // 2 + 1) triangular filters with slaney area normalization
+    fft_freqs = np.fft.rfftfreq(n_fft, 1.0 / sample_rate)
+    min_mel, max_mel = _hz_to_mel([0.0, sample_rate / 2.0])
+    mel_freqs = _mel_to_hz(np.linspace(min_mel, max_mel, n_mels + 2))
+
+    freq_diffs = np.diff(mel_freqs)
+    ramps = np.subtract.outer(mel_freqs, fft_freqs)
+    lower = -ramps[:-2] / freq_diffs[:-1, None]
+    upper = ramps[2:] / freq_diffs[1:, None]
+    weights = np.maximum(0.0, np.minimum(lower, upper))
+
+    weights *= (2.0 / (mel_freqs[2:] - mel_freqs[:-2]))[:, None]
+    return weights.astype(np.float32)
+
+@lru_cache(maxsize=None)
+def _dct_matrix(n_mels, n_mfcc):
+    # First n_mfcc rows of the orthonormal DCT-II over the mel bands - (n_mfcc, n_mels)
+    k = np.arange(n_mfcc)[:, None]
+    n = np.arange(n_mels)[None, :]
+    dct = np.sqrt(2.0 / n_mels) * np.cos(np.pi * k * (2 * n + 1) / (2 * n_mels))
+    dct[0] /= np.sqrt(2.0)
+    return dct.astype(np.float32)
+
+@lru_cache(maxsize=None)
+def mfcc_matrices(sample_rate, n_fft, n_mels, n_mfcc):
+    # Everything needed for a configuration, built once
+    return _window(n_fft), _mel_filterbank(sample_rate, n_fft, n_mels), _dct_matrix(n_mels, n_mfcc)
+
+def frame_lengths(sample_rate):
+    # (n_fft, hop_length) in samples at sample_rate - the window & frame period of N_FFT & HOP_LENGTH
+    # at REFERENCE_RATE (682 & 171 at 16kHz), n_fft kept even for the rfft
+    n_fft = 2 * round(N_FFT * sample_rate / REFERENCE_RATE / 2)
+    hop_length = round(HOP_LENGTH * sample_rate / REFERENCE_RATE)
+    return n_fft, hop_length
+
+def _frames(y, n_fft, hop_length, center):
+    # (num frames, n_fft) view of the signal - no copy
+    if center:
+        y = np.pad(y, n_fft // 2)
+    if len(y) < n_fft:
+        return np.empty((0, n_fft), dtype=np.float32)
+    return np.lib.stride_tricks.sliding_window_view(y, n_fft)[::hop_length]
+
+def compute_mfccs(y, sample_rate, n_mfcc=13, n_fft=None, hop_length=None, n_mels=N_MELS, center=True,
+                  top_db=TOP_DB):
+    # MFCCs of a mono signal - (num frames, n_mfcc) float32, time first like the hmm input
+    # n_fft & hop_length default to frame_lengths(sample_rate), top_db=None skips the clamp
+    default_n_fft, default_hop_length = frame_lengths(sample_rate)
+    n_fft = n_fft or default_n_fft
+    hop_length = hop_length or default_hop_length
+    y = np.asarray(y, dtype=np.float32)
+    window, mel_basis, dct = mfcc_matrices(sample_rate, n_fft, n_mels, n_mfcc)
+
+    # 1. Power spectrum of every windowed frame
+    frames = _frames(y, n_fft, hop_length, center)
+    spectrum = scipy.fft.rfft(frames * window, axis=1) # Stays complex64 unlike np.fft
+    power = spectrum.real ** 2 + spectrum.imag ** 2
+
+    # 2. Mel bands in dB
+    mel_power = power @ mel_basis.T
+    mel_db = 10.0 * np.log10(np.maximum(mel_power, AMIN))
+    if top_db is not None and mel_db.size:
+        np.maximum(mel_db, mel_db.max() - top_db, out=mel_db)
+
+    # 3. Decorrelate the bands
+    return (mel_db @ dct.T).astype(np.float32, copy=False)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    import subprocess
+
+    sample_rate = 48000
+    y = (np.random.default_rng(0).normal(size=sample_rate) * 0.1).astype(np.float32) # 1 second chunk
+    y[sample_rate // 2:] *= 1e-5 # Quiet second half - below the top_db clamp
+
+    def per_call_ms(func, repeats=50):
+        func() # warm up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            func()
+        return (time.perf_counter() - start) / repeats * 1000
+
+    def import_seconds(statement):
+        # In a fresh interpreter - librosa loads its submodules (& numba) lazily so the statement touches them
+        code = f"import time; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)"
+        return float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout)
+
+    native_ms = per_call_ms(lambda: compute_mfccs(y, sample_rate))
+    print(f"Native MFCC: {native_ms:.2f} ms per 1s chunk, import {import_seconds('import mfcc'):.3f}s")
+
+    try:
+        import librosa
+    except ImportError:
+        print("librosa not installed - skipping the comparison")
+        sys.exit(0)
+
+    def librosa_mfccs():
+        mel_power = librosa.feature.melspectrogram(y=y, sr=sample_rate, n_fft=N_FFT, hop_length=HOP_LENGTH)
+        return librosa.feature.mfcc(S=librosa.power_to_db(mel_power), n_mfcc=13).T # Defaults, top_db=80
+
+    expected = librosa_mfccs()
+    max_diff = np.max(np.abs(compute_mfccs(y, sample_rate) - expected) / np.maximum(np.abs(expected), 1.0))
+    librosa_ms = per_call_ms(librosa_mfccs)
+    print(f"librosa MFCC: {librosa_ms:.2f} ms per 1s chunk, import {import_seconds('import librosa; librosa.feature.mfcc'):.3f}s")
+    print(f"Speedup: {librosa_ms / native_ms:.1f}x, max relative diff: {max_diff:.2e} (tolerance {MFCC_TOLERANCE})")
@@ -0,0 +1,190 @@
+import json
+import mmap
+import struct
+import zlib
+import numpy as np
+from hmm import HMM
+from emissions import EMISSION_TYPES
+
+# Compiled model file - the decode ready arrays of an HMM (log probs, cholesky factors, whiteners..)
+# stored aligned after a small header so loading is a memory map & no linear algebra
+#
+# Layout:
+#   MAGIC (8 bytes) | header length (uint32 little endian) | JSON header | padding | arrays
+# The header holds the format version, N, D, covariance type, phoneme list (& the phoneme of each sub state),
+# the array layout (offset from the data start, shape, dtype) & a crc32 of the data
+# Convert the training npz with: python model_format.py convert phonems_arrays.npz hmm_model.sttm
+
+MAGIC = b"STTHMM\x00\x00"
+FORMAT_VERSION = 1
+ALIGNMENT = 64 # Bytes - every array starts on a cache line
+
+_LENGTH = struct.Struct("<I")
+
+
+class ModelFormatError(ValueError):
+    pass
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def array_layout(arrays):
+    # {name: (offset, shape, dtype str)} of the arrays packed one after the other & aligned
+    # Returns the layout and the total size in bytes
+    layout = {}
+    size = 0
+    for name, array in arrays.items():
+        offset = _align(size)
+        layout[name] = (offset, array.shape, array.dtype.str)
+        size = offset + array.nbytes
+    return layout, size
+
+def array_views(buffer, layout, offset=0):
+    # Read only ndarrays over a buffer laid out by array_layout - no copy
+    arrays = {}
+    for name, (array_offset, shape, dtype) in layout.items():
+        array = np.ndarray(tuple(shape), dtype=dtype, buffer=buffer, offset=offset + array_offset)
+        array.flags.writeable = False
+        arrays[name] = array
+    return arrays
+
+def pack_arrays(arrays):
+    # Arrays -> (layout, bytearray of the data) laid out by array_layout
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout, size = array_layout(arrays)
+    data = bytearray(size)
+    for name, array in arrays.items():
+        offset, shape, dtype = layout[name]
+        np.ndarray(shape, dtype=dtype, buffer=data, offset=offset)[...] = array
+    return layout, data
+
+def write_file(filepath, magic, header, data):
+    # MAGIC | header length | JSON header | padding | data - shared by the model & the lexicon files
+    # Returns the file size in bytes
+    header_bytes = json.dumps(header).encode("utf-8")
+    prefix = magic + _LENGTH.pack(len(header_bytes)) + header_bytes
+    padding = b"\x00" * (_align(len(prefix)) - len(prefix))
+    with open(filepath, "wb") as f:
+        f.write(prefix + padding)
+        f.write(data)
+    return len(prefix) + len(padding) + len(data)
+
+def map_file(filepath, magic, kind, verify=True):
+    # Memory maps a file written by write_file
+    # Returns (mapping, header, data offset) - checks the magic, the size &, with verify, the crc32 of the data
+    with open(filepath, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if bytes(mapping[:len(magic)]) != magic:
+        raise ModelFormatError(f"not a compiled STT {kind} file")
+    (header_length,) = _LENGTH.unpack_from(mapping, len(magic))
+    header_start = len(magic) + _LENGTH.size
+    header = json.loads(bytes(mapping[header_start:header_start + header_length]))
+
+    data_offset = _align(header_start + header_length)
+    if len(mapping) < data_offset + header["data_size"]:
+        raise ModelFormatError(f"{kind} file is truncated")
+    if verify:
+        data = memoryview(mapping)[data_offset:data_offset + header["data_size"]]
+        checksum = zlib.crc32(data)
+        data.release()
+        if checksum != header["checksum"]:
+            raise ModelFormatError(f"{kind} checksum mismatch - the file is corrupted")
+    return mapping, header, data_offset
+
+def save_model(hmm, filepath, phonemes):
+    layout, data = pack_arrays(hmm.export_arrays())
+    header = {
+        "version": FORMAT_VERSION,
+        "num_states": hmm.N,
+        "mfcc_dim": hmm.mfcc_dim,
+        "covariance_type": hmm.emissions.emission_type, # One of emissions.EMISSION_TYPES
+        "phonemes": list(phonemes),
+        "state_phonemes": [list(phonemes).index(hmm.index_map[i]) for i in range(hmm.N)], # Phoneme of each (sub) state
+        "layout": layout,
+        "data_size": len(data),
+        "checksum": zlib.crc32(data),
+    }
+    size = write_file(filepath, MAGIC, header, data)
+    print(f"model saved to {filepath} ({size / 1024:.1f} KB)")
+
+def check_header(header):
+    if header["version"] != FORMAT_VERSION:
+        raise ModelFormatError(f"model format version {header['version']}, expected {FORMAT_VERSION}")
+    if header["covariance_type"] not in EMISSION_TYPES:
+        raise ModelFormatError(f"unsupported covariance type '{header['covariance_type']}'")
+
+def load_model(filepath, expected_phonemes=None, verify=True, forward_backward_mode="log"):
+    # Memory maps the file & builds the HMM over read only views of it
+    # verify - checks the crc32 of the data (reads the whole file once)
+    mapping, header, data_offset = map_file(filepath, MAGIC, "model", verify)
+    check_header(header)
+    if expected_phonemes is not None and header["phonemes"] != list(expected_phonemes):
+        raise ModelFormatError("model phoneme list doesn't match the phoneme set of this server")
+
+    phonemes = header["phonemes"]
+    state_phonemes = header.get("state_phonemes", range(header["num_states"]))
+    index_map = {i: phonemes[p] for i, p in enumerate(state_phonemes)}
+    meta = {
+        "num_states": header["num_states"],
+        "mfcc_dim": header["mfcc_dim"],
+        "state_map": {phoneme: i for i, phoneme in reversed(index_map.items())}, # phoneme -> its first state
+        "index_map": index_map,
+        "emission_type": header["covariance_type"],
+    }
+    arrays = array_views(mapping, header["layout"], data_offset)
+    for name, array in arrays.items():
+        if name in ("log_pi", "log_A") and array.shape[0] != meta["num_states"]:
+            raise ModelFormatError(f"'{name}' shape {array.shape} doesn't match N={meta['num_states']}")
+
+    return HMM.from_arrays(meta, arrays, forward_backward_mode)
+
+def convert_npz(npz_path, model_path):
+    # Training parameters (phonems_arrays.npz) -> compiled model file
+    # With phonemes.STATES_PER_PHONEME > 1 the model is expanded to the left to right topology first
+    # & the emissions are built as phonemes.EMISSION_TYPE
+    import phonemes as ph
+
+    loaded = ph.load_array_params(npz_path)
+    if loaded is None:
+        raise ModelFormatError(f"couldn't load parameters from {npz_path}")
+    initial_p, transition_m, emission_m, emission_c = loaded
+    ph.check_array_shapes(initial_p, transition_m, emission_m, emission_c)
+
+    params = dict(ph.HMM_PARAMS)
+    params.update(initial_probs=initial_p, transition_matrix=transition_m,
+                  emission_means=emission_m, emission_covariances=emission_c)
+    if ph.STATES_PER_PHONEME > 1:
+        params = ph.expand_to_left_to_right(params, ph.STATES_PER_PHONEME)
+    save_model(HMM(params), model_path, ph.PHONEMES)
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import subprocess
+
+    usage = "usage: python model_format.py convert <params.npz> <model.sttm> | bench <params.npz> <model.sttm>"
+    if len(sys.argv) != 4 or sys.argv[1] not in ("convert", "bench"):
+        sys.exit(usage)
+    command, npz_path, model_path = sys.argv[1], os.path.abspath(sys.argv[2]), os.path.abspath(sys.argv[3])
+
+    if command == "convert":
+        convert_npz(npz_path, model_path)
+        sys.exit(0)
+
+    # Cold start of each loader in a fresh interpreter (imports excluded)
+    loaders = {
+        "npz + factorize": f"import phonemes as ph; from hmm import HMM; HMM(ph.init_hmm_params({npz_path!r}))",
+        "compiled": f"import model_format; model_format.load_model({model_path!r})",
+        "compiled, no verify": f"import model_format; model_format.load_model({model_path!r}, verify=False)",
+    }
+    for label, statement in loaders.items():
+        code = ("import io, contextlib, time, phonemes, hmm, model_format\n"
+                f"t = time.perf_counter()\nwith contextlib.redirect_stdout(io.StringIO()): {statement}\n"
+                "print(time.perf_counter() - t)")
+        times = [float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                      cwd=os.path.dirname(os.path.abspath(__file__))).stdout)
+                 for _ in range(5)]
+        print(f"{label:>20}: {1000 * min(times):.2f} ms (best of 5)")
@@ -1,6 +1,10 @@
+import os
 import numpy as np
 
 PARAMS_FILE = "phonems_arrays.npz" 
+MODEL_FILE = "hmm_model.sttm" # Compiled from PARAMS_FILE by model_format.py - used for serving when present
+LEXICON_FILE = "lexicon.sttl" # Compiled pronunciation dictionary (lexicon.py) - transcripts are words when present
+LANGUAGE_MODEL_FILE = "lm.sttlm" # Compiled ARPA n-gram model (language_model.py) - used by the word decoder when present
 
 # From https://github.com/cmusphinx/cmudict/blob/master/cmudict.phones
 PHONEMES = [
@@ -50,6 +54,14 @@ NUM_STATES = len(PHONEMES)
 
 MFCC_DIM = 13  # Observation vector dimension
 
+STATES_PER_PHONEME = 1 # 3 for the left to right sub states topology (see expand_to_left_to_right)
+
+SELF_LOOP_PROB = 0.6 # Prob of a sub state staying in itself in the left to right topology
+
+EMISSION_TYPE = "full" # "full", "diag", "tied", "gmm_diag" or "gmm_full" (see emissions.EMISSION_TYPES)
+
+NUM_MIXTURE_COMPONENTS = 4 # Gaussians per state of the gmm emission types
+
 STATE_MAP = {phoneme: i for i, phoneme in enumerate(PHONEMES)} # access states as indexes
 
 INDEX_MAP = {i: phoneme for i, phoneme in enumerate(PHONEMES)} # access states as strings
@@ -72,6 +84,8 @@ HMM_PARAMS = {
     "transition_matrix": TRANSITION_MATRIX,
     "emission_means": EMISION_MEANS,
     "emission_covariances": EMISION_CONVARIOANCES,
+    "emission_type": EMISSION_TYPE,
+    "num_components": NUM_MIXTURE_COMPONENTS,
 }
 
 def _gen_initial_probs(num_states, state_map):
@@ -155,29 +169,36 @@ def load_array_params(filepath):
         print(f"Error loading parameters from {filepath}: {e}")
         return None
 
+def check_array_shapes(initial_p, transition_m, emission_m, emission_c):
+    # Raises ValueError listing every array that doesn't fit NUM_STATES & MFCC_DIM
+    mismatches = []
+    if initial_p.shape != (NUM_STATES,): mismatches.append(f"initial_probs {initial_p.shape}")
+    if transition_m.shape != (NUM_STATES, NUM_STATES): mismatches.append(f"transition_matrix {transition_m.shape}")
+    if emission_m.shape != (NUM_STATES, MFCC_DIM): mismatches.append(f"emission_means {emission_m.shape}")
+    if emission_c.shape != (NUM_STATES, MFCC_DIM, MFCC_DIM): mismatches.append(f"emission_covariances {emission_c.shape}")
+    if mismatches:
+        raise ValueError(f"shape mismatch for N={NUM_STATES}, D={MFCC_DIM}: " + ", ".join(mismatches))
+
 def init_hmm_params(filepath=None):
     loaded_array_data = None
     generate_defaults = True
 
-    if filepath:
+    if filepath and os.path.exists(filepath):
         print(f"Attempting to load parameters from {filepath}...")
         loaded_array_data = load_array_params(filepath)
 
-        if loaded_array_data:
-            # Check that dimensions match
-            initial_p, transition_m, emission_m, emission_c = loaded_array_data
-            valid = True
-
-            if initial_p.shape != (NUM_STATES,): valid = False; print("Mismatch: initial_probs shape")
-            if transition_m.shape != (NUM_STATES, NUM_STATES): valid = False; print("Mismatch: transition_matrix shape")
-            if emission_m.shape != (NUM_STATES, MFCC_DIM): valid = False; print("Mismatch: emission_means shape")
-            if emission_c.shape != (NUM_STATES, MFCC_DIM, MFCC_DIM): valid = False; print("Mismatch: emission_covariances shape")
+        # An existing file that can't be used is an error - never replaced with random defaults
+        if loaded_array_data is None:
+            print(f"Parameters in {filepath} can't be loaded - leaving the file as is.")
+            return None
+        try:
+            check_array_shapes(*loaded_array_data)
+        except ValueError as e:
+            print(f"Error: {e} - leaving {filepath} as is.")
+            return None
 
-            if valid:
-                print("Using loaded parameters.") # Message for successful load
-                generate_defaults = False
-            else:
-                print("Dimension mismatch. Will generate defaults.")
+        print("Using loaded parameters.") # Message for successful load
+        generate_defaults = False
 
     if generate_defaults:
         print("Generating default parameters...")
@@ -213,5 +234,57 @@ def init_hmm_params(filepath=None):
         "transition_matrix": TRANSITION_MATRIX,
         "emission_means": EMISION_MEANS,
         "emission_covariances": EMISION_CONVARIOANCES,
+        "emission_type": EMISSION_TYPE,
+        "num_components": NUM_MIXTURE_COMPONENTS,
     }
-    return final_params
\ No newline at end of file
+    return final_params
+
+def expand_to_left_to_right(params, states_per_phoneme=3, self_loop_prob=SELF_LOOP_PROB):
+    # Builds the multi state topology from one state per phoneme params
+    # Each phoneme gets a left to right chain of sub states - a sub state loops on itself or moves to the next one
+    # & only the last one leaves the phoneme, to the first sub state of another phoneme with the probs of the
+    # one state transition matrix (without its self loop). The sub states start from their phoneme's emission params
+    # The transitions are sparse - (sources, destinations, probs) instead of a dense matrix
+    num_phonemes = params["num_states"]
+    S = states_per_phoneme
+    num_states = num_phonemes * S
+    first_states = np.arange(num_phonemes) * S
+    last_states = first_states + S - 1
+
+    # 1. Inside the phonemes - self loops & moves to the next sub state
+    sources = [np.arange(num_states)]
+    destinations = [np.arange(num_states)]
+    probs = [np.full(num_states, self_loop_prob)]
+    chain = np.arange(num_states)[np.arange(num_states) % S != S - 1]
+    sources.append(chain)
+    destinations.append(chain + 1)
+    probs.append(np.full(len(chain), 1.0 - self_loop_prob))
+
+    # 2. Between the phonemes - last sub state to the first sub state of the next phoneme
+    between = np.array(params["transition_matrix"], dtype=np.float64)
+    np.fill_diagonal(between, 0.0)
+    row_sums = between.sum(axis=1, keepdims=True)
+    row_sums[row_sums == 0] = 1 # To not divide by zero
+    between /= row_sums
+    from_phonemes, to_phonemes = np.nonzero(between)
+    sources.append(last_states[from_phonemes])
+    destinations.append(first_states[to_phonemes])
+    probs.append((1.0 - self_loop_prob) * between[from_phonemes, to_phonemes])
+
+    # 3. Paths start at the first sub state of a phoneme
+    initial_p = np.zeros(num_states)
+    initial_p[first_states] = params["initial_probs"]
+
+    phonemes = params["phonemes"]
+    expanded = dict(params)
+    del expanded["transition_matrix"]
+    expanded.update({
+        "num_states": num_states,
+        "state_map": {phoneme: first_states[i] for i, phoneme in enumerate(phonemes)}, # phoneme -> its first sub state
+        "index_map": {state: phonemes[state // S] for state in range(num_states)}, # sub state -> its phoneme
+        "initial_probs": initial_p,
+        "transitions": (np.concatenate(sources), np.concatenate(destinations), np.concatenate(probs)),
+        "emission_means": np.repeat(params["emission_means"], S, axis=0),
+        "emission_covariances": np.repeat(params["emission_covariances"], S, axis=0),
+    })
+    return expanded
@@ -1,19 +1,53 @@
 import av              # python wrapper for FFmpegto decode/encode media
 import io              # for in-memory byte streams like files
+import os
+import time
 import numpy as np
-import librosa         # audio analysis for MFCCs
-from hmm import HMM
+from mfcc import compute_mfccs, frame_lengths # native cached MFCCs
+from hmm import HMM, StreamingViterbi
+from batching import MicroBatcher
+from vad import VoiceActivityDetector, StreamingVad
+import shared_model
+import model_format
+import metrics
+import profiling
 import phonemes as ph
+from lexicon import Lexicon
+from language_model import LanguageModel
+from word_decoder import DecodingNetwork, WordDecoder
 
 hmm_model = None
+word_network = None # Lexicon tree over the HMM states - None transcribes to phonemes
+decode_batcher = None # MicroBatcher in front of the decoder - None decodes each chunk on its own
+emission_batcher = None # MicroBatcher of the emission tables the word decoder searches - with decode_batcher
+
+STREAM_BLOCK_SECONDS = 0.25 # Decoded audio gathered in a stream before running MFCC & Viterbi on it
+
+TARGET_SAMPLE_RATE = 16000 # Rate the audio is resampled to while decoding - enough for speech
+
+# Silent chunks are answered right after the audio decode & voiced ones are trimmed to their speech
+# In a stream only the speech is decoded - vad = None runs every chunk & stream through the whole pipeline
+vad = VoiceActivityDetector(TARGET_SAMPLE_RATE)
 
 def load_hmm():
     global hmm_model
 
+    # The compiled model is a memory map - no parsing or factorizing at startup
+    if os.path.exists(ph.MODEL_FILE):
+        try:
+            hmm_model = model_format.load_model(ph.MODEL_FILE, expected_phonemes=ph.PHONEMES)
+            print(f"STT: HMM model loaded from {ph.MODEL_FILE}.")
+            return
+        except Exception as e:
+            print(f"STT ERROR: compiled model {ph.MODEL_FILE} can't be used ({e}) - falling back to {ph.PARAMS_FILE}")
+
     ph.HMM_PARAMS = ph.init_hmm_params(ph.PARAMS_FILE)
     if ph.HMM_PARAMS:
         try:
-            hmm_model = HMM(ph.HMM_PARAMS)
+            params = ph.HMM_PARAMS
+            if ph.STATES_PER_PHONEME > 1:
+                params = ph.expand_to_left_to_right(params, ph.STATES_PER_PHONEME)
+            hmm_model = HMM(params)
             print("STT: HMM model loaded/initialized.")
         except Exception as e:
             hmm_model = None
@@ -22,6 +56,120 @@ def load_hmm():
         hmm_model = None
         print("STT ERROR: HMM Parameter init failed.")
 
+def load_shared_hmm(descriptor):
+    # Worker process startup - attaches to the parameters the parent published (see shared_model)
+    global hmm_model
+    try:
+        hmm_model = shared_model.attach_model(descriptor)
+        print("STT: HMM model attached from shared memory.")
+    except Exception as e:
+        hmm_model = None
+        print(f"STT ERROR: HMM shared memory attach failed: {e}")
+    load_lexicon() # A memory map of the file - each worker maps the same pages
+
+def load_lexicon():
+    # Word transcripts when the compiled lexicon is there - otherwise the transcripts stay phonemes
+    global word_network
+    word_network = None
+    if hmm_model is None or not os.path.exists(ph.LEXICON_FILE):
+        return
+    try:
+        lexicon = Lexicon.load(ph.LEXICON_FILE, expected_phonemes=ph.PHONEMES)
+        print(f"STT: Lexicon loaded from {ph.LEXICON_FILE} ({lexicon.num_words} words).")
+    except Exception as e:
+        print(f"STT ERROR: lexicon {ph.LEXICON_FILE} can't be used ({e}) - transcribing to phonemes")
+        return
+
+    language_model = None
+    if os.path.exists(ph.LANGUAGE_MODEL_FILE):
+        try:
+            language_model = LanguageModel.load(ph.LANGUAGE_MODEL_FILE)
+            print(f"STT: Language model loaded from {ph.LANGUAGE_MODEL_FILE} (order {language_model.order}).")
+        except Exception as e:
+            print(f"STT ERROR: language model {ph.LANGUAGE_MODEL_FILE} can't be used ({e}) - decoding without it")
+    word_network = DecodingNetwork(hmm_model, lexicon, language_model)
+
+def enable_batching(window_ms, max_batch_size):
+    # Chunks decoded at the same time from different request threads are decoded as one batch
+    # Word transcripts batch the emissions only - the token passing over the lexicon runs per chunk
+    global decode_batcher, emission_batcher
+    if hmm_model is None:
+        print("STT ERROR: HMM not init for batching.")
+        return
+    for batcher in (decode_batcher, emission_batcher):
+        if batcher is not None:
+            batcher.close()
+    decode_batcher = MicroBatcher(hmm_model.viterbi_decode_batch, window_ms=window_ms, max_batch_size=max_batch_size,
+                                  name="viterbi")
+    emission_batcher = MicroBatcher(hmm_model.log_emission_matrices, window_ms=window_ms,
+                                    max_batch_size=max_batch_size, name="emissions")
+    print(f"STT: Micro-batching decoder - window {window_ms}ms, max batch {max_batch_size}")
+
+class _SampleBuffer:
+    # Preallocated float32 buffer that grows by doubling - decoded audio is written straight into it
+    def __init__(self, capacity=TARGET_SAMPLE_RATE):
+        self.data = np.empty(capacity, dtype=np.float32)
+        self.size = 0
+
+    def append(self, samples):
+        end = self.size + len(samples)
+        if end > len(self.data):
+            grown = np.empty(max(end, 2 * len(self.data)), dtype=np.float32)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:end] = samples
+        self.size = end
+
+    def view(self):
+        return self.data[:self.size]
+
+    def clear(self):
+        self.size = 0
+
+def _make_resampler(target_rate):
+    # Mono float32 at the target rate - the channel mix & rate conversion are done by FFmpeg while decoding
+    return av.AudioResampler(format='flt', layout='mono', rate=target_rate)
+
+def _resample_into(resampler, frame, buffer):
+    # frame=None flushes the samples the resampler still holds
+    for resampled in resampler.resample(frame):
+        buffer.append(resampled.to_ndarray()[0]) # packed mono -> (1, samples)
+
+def decode_audio(audio_file, target_rate=TARGET_SAMPLE_RATE):
+    # Decodes an uploaded webm file into a single mono float32 signal at target_rate
+    # Reads from the file object itself - the upload is never copied into memory as a whole
+    try:
+        with av.open(audio_file, format='webm') as container:
+            if not container.streams.audio:
+                return None, None
+
+            # Get the first available audio stream from the container
+            stream = container.streams.audio[0]
+            resampler = _make_resampler(target_rate)
+            # Starts with room for the expected 1 second chunks
+            samples = _SampleBuffer(target_rate)
+
+            # The resampling runs between the decoded frames - its time is taken out of the decode stage
+            start = time.perf_counter()
+            resample_time = 0.0
+            for frame in container.decode(stream):
+                resample_start = time.perf_counter()
+                _resample_into(resampler, frame, samples)
+                resample_time += time.perf_counter() - resample_start
+            resample_start = time.perf_counter()
+            _resample_into(resampler, None, samples)
+            end = time.perf_counter()
+            resample_time += end - resample_start
+
+        metrics.stage_seconds.observe(end - start - resample_time, "decode")
+        metrics.stage_seconds.observe(resample_time, "resample")
+        return samples.view(), target_rate
+
+    except Exception as e:
+        metrics.errors.inc(label="decode")
+        print(f"STT ERROR: Audio decoding failed: {e}")
+        return None, None
+
 def get_audio_frames(audio_file):
     try:
         webm_data = audio_file.read() # Read all binary data from the uploaded file
@@ -54,6 +202,21 @@ def audio_frames_to_mfccs(audio_frames, sample_rate):
     if not audio_frames or sample_rate is None:
         return None
 
+    audio_data = audio_frames_to_samples(audio_frames)
+    if audio_data is None:
+        return None
+
+    mfccs = samples_to_mfccs(audio_data, sample_rate)
+    if mfccs is not None and mfccs.shape[0] == 0:
+        print("STT WARNING: 0 MFCC frames extracted.")
+        return None
+    return mfccs
+
+def audio_frames_to_samples(audio_frames):
+    # Stitches the decoded frames into a single mono float32 signal in [-1.0, 1.0]
+    if not audio_frames:
+        return None
+
     # Stitch Frames
     try:
         # Determine audio structure- mono or planar- from first frame's shape
@@ -96,22 +259,22 @@ def audio_frames_to_mfccs(audio_frames, sample_rate):
         print(f"STT ERROR during audio prep: {e}")
         return None
 
-    # Extract MFCCs
+    return audio_data
+
+def samples_to_mfccs(audio_data, sample_rate, center=True):
+    # Extract MFCCs - (num frames, mfcc_dim)
     if hmm_model is None: print("STT ERROR: HMM not init for MFCC."); return None
     try:
-        # y-> input audio- 1D float32 array, sr-> sample rate
-        # n_mfcc = num of coefficients to return
-        mfccs = librosa.feature.mfcc(y=audio_data,
-                                     sr=sample_rate,
-                                     n_mfcc=hmm_model.mfcc_dim).T # the hmm input is the opposite
-        
-        if mfccs.shape[0] == 0:
-            print("STT WARNING: 0 MFCC frames extracted.")
-            return None
-        
-        return mfccs
-    
+        # audio_data-> input audio- 1D float32 array, n_mfcc = num of coefficients to return
+        # center=False only takes the windows that fit completely in the audio (used when streaming)
+        # The window & hop follow the sample rate so a frame is 10.7ms of audio at any rate
+        # No top_db clipping like librosa's default - it's relative to the loudest frame of the chunk
+        # so a frame would depend on its neighbours
+        with metrics.stage_seconds.time("mfcc"):
+            return compute_mfccs(audio_data, sample_rate, n_mfcc=hmm_model.mfcc_dim, center=center, top_db=None)
+
     except Exception as e:
+        metrics.errors.inc(label="mfcc")
         print(f"STT ERROR during MFCC extraction: {e}")
         return None
 
@@ -125,24 +288,317 @@ def decode_sequence(mfccs):
         return "[MFCC Dim Error]"
 
     try:
+        if decode_batcher is not None:
+            # The batch computes the emissions of all its chunks - the wait & the emissions are in the viterbi time
+            with metrics.stage_seconds.time("viterbi"):
+                path_indices, _ = decode_batcher.decode(mfccs)
+        else:
+            with metrics.stage_seconds.time("emissions"):
+                log_B = hmm_model._log_emission_matrix(mfccs)
+            with metrics.stage_seconds.time("viterbi"):
+                path_indices, _ = hmm_model.viterbi_decode(mfccs, log_B)
+        with metrics.stage_seconds.time("postprocess"):
+            return " ".join(path_to_phonemes(path_indices))
+    except Exception as e:
+        # Catch any errors during the Viterbi decoding process
+        metrics.errors.inc(label="viterbi")
+        print(f"STT Error during Viterbi decode: {e}")
+        return "[Decoding Error]"
 
-        path_indices, _ = hmm_model.viterbi_decode(mfccs)
-
-        # Convert the sequence of states back to phonemes
-        phoneme_list = [hmm_model.index_map[idx] for idx in path_indices]
+def _frame_time(frame):
+    # Start of an MFCC frame in seconds of the decoded audio
+    return round(frame * frame_lengths(TARGET_SAMPLE_RATE)[1] / TARGET_SAMPLE_RATE, 3)
 
-        # Post-process raw phoneme sequence
-        recognized_text = ""
-        if phoneme_list:
-            # Remove same phoneme sequences
-            processed = [p for i, p in enumerate(phoneme_list) if i == 0 or p != phoneme_list[i-1]]
-            
-            # Remove silence tokens
-            final = [p for p in processed if p != 'SIL']
+def words_to_json(words, offset=0.0):
+    # (word, first frame, last frame) -> {'word', 'start', 'end'} in seconds from offset
+    return [{'word': word, 'start': round(offset + _frame_time(start), 3), 'end': round(offset + _frame_time(end + 1), 3)}
+            for word, start, end in words]
 
-            recognized_text = " ".join(final)
-        return recognized_text
+def decode_words(mfccs):
+    # Token passing over the lexicon - list of (word, first frame, last frame), None on errors
+    if hmm_model is None or word_network is None:
+        return None
+    if not isinstance(mfccs, np.ndarray) or mfccs.ndim != 2 or mfccs.shape[1] != hmm_model.mfcc_dim:
+        return None
+    try:
+        with metrics.stage_seconds.time("emissions"): # With batching - the wait for the batch included
+            if emission_batcher is not None:
+                log_B = emission_batcher.decode(mfccs)
+            else:
+                log_B = hmm_model._log_emission_matrix(np.asarray(mfccs, dtype=np.float64))
+        with metrics.stage_seconds.time("viterbi"): # Token passing - the viterbi search over the lexicon
+            return WordDecoder(hmm_model, word_network).decode(mfccs, log_B)
     except Exception as e:
-        # Catch any errors during the Viterbi decoding process
-        print(f"STT Error during Viterbi decode: {e}")
-        return "[Decoding Error]"
\ No newline at end of file
+        metrics.errors.inc(label="viterbi")
+        print(f"STT Error during word decode: {e}")
+        return None
+
+def transcribe(audio_file, deadline=None):
+    # The whole /get-audio pipeline for one uploaded chunk - returns (response body, http status)
+    # deadline - time.time() after which the chunk is stale & dropped between the stages
+    def expired():
+        return deadline is not None and time.time() > deadline
+
+    if expired():
+        return {'error': 'Deadline exceeded'}, 504
+
+    # 1. Decode audio to mono samples at the target rate
+    audio_data, sample_rate = decode_audio(audio_file)
+
+    if audio_data is None:
+        return {'error': 'Audio decoding failed'}, 500
+
+    if len(audio_data) == 0:
+        return {'message': 'No frames decoded', 'text': ''}, 200
+    metrics.audio_seconds.inc(len(audio_data) / sample_rate, "chunk")
+
+    # 2. Voice activity - nothing to decode in silence, the speech is cut out of the chunk
+    offset = 0.0 # Seconds trimmed from the start - the word times are from the start of the chunk
+    if vad is not None:
+        with metrics.stage_seconds.time("vad"):
+            speech = vad.trim(audio_data)
+        if speech is None:
+            return {'message': 'No speech', 'text': ''}, 200
+        start, end = speech
+        audio_data = audio_data[start:end]
+        offset = start / sample_rate
+
+    if expired():
+        return {'error': 'Deadline exceeded'}, 504
+
+    # 3. Convert samples to MFCCs
+    mfccs = samples_to_mfccs(audio_data, sample_rate)
+    if mfccs is None or len(mfccs) == 0:
+        return {'message': 'MFCC extraction failed', 'text': ''}, 200
+
+    if expired():
+        return {'error': 'Deadline exceeded'}, 504
+
+    # 4. Decode MFCCs and return text - words with their times when there is a lexicon
+    if word_network is not None:
+        words = decode_words(mfccs)
+        if words is None:
+            return {'message': 'Word decoding failed', 'text': '[Decoding Error]', 'words': []}, 200
+        with metrics.stage_seconds.time("postprocess"):
+            text, words = " ".join(w for w, _, _ in words), words_to_json(words, offset)
+        return {'message': 'Audio processed successfully', 'text': text, 'words': words}, 200
+
+    recognized_text = decode_sequence(mfccs)
+
+    return {'message': 'Audio processed successfully', 'text': recognized_text}, 200
+
+def transcribe_bytes(webm_data, deadline=None, profile=False):
+    # transcribe for the uploaded bytes - what the async server sends to its worker processes
+    # Returns (response body, http status, metric observations) - the server records the observations,
+    # the metrics of a worker process aren't the ones /metrics shows
+    # profile - profiled in the worker, see profiling
+    with metrics.capture() as observations, profiling.maybe_profile(profile, "get-audio"):
+        body, status = transcribe(io.BytesIO(webm_data), deadline)
+    return body, status, observations
+
+def path_to_phonemes(path_indices, previous_state=None):
+    # Convert the sequence of states back to phonemes
+    # A phoneme starts when the path moves into the first sub state of a phoneme - the self loops & the
+    # other sub states of a multi state phoneme collapse into it
+    # previous_state is the last state of an earlier part of the same stream
+    processed = []
+    for i, state in enumerate(path_indices):
+        prev = path_indices[i-1] if i > 0 else previous_state
+        if state != prev and hmm_model.entry_states[state]:
+            processed.append(hmm_model.index_map[state])
+
+    # Remove silence tokens
+    return [p for p in processed if p != 'SIL']
+
+
+class StreamingMfcc:
+    # MFCCs of a signal that arrives in blocks of any size
+    # Keeps the samples of the windows that are not complete yet so each frame is computed once and
+    # the output is exactly the frames samples_to_mfccs gives for the whole signal at once
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.n_fft, self.hop_length = frame_lengths(sample_rate) # The ones samples_to_mfccs uses
+        self.reset()
+
+    def reset(self):
+        # Start with the same zero padding a centered whole signal MFCC adds before the first sample
+        self.buffer = np.zeros(self.n_fft // 2, dtype=np.float32)
+        self.frames_extracted = 0
+
+    def push(self, samples):
+        # Adds samples & returns the MFCCs of all the windows completed by them (may be 0 frames)
+        self.buffer = np.concatenate([self.buffer, np.asarray(samples, dtype=np.float32)])
+        return self._extract()
+
+    def flush(self):
+        # End of signal - pads the end like a centered MFCC & returns the last frames
+        self.buffer = np.concatenate([self.buffer, np.zeros(self.n_fft // 2, dtype=np.float32)])
+        mfccs = self._extract()
+        self.reset()
+        return mfccs
+
+    def _extract(self):
+        num_frames = 0
+        if len(self.buffer) >= self.n_fft:
+            num_frames = 1 + (len(self.buffer) - self.n_fft) // self.hop_length
+        if num_frames == 0:
+            return np.empty((0, hmm_model.mfcc_dim), dtype=np.float32)
+
+        # Only the samples of complete windows, the rest (n_fft - hop) & up stays for the next push
+        used = (num_frames - 1) * self.hop_length + self.n_fft
+        mfccs = samples_to_mfccs(self.buffer[:used], self.sample_rate, center=False)
+        self.buffer = self.buffer[num_frames * self.hop_length:]
+        self.frames_extracted += num_frames
+        return mfccs
+
+
+class _ReceiveStream:
+    # Read only file object over the messages of a streaming connection
+    # Lets PyAV demux a single continuous webm stream while it's still arriving
+    def __init__(self, receive):
+        self.receive = receive # Blocking - returns the next binary message, None or text ends the stream
+        self.buffer = bytearray()
+        self.ended = False
+
+    def read(self, size=-1):
+        # Waits only until there is some data - not until size bytes so decoding follows the stream closely
+        while not self.buffer and not self.ended:
+            message = self.receive()
+            if not message or isinstance(message, str):
+                self.ended = True
+            else:
+                self.buffer += message
+
+        if size is None or size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+class StreamSession:
+    # State of one speaker's audio stream - the demuxer/decoder, the Viterbi decoder & the transcript so far
+    def __init__(self):
+        self.viterbi = StreamingViterbi(hmm_model)
+        # Word transcripts with a lexicon - a word is sent once every hypothesis still alive agrees on it
+        self.words = WordDecoder(hmm_model, word_network) if word_network is not None else None
+        self.mfcc = StreamingMfcc(TARGET_SAMPLE_RATE)
+        self.resampler = _make_resampler(TARGET_SAMPLE_RATE)
+        self.last_state = None # So phonemes repeated across two updates are merged
+        self.pending_samples = _SampleBuffer(TARGET_SAMPLE_RATE)
+        # Voice activity - the MFCCs are computed over the whole stream so the windows stay continuous, but
+        # only the frames in speech are decoded & the decoder is finished at every end of speech
+        self.vad = StreamingVad(vad) if vad is not None else None
+        self.queued_mfccs = np.empty((0, hmm_model.mfcc_dim), dtype=np.float32) # Waiting for their VAD decision
+        self.mfcc_frames_gated = 0 # Stream index of the first queued MFCC frame
+        self.speech = np.zeros(0, dtype=bool) # VAD decisions from the frame of the first queued MFCC frame on
+        self.speech_start = 0 # VAD frame index of speech[0]
+        self.in_speech = False # Whether the last decoded frame was speech
+
+    def run(self, receive):
+        # Decodes the stream while it arrives & yields (text, is_final) for every transcript update
+        if hmm_model is None:
+            print("STT ERROR: HMM not init for streaming.")
+            return
+
+        try:
+            container = av.open(_ReceiveStream(receive), format='webm')
+        except Exception as e:
+            print(f"STT ERROR: Stream opening failed: {e}")
+            return
+
+        with container:
+            if not container.streams.audio:
+                return
+            stream = container.streams.audio[0]
+            block_samples = int(TARGET_SAMPLE_RATE * STREAM_BLOCK_SECONDS)
+
+            try:
+                for frame in container.decode(stream):
+                    _resample_into(self.resampler, frame, self.pending_samples)
+
+                    if self.pending_samples.size >= block_samples:
+                        text = self._decode_pending()
+                        if text:
+                            yield text, False
+            except Exception as e:
+                # A stream cut in the middle of a frame - keep what was decoded until there
+                print(f"STT WARNING: Stream decoding stopped: {e}")
+
+        # End of stream - decode the rest & flush the resampler, the MFCC, the VAD & the decoder
+        _resample_into(self.resampler, None, self.pending_samples)
+        texts = [self._decode_pending()]
+        texts.append(self._gate(self.mfcc.flush(), self.vad.flush() if self.vad is not None else None, final=True))
+        texts.append(self._finish())
+        yield " ".join(filter(None, texts)), True
+
+    def _decode_pending(self):
+        if self.pending_samples.size == 0:
+            return ""
+        metrics.audio_seconds.inc(self.pending_samples.size / TARGET_SAMPLE_RATE, "stream")
+        samples = self.pending_samples.view()
+        mfccs = self.mfcc.push(samples) # copied into the MFCC window buffer
+        decisions = self.vad.push(samples) if self.vad is not None else None
+        self.pending_samples.clear()
+        return self._gate(mfccs, decisions)
+
+    def _gate(self, mfccs, decisions, final=False):
+        # Decodes the MFCC frames whose VAD frame (the one of the window center) is decided & in speech
+        # The VAD decides later than the MFCCs are computed (its smoothing looks ahead), so frames wait in a queue
+        if self.vad is None:
+            return self._decode_mfccs(mfccs)
+        metrics.vad_frames.inc(int(np.count_nonzero(decisions)), "kept")
+        metrics.vad_frames.inc(int(len(decisions) - np.count_nonzero(decisions)), "skipped")
+        self.speech = np.concatenate([self.speech, decisions])
+        self.queued_mfccs = np.concatenate([self.queued_mfccs, mfccs])
+
+        # 1. VAD frame of every queued MFCC frame - centered MFCC windows, frame k is centered on sample k * hop
+        centers = (self.mfcc_frames_gated + np.arange(len(self.queued_mfccs))) * self.mfcc.hop_length
+        vad_frames = centers // vad.frame_length - self.speech_start
+        if final:
+            # The samples after the last whole VAD frame go with it
+            vad_frames = np.minimum(vad_frames, len(self.speech) - 1)
+        ready = np.count_nonzero(vad_frames < len(self.speech))
+        in_speech = self.speech[vad_frames[:ready]] if len(self.speech) else np.zeros(ready, dtype=bool)
+        mfccs = self.queued_mfccs[:ready]
+        self.queued_mfccs = self.queued_mfccs[ready:]
+        self.mfcc_frames_gated += ready
+        drop = min(self.mfcc_frames_gated * self.mfcc.hop_length // vad.frame_length - self.speech_start, len(self.speech))
+        self.speech = self.speech[drop:]
+        self.speech_start += drop
+
+        # 2. Runs of speech are decoded, the decoder is finished where a run ends
+        texts = []
+        boundaries = np.flatnonzero(np.diff(in_speech.view(np.int8))) + 1
+        for run in np.split(np.arange(ready), boundaries):
+            if len(run) == 0:
+                continue
+            if in_speech[run[0]]:
+                texts.append(self._decode_mfccs(mfccs[run]))
+                self.in_speech = True
+            elif self.in_speech:
+                texts.append(self._finish())
+                self.in_speech = False
+        return " ".join(filter(None, texts))
+
+    def _decode_mfccs(self, mfccs):
+        if self.words is not None:
+            self.words.push(mfccs)
+            return " ".join(word for word, _, _ in self.words.stable_words())
+        return self._path_to_text(self.viterbi.push(mfccs))
+
+    def _finish(self):
+        # Text of the rest of the speech once it ended - the decoder starts over with the next speech
+        if self.words is not None:
+            return " ".join(word for word, _, _ in self.words.finish())
+        final_path, _ = self.viterbi.flush()
+        text = self._path_to_text(final_path)
+        self.last_state = None # A phoneme after the pause is a new one
+        return text
+
+    def _path_to_text(self, path_indices):
+        if len(path_indices) == 0:
+            return ""
+        phonemes = path_to_phonemes(path_indices, self.last_state)
+        self.last_state = path_indices[-1]
+        return " ".join(phonemes)
\ No newline at end of file
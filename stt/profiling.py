@@ -0,0 +1,98 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# On demand profiling of single requests - for the chunk that is slow in production
+# A request is profiled when it asks for it (?profile=1 or the X-Profile: 1 header) or is picked by the
+# sampling rate. Its pipeline runs under cProfile & tracemalloc, the results go to PROFILE_DIR:
+#   <time>-<pid>-<name>.prof - pstats file, open with: python -m pstats file.prof (or snakeviz)
+#   <time>-<pid>-<name>.txt  - wall time, allocation peak & the hottest functions of the STT modules
+# Only the newest PROFILE_KEEP profiles are kept
+# Requests that aren't profiled only pay for the flag check - nothing is hooked until a request is picked
+
+PROFILE_DIR = os.environ.get("STT_PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_RATE = float(os.environ.get("STT_PROFILE_SAMPLE_RATE", 0)) # Fraction of the requests profiled
+PROFILE_KEEP = int(os.environ.get("STT_PROFILE_KEEP", 50))
+
+SUMMARY_FUNCTIONS = 30 # Functions listed in the .txt summary
+STT_MODULES = r"(processor|hmm|emissions|mfcc|vad|word_decoder|language_model|lexicon|batching)\.py"
+
+# cProfile & tracemalloc are per process (one profiler at a time since python 3.12) - a request that
+# is picked while another one is profiled runs without profiling
+_lock = threading.Lock()
+
+
+def requested(flag):
+    # True when a request asks for a profile (query flag or header value) or the sampling picks it
+    if flag is not None and flag.lower() in ("1", "true", "yes"):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def maybe_profile(enabled, name):
+    # profile(name) for the picked requests, a no-op context for the others
+    return profile(name) if enabled else nullcontext()
+
+@contextmanager
+def profile(name):
+    # Profiles the body of the with statement & writes the results to PROFILE_DIR
+    if not _lock.acquire(blocking=False):
+        yield
+        return
+    try:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            wall_time = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            try:
+                _write(profiler, name, wall_time, peak)
+            except OSError as e:
+                print(f"STT: profile of {name} not written: {e}")
+    finally:
+        _lock.release()
+
+def _write(profiler, name, wall_time, peak):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    now = time.time()
+    stem = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(1000 * now) % 1000:03d}-{os.getpid()}-{name}"
+    path = os.path.join(PROFILE_DIR, stem)
+    profiler.dump_stats(path + ".prof")
+
+    # Summary - the STT functions by cumulative time
+    out = io.StringIO()
+    out.write(f"{name}: {1000 * wall_time:.2f} ms wall, {peak / 2**20:.2f} MB allocation peak\n\n")
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats("cumulative").print_stats(STT_MODULES, SUMMARY_FUNCTIONS)
+    with open(path + ".txt", "w") as f:
+        f.write(out.getvalue())
+
+    _rotate()
+    print(f"STT: profile of {name} written to {path}.prof")
+
+def _rotate():
+    # Removes the oldest profiles past PROFILE_KEEP - the names start with the time, so they sort by age
+    stems = sorted({os.path.splitext(filename)[0] for filename in os.listdir(PROFILE_DIR)
+                    if filename.endswith((".prof", ".txt"))})
+    for stem in stems[:max(0, len(stems) - PROFILE_KEEP)]:
+        for extension in (".prof", ".txt"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, stem + extension))
+            except FileNotFoundError:
+                pass # Removed by another worker process
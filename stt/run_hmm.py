@@ -1,6 +1,11 @@
+import copy
+import contextlib
+import io
+import time
 import numpy as np
 from hmm import HMM
 import phonemes as ph
+import model_format
 from scipy.special import logsumexp 
 
 def print_hmm_params(hmm_params_dict):
@@ -38,6 +43,15 @@ def setup_hmm(load_from_file=True):
         return None, params
     return hmm, params
 
+def setup_large_sparse_hmm(params, states_per_phoneme=75, mean_jitter=0.1):
+    # Large sparse topology (3000 states with the 40 phonemes) to measure the decoders where beam pruning pays off
+    # The sub states get jittered copies of their phoneme's means so they don't all score the same
+    if params is None: return None
+    expanded = ph.expand_to_left_to_right(params, states_per_phoneme=states_per_phoneme)
+    expanded["emission_means"] = expanded["emission_means"] + mean_jitter * np.random.randn(*expanded["emission_means"].shape)
+    print(f"\n=== Building Sparse HMM ({expanded['num_states']} states, {len(expanded['transitions'][0])} transitions) ===")
+    return HMM(expanded)
+
 def generate_dummy_sequences(num_sequences=10, avg_len=50, mfcc_dim=ph.MFCC_DIM):
     if num_sequences <= 0 or avg_len <= 0 or mfcc_dim <= 0: return []
     print(f"\n=== Generating {num_sequences} Dummy Observation Sequence(s) (Avg Len={avg_len}) ===")
@@ -66,16 +80,107 @@ def run_backward_test(hmm, observations):
         print(f"Backward calculation completed. Beta table shape: {beta.shape}")
     else: print("Backward calculation failed.")
 
+def run_forward_backward_check(hmm, observations):
+    # Compares the scaled linear forward backward against the log domain one on the same sequence
+    if hmm is None or observations is None or len(observations) == 0: return
+    print("\n--- Checking Scaled Forward-Backward Against Log Domain ---")
+    log_alpha, log_beta, log_prob_O = hmm.forward_backward(observations, mode="log")
+    scaled_alpha, scaled_beta, scaled_log_prob_O = hmm.forward_backward(observations, mode="scaled")
+    if log_alpha is None or scaled_alpha is None:
+        print("Forward-Backward check failed: sequence is imposable in one of the modes.")
+        return
+    finite = np.isfinite(log_alpha) & np.isfinite(log_beta)
+    print(f"Log P(O|lambda): log={log_prob_O:.6f} scaled={scaled_log_prob_O:.6f}")
+    print(f"Max alpha diff: {np.max(np.abs(log_alpha[finite] - scaled_alpha[finite])):.3e}")
+    print(f"Max beta diff: {np.max(np.abs(log_beta[finite] - scaled_beta[finite])):.3e}")
+
 def run_viterbi_test(hmm, observations):
     if hmm is None or observations is None or len(observations) == 0: return
     print(f"\n--- Testing Viterbi Decoding ---")
     best_path, phoneme_sequence, final_log_prob = hmm.decode_to_phonemes(observations)
     print(f"Viterbi Algo: Final Log-Probability: {final_log_prob:.2f}")
-    if best_path:
+    if len(best_path) > 0:
         print(f"Viterbi Algo: Decoded Phoneme Sequence ({len(best_path)} states): {phoneme_sequence}")
     else: print("Viterbi Algo: No valid path found.")
 
-def run_training(hmm, training_sequences, max_iter=5, save_params=False, threshold=0.01):
+def run_beam_comparison(hmm, observation_sequences, beams=(None, 20.0, 10.0, 5.0), max_active=None, params=None):
+    # Accuracy & speed of the beam pruned Viterbi against the exact one on the same sequences
+    # With the one state params it's also compared on a large sparse topology (setup_large_sparse_hmm) -
+    # the small models keep most states in the beam, the large one is where the pruning saves time
+    if hmm is None or not observation_sequences: return
+    _compare_beams(hmm, observation_sequences, beams, max_active)
+    if params is not None:
+        _compare_beams(setup_large_sparse_hmm(params), observation_sequences, beams, max_active)
+
+def _compare_beams(hmm, observation_sequences, beams, max_active):
+    print(f"\n--- Comparing Beam Viterbi Against Exact Viterbi (max_active={max_active}) ---")
+    start = time.perf_counter()
+    exact = [hmm.viterbi_decode(observations) for observations in observation_sequences]
+    exact_time = time.perf_counter() - start
+    num_frames = sum(len(observations) for observations in observation_sequences)
+    print(f"Exact: {1000 * exact_time:.1f} ms, {hmm.N} states per frame")
+
+    for beam in beams:
+        stats = {}
+        matching_frames = 0
+        active_states = 0
+        emission_evaluations = 0
+        score_losses = []
+        start = time.perf_counter()
+        results = []
+        for observations in observation_sequences:
+            results.append(hmm.viterbi_decode_beam(observations, beam=beam, max_active=max_active, stats=stats))
+            active_states += int(stats.get("active_states", np.zeros(0)).sum())
+            emission_evaluations += stats.get("emission_evaluations", 0)
+        beam_time = time.perf_counter() - start
+
+        for (exact_path, exact_score), (path, score) in zip(exact, results):
+            if len(path) == len(exact_path) and len(path) > 0:
+                matching_frames += int(np.sum(path == exact_path))
+                score_losses.append(exact_score - score)
+        max_loss = max(score_losses) if score_losses else float("nan")
+        print(f"Beam {beam}: {1000 * beam_time:.1f} ms ({exact_time / beam_time:.1f}x), "
+              f"{active_states / num_frames:.1f} active & {emission_evaluations / num_frames:.1f} scored states per frame, "
+              f"frame accuracy {matching_frames / num_frames:.2%}, max log prob loss {max_loss:.3f}")
+
+def run_tied_covariance_benchmark(hmm, training_sequences, test_sequences=None, train_iterations=3):
+    # Decode time & likelihood of one covariance tied across all the states against the per state covariances
+    # Both models start from the same params & get the same training
+    if hmm is None or not training_sequences: return
+    test_sequences = test_sequences or training_sequences
+    print(f"\n--- Tied vs Untied Covariances ({train_iterations} training iterations) ---")
+
+    models = {"untied": copy.deepcopy(hmm), "tied": copy.deepcopy(hmm)}
+    models["tied"].tie_covariances()
+    with contextlib.redirect_stdout(io.StringIO()): # The training logs of both models
+        for name, model in models.items():
+            if train_iterations > 0:
+                model.baum_welch_train(training_sequences, max_iterations=train_iterations, tie_covariances=(name == "tied"))
+
+    paths = {}
+    for name, model in models.items():
+        # Best of 3 so the timing isn't the first run warm up
+        emission_time = decode_time = np.inf
+        for _ in range(3):
+            start = time.perf_counter()
+            for observations in test_sequences:
+                model._log_emission_matrix(observations)
+            emission_time = min(emission_time, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            paths[name] = [model.viterbi_decode(observations)[0] for observations in test_sequences]
+            decode_time = min(decode_time, time.perf_counter() - start)
+
+        log_likelihood = sum(model.forward_backward(observations, mode="scaled")[2] for observations in test_sequences)
+        print(f"{name}: emissions {1000 * emission_time:.2f} ms, decode {1000 * decode_time:.2f} ms, "
+              f"total log likelihood {log_likelihood:.2f}")
+
+    num_frames = sum(len(observations) for observations in test_sequences)
+    matching_frames = sum(int(np.sum(untied_path == tied_path)) for untied_path, tied_path in zip(paths["untied"], paths["tied"])
+                          if len(untied_path) == len(tied_path))
+    print(f"Tied paths agree with the untied ones on {matching_frames / num_frames:.2%} of the frames")
+
+def run_training(hmm, training_sequences, max_iter=5, save_params=False, threshold=0.01, num_workers=1):
     if hmm is None or not training_sequences:
         print("Cannot run training: HMM not initialized or no training data.")
         return
@@ -83,11 +188,17 @@ def run_training(hmm, training_sequences, max_iter=5, save_params=False, thresho
     print(f"\n--- Starting Baum-Welch Training ({max_iter} iterations, threshold={threshold}) ---")
     likelihood_history = hmm.baum_welch_train(training_sequences,
                                    max_iterations=max_iter,
-                                   convergence_threshold=threshold)
+                                   convergence_threshold=threshold,
+                                   num_workers=num_workers)
     print("\n--- Training Complete ---")
     print(f"Log Likelihood History: {likelihood_history}")
 
-    if save_params:
+    if save_params and (hmm.transitions is not None or hmm.emissions.emission_type != "full"):
+        # The npz only holds one state per phoneme with a full covariance gaussian - other topologies &
+        # emission types go to the compiled model
+        model_format.save_model(hmm, ph.MODEL_FILE, ph.PHONEMES)
+        print("--- Trained Parameters Saved ---")
+    elif save_params:
         print(f"Saving trained parameters to {ph.PARAMS_FILE}...")
         updated_params = {
             "phonemes": ph.PHONEMES, "num_states": hmm.N, "mfcc_dim": hmm.mfcc_dim,
@@ -98,6 +209,8 @@ def run_training(hmm, training_sequences, max_iter=5, save_params=False, thresho
         ph.save_array_params(ph.PARAMS_FILE, updated_params["initial_probs"],
                               updated_params["transition_matrix"], updated_params["emission_means"],
                               updated_params["emission_covariances"])
+        # Recompile the serving model so it doesn't keep the old parameters
+        model_format.save_model(hmm, ph.MODEL_FILE, ph.PHONEMES)
         print("--- Trained Parameters Saved ---")
     else:
         print("--- Trained Parameters NOT saved ---")
@@ -110,5 +223,8 @@ if __name__ == "__main__":
     # print_hmm_params(initial_params)
     # run_forward_test(hmm_instance, dummy_sequences[0])
     # run_backward_test(hmm_instance, dummy_sequences[0])
+    # run_forward_backward_check(hmm_instance, dummy_sequences[0])
     # run_viterbi_test(hmm_instance, dummy_sequences[0])
+    # run_beam_comparison(hmm_instance, dummy_sequences, params=initial_params)
+    # run_tied_covariance_benchmark(hmm_instance, dummy_sequences)
     # run_training(hmm_instance, dummy_sequences, max_iter=5, save_params=False)
\ No newline at end of file
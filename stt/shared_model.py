@@ -0,0 +1,37 @@
+import numpy as np
+from multiprocessing import shared_memory
+from hmm import HMM
+from model_format import array_layout, array_views
+
+# Model parameters shared by all the worker processes of a deployment
+# The parent publishes the decode ready arrays of its model once into a shared memory block &
+# every worker builds its HMM from read only views into that block - no loading, no factorizing
+# and no copy of the parameters per worker
+
+def publish_model(hmm):
+    # Copies the model arrays into a new shared memory block
+    # Returns the block (the caller closes & unlinks it when the workers are done) and a small
+    # picklable descriptor the workers attach with
+    arrays = {name: np.ascontiguousarray(array) for name, array in hmm.export_arrays().items()}
+
+    # 1. Layout - (offset, shape, dtype) of each array in the block, same as the compiled model file
+    layout, size = array_layout(arrays)
+
+    # 2. Copy the arrays in
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for name, array in arrays.items():
+        offset, shape, dtype = layout[name]
+        np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)[...] = array
+
+    descriptor = {"name": block.name, "layout": layout, "meta": hmm.export_meta()}
+    print(f"STT: Published HMM parameters to shared memory '{block.name}' ({size / 1024:.1f} KB)")
+    return block, descriptor
+
+def attach_model(descriptor):
+    # HMM backed by read only views of a block published by publish_model
+    block = shared_memory.SharedMemory(name=descriptor["name"])
+    hmm = HMM.from_arrays(descriptor["meta"], array_views(block.buf, descriptor["layout"]))
+    _attached_blocks.append(block) # The views need the mapping for as long as the process lives
+    return hmm
+
+_attached_blocks = []
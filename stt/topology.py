@@ -0,0 +1,164 @@
+import numpy as np
+import scipy.sparse
+
+# Sparse transition structure for the multi state phoneme topologies
+# Only the transitions that can happen are stored so every decoding / training step costs
+# O(number of transitions) instead of O(N^2) - a 3 state left to right model of the 40 phonemes has
+# 120 states but about 1.8K transitions instead of the 14.4K of a dense matrix
+
+LOG_ZERO = -np.inf
+
+
+def _segments(sorted_keys, num_states):
+    # (indptr, start of every non empty segment, state of every non empty segment) of keys sorted by state
+    indptr = np.searchsorted(sorted_keys, np.arange(num_states + 1))
+    states = np.flatnonzero(np.diff(indptr) > 0)
+    return indptr, indptr[states], states
+
+def _ragged_arange(starts, counts):
+    # Concatenation of arange(start, start + count) for every pair
+    total = counts.sum()
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    ends = np.cumsum(counts)
+    offsets = np.repeat(starts - (ends - counts), counts)
+    return offsets + np.arange(total)
+
+
+class SparseTransitions:
+    # Log transition probs stored as CSR (sorted by source state) with a second ordering by destination
+    # for the steps that reduce over the incoming transitions of every state (viterbi, forward)
+    def __init__(self, num_states, sources, destinations, log_probs):
+        self.N = num_states
+        sources = np.asarray(sources, dtype=np.int64)
+        destinations = np.asarray(destinations, dtype=np.int64)
+        log_probs = np.asarray(log_probs, dtype=np.float64)
+
+        # 1. CSR - sorted by (source, destination)
+        order = np.lexsort((destinations, sources))
+        self.sources = sources[order]
+        self.destinations = destinations[order]
+        self.log_probs = log_probs[order]
+        self.source_indptr, self._out_starts, self._out_states = _segments(self.sources, num_states)
+
+        # 2. The same transitions sorted by (destination, source) - the first best predecessor
+        # of a state is then the lowest source index, same as argmax over a dense column
+        self.by_destination = np.lexsort((self.sources, self.destinations))
+        self.in_sources = self.sources[self.by_destination]
+        self.in_destinations = self.destinations[self.by_destination]
+        self.in_log_probs = self.log_probs[self.by_destination]
+        self.destination_indptr, self._in_starts, self._in_states = _segments(self.in_destinations, num_states)
+        self._in_positions = np.empty_like(self.by_destination) # CSR transition -> its position in that order
+        self._in_positions[self.by_destination] = np.arange(len(self.by_destination))
+
+        # 3. Linear probs for the scaled forward backward - A & its transpose as scipy CSR
+        self.probs = scipy.sparse.csr_matrix((np.exp(self.log_probs), self.destinations, self.source_indptr),
+                                             shape=(num_states, num_states))
+        self.probs_T = self.probs.T.tocsr()
+
+    @classmethod
+    def from_dense(cls, transition_matrix, threshold=0.0):
+        # Keeps the transitions with prob above threshold
+        sources, destinations = np.nonzero(transition_matrix > threshold)
+        return cls(transition_matrix.shape[0], sources, destinations,
+                   np.log(transition_matrix[sources, destinations]))
+
+    @property
+    def num_transitions(self):
+        return len(self.log_probs)
+
+    def with_log_probs(self, log_probs):
+        # Same structure with new probs (in CSR order) - used by the M-step
+        return SparseTransitions(self.N, self.sources, self.destinations, log_probs)
+
+    def to_dense(self):
+        # (N, N) log transition matrix, -inf for the transitions that don't exist
+        log_A = np.full((self.N, self.N), LOG_ZERO)
+        log_A[self.sources, self.destinations] = self.log_probs
+        return log_A
+
+    def _reduce_max(self, values, starts, states):
+        # Max of (..., E) values over each segment -> (..., N), -inf for states without transitions
+        result = np.full(values.shape[:-1] + (self.N,), LOG_ZERO)
+        if len(starts):
+            result[..., states] = np.maximum.reduceat(values, starts, axis=-1)
+        return result
+
+    def _reduce_logsumexp(self, values, starts, states, keys):
+        # Logsumexp of (E,) values over each segment -> (N,)
+        max_values = self._reduce_max(values, starts, states)
+        shift = np.where(np.isfinite(max_values), max_values, 0.0)
+        sums = np.zeros(self.N)
+        if len(starts):
+            sums[states] = np.add.reduceat(np.exp(values - shift[keys]), starts)
+        with np.errstate(divide="ignore"): # No possible transition - log(0) = -inf
+            return np.log(sums) + shift
+
+    def best_predecessors(self, paths_probs):
+        # Viterbi step - paths_probs is (N,) or (B, N) path probs of the last frame
+        # Returns the best previous state & the best path prob into every state (before its emission)
+        values = paths_probs[..., self.in_sources] + self.in_log_probs
+        best_paths_probs = self._reduce_max(values, self._in_starts, self._in_states)
+
+        # First transition of each destination that reaches its max
+        E = values.shape[-1]
+        is_best = values == best_paths_probs[..., self.in_destinations]
+        first_best = np.where(is_best, np.arange(E), E)
+        best_transitions = np.zeros(best_paths_probs.shape, dtype=np.int64) # States without transitions point at 0
+        if len(self._in_starts):
+            best_transitions[..., self._in_states] = np.minimum.reduceat(first_best, self._in_starts, axis=-1)
+        best_prev_states = self.in_sources[np.minimum(best_transitions, E - 1)]
+        return best_prev_states, best_paths_probs
+
+    def active_best_predecessors(self, paths_probs, active):
+        # Viterbi step over the transitions out of the active states only (sorted indices) - the beam search
+        # costs O(transitions out of the active states) per frame instead of O(all transitions)
+        # Returns the reached states (sorted), their best previous state & best path prob (before the emission)
+        # 1. Outgoing transitions of the active states - in CSR order, so the sources are ascending
+        starts = self.source_indptr[active]
+        edges = _ragged_arange(starts, self.source_indptr[active + 1] - starts)
+        if len(edges) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0)
+
+        if 2 * len(edges) > self.num_transitions:
+            # Most states are active - one pass over all the transitions in their presorted order is cheaper
+            active_paths_probs = np.full(self.N, LOG_ZERO)
+            active_paths_probs[active] = paths_probs[active]
+            best_prev_states, best_paths_probs = self.best_predecessors(active_paths_probs)
+            reached = np.flatnonzero(best_paths_probs > LOG_ZERO)
+            return reached, best_prev_states[reached], best_paths_probs[reached]
+
+        # 2. Grouped by destination - sorting the positions in the (destination, source) order keeps the
+        # sources ascending inside every group
+        edges = self.by_destination[np.sort(self._in_positions[edges])]
+        values = paths_probs[self.sources[edges]] + self.log_probs[edges]
+        destinations = self.destinations[edges]
+        is_start = np.empty(len(edges), dtype=bool)
+        is_start[0] = True
+        np.not_equal(destinations[1:], destinations[:-1], out=is_start[1:])
+        group_starts = np.flatnonzero(is_start)
+
+        # 3. Max per destination & its first transition, same tie break as best_predecessors
+        best_paths_probs = np.maximum.reduceat(values, group_starts)
+        is_best = values == best_paths_probs[np.cumsum(is_start) - 1]
+        best_transitions = np.minimum.reduceat(np.where(is_best, np.arange(len(edges)), len(edges)), group_starts)
+        return destinations[group_starts], self.sources[edges[best_transitions]], best_paths_probs
+
+    def log_forward(self, log_alpha):
+        # log Sum_i alpha(i) * A_ij for every state j
+        values = log_alpha[self.in_sources] + self.in_log_probs
+        return self._reduce_logsumexp(values, self._in_starts, self._in_states, self.in_destinations)
+
+    def log_backward(self, log_future):
+        # log Sum_j A_ij * future(j) for every state i
+        values = self.log_probs + log_future[self.destinations]
+        return self._reduce_logsumexp(values, self._out_starts, self._out_states, self.sources)
+
+    def log_normalize(self, log_probs):
+        # Normalizes (E,) log probs in CSR order so the transitions out of each state sum to 1
+        log_sums = self._reduce_logsumexp(log_probs, self._out_starts, self._out_states, self.sources)
+        finite = np.isfinite(log_sums[self.sources])
+        normalized = log_probs.copy()
+        normalized[finite] -= log_sums[self.sources][finite]
+        return normalized
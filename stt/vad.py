@@ -0,0 +1,123 @@
+import numpy as np
+import metrics
+
+# Voice activity detection - runs on the decoded samples before MFCC & decoding
+# A frame is speech when it's loud enough, or a bit quieter but with the high zero crossing rate of the
+# unvoiced consonants (S, F, SH..). The frame decisions are smoothed - single loud frames (clicks) are
+# dropped & a speech region is extended by a few frames before its start & after its end (hangover) so the
+# soft starts & endings of words aren't cut
+# Silent chunks skip the whole pipeline, voiced ones are trimmed to their first & last speech frame
+# In a stream (StreamingVad) the frames outside speech skip the decoder
+
+FRAME_SECONDS = 0.02 # Analysis frames, not overlapping
+ENERGY_THRESHOLD_DB = -45.0 # RMS level (dB of full scale) above which a frame is speech
+UNVOICED_THRESHOLD_DB = -55.0 # Quieter frames are still speech with a zero crossing rate above ZCR_THRESHOLD
+ZCR_THRESHOLD = 0.25 # Sign changes per sample
+MIN_SPEECH_FRAMES = 3 # Shorter runs of speech frames are noise
+ONSET_FRAMES = 5 # Frames kept before a speech region
+HANGOVER_FRAMES = 15 # Frames kept after a speech region
+
+
+class VoiceActivityDetector:
+    def __init__(self, sample_rate, frame_seconds=FRAME_SECONDS, energy_threshold_db=ENERGY_THRESHOLD_DB,
+                 unvoiced_threshold_db=UNVOICED_THRESHOLD_DB, zcr_threshold=ZCR_THRESHOLD,
+                 min_speech_frames=MIN_SPEECH_FRAMES, onset_frames=ONSET_FRAMES, hangover_frames=HANGOVER_FRAMES):
+        self.frame_length = max(1, int(sample_rate * frame_seconds))
+        self.energy_threshold = 10 ** (energy_threshold_db / 10) # Mean square of the signal, full scale = 1.0
+        self.unvoiced_threshold = 10 ** (unvoiced_threshold_db / 10)
+        self.zcr_threshold = zcr_threshold
+        self.min_speech_frames = min_speech_frames
+        self.onset_frames = onset_frames
+        self.hangover_frames = hangover_frames
+
+    def speech_frames(self, samples):
+        # (num frames,) bool - the smoothed speech decision of every analysis frame
+        num_frames = len(samples) // self.frame_length
+        if num_frames == 0:
+            return np.zeros(0, dtype=bool)
+        frames = samples[:num_frames * self.frame_length].reshape(num_frames, self.frame_length)
+
+        # 1. Energy & zero crossing rate per frame
+        energy = np.einsum("ij,ij->i", frames, frames, dtype=np.float64) / self.frame_length
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / self.frame_length
+        speech = (energy > self.energy_threshold) | ((energy > self.unvoiced_threshold) & (zcr > self.zcr_threshold))
+
+        # 2. Drop the runs of speech frames that are too short
+        edges = np.diff(np.concatenate([[0], speech.view(np.int8), [0]]))
+        run_starts, run_ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+        for start, end in zip(run_starts, run_ends):
+            if end - start < self.min_speech_frames:
+                speech[start:end] = False
+
+        # 3. Onset & hangover - frame i is kept when there is speech in [i - hangover, i + onset]
+        window = np.ones(self.onset_frames + self.hangover_frames + 1)
+        spread = np.convolve(speech.astype(np.float64), window)
+        return spread[self.onset_frames:self.onset_frames + num_frames] > 0.5
+
+    def trim(self, samples):
+        # (start, end) samples of the speech part of a chunk - from the first to the last speech frame
+        # Returns None for a silent chunk. Pauses in the middle are kept, the decoder handles them
+        speech = self.speech_frames(samples)
+        voiced = np.flatnonzero(speech)
+        num_frames = len(speech)
+
+        # Metrics - captured with the rest of the pipeline in the worker processes
+        if len(voiced) == 0:
+            metrics.vad_chunks.inc(label="silent")
+            metrics.vad_frames.inc(num_frames, "skipped")
+            return None
+        kept = int(voiced[-1] + 1 - voiced[0])
+        metrics.vad_chunks.inc(label="speech")
+        metrics.vad_frames.inc(kept, "kept")
+        metrics.vad_frames.inc(num_frames - kept, "skipped") # Trimmed silence
+
+        start = int(voiced[0]) * self.frame_length
+        # The samples after the last whole frame stay with a chunk that is speech up to its end
+        end = len(samples) if voiced[-1] == num_frames - 1 else int(voiced[-1] + 1) * self.frame_length
+        return start, end
+
+
+class StreamingVad:
+    # Speech decisions of a signal that arrives in blocks of any size - the same decisions speech_frames gives
+    # for the whole signal at once. A frame is decided once the frames its smoothing looks ahead at arrived
+    # (onset + min_speech_frames - 1 frames later) & the samples of the frames it looks back at are kept
+    def __init__(self, detector):
+        self.detector = detector
+        self.lookahead = detector.onset_frames + detector.min_speech_frames - 1
+        self.context = detector.hangover_frames + detector.min_speech_frames
+        self.reset()
+
+    def reset(self):
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.buffer_start = 0 # Frame index of the first buffered sample
+        self.frames_decided = 0
+
+    def push(self, samples):
+        # Adds samples & returns the decisions of the frames that became final (may be 0 frames)
+        self.buffer = np.concatenate([self.buffer, np.asarray(samples, dtype=np.float32)])
+        return self._decide(self._whole_frames() - self.lookahead)
+
+    def flush(self):
+        # End of signal - the decisions of all the whole frames left
+        # The samples after the last whole frame go with it, like in trim
+        decisions = self._decide(self._whole_frames())
+        self.reset()
+        return decisions
+
+    def _whole_frames(self):
+        return self.buffer_start + len(self.buffer) // self.detector.frame_length
+
+    def _decide(self, end):
+        if end <= self.frames_decided:
+            return np.zeros(0, dtype=bool)
+        speech = self.detector.speech_frames(self.buffer)
+        decisions = speech[self.frames_decided - self.buffer_start:end - self.buffer_start]
+        self.frames_decided = end
+
+        # Only the frames the next decisions look back at stay - a speech run cut at the start of the
+        # buffer can then only change frames that were already decided
+        drop = max(0, end - self.context - self.buffer_start)
+        self.buffer = self.buffer[drop * self.detector.frame_length:]
+        self.buffer_start += drop
+        return decisions
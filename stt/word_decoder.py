@@ -0,0 +1,337 @@
+import numpy as np
+from lexicon import ROOT, SILENCE_WORD
+
+# Word decoding - token passing over the lexicon prefix tree
+# Every tree node is expanded into the HMM sub states of its phoneme, a token in a state is the best path
+# ending there (score, the word history link & the frame its current word started). Per frame the tokens
+# stay in their state or move to the next sub state / the first sub state of a child node, get the emission
+# of the HMM state they are in, & the ones outside of the beam are dropped
+# A token leaving a node where words end finishes a word - the best finished word of the frame becomes a
+# word link & restarts at the root, so the next word can start on the next frame
+# Only the active tokens are expanded so the cost per frame follows the beam, not the lexicon size
+
+WORD_BEAM = 15.0 # Log prob beam of the active tokens
+MAX_ACTIVE_TOKENS = 5000 # Most tokens kept per frame
+WORD_PENALTY = -5.0 # Log prob added per word - more negative prefers fewer, longer words
+LM_WEIGHT = 10.0 # Scale of the language model log probs against the acoustic (per frame) log likelihoods
+COMPACT_LINKS = 1024 # Word links stored before the unreachable ones are dropped - keeps a stream's memory bounded
+
+LOG_ZERO = -np.inf
+
+
+def _ragged_arange(starts, counts):
+    # Concatenation of arange(start, start + count) for every pair
+    total = counts.sum()
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    ends = np.cumsum(counts)
+    offsets = np.repeat(starts - (ends - counts), counts)
+    return offsets + np.arange(total)
+
+def _self_loop_log_probs(hmm):
+    # log prob of every HMM state staying in itself
+    if hmm.transitions is None:
+        return np.diag(hmm.log_A).astype(np.float64)
+    self_loops = np.full(hmm.N, LOG_ZERO)
+    loops = hmm.transitions.sources == hmm.transitions.destinations
+    self_loops[hmm.transitions.sources[loops]] = hmm.transitions.log_probs[loops]
+    return self_loops
+
+
+class DecodingNetwork:
+    # The lexicon tree expanded into the HMM states - built once per (hmm, lexicon) & shared by the decoders
+    # The phoneme to phoneme transitions of the HMM are replaced by the tree, a state moves on with the
+    # prob of not staying in itself
+    # language_model - optional language_model.LanguageModel scoring the words at their ends
+    def __init__(self, hmm, lexicon, language_model=None):
+        if lexicon.phonemes != [hmm.index_map[i] for i in range(hmm.N) if hmm.entry_states[i]]:
+            raise ValueError("lexicon phoneme list doesn't match the phonemes of the HMM")
+        self.lexicon = lexicon
+
+        # 1. HMM sub states of every phoneme - (first state, number of states)
+        first_states = np.flatnonzero(hmm.entry_states)
+        phoneme_sizes = np.diff(np.append(first_states, hmm.N))
+
+        # 2. Network states - the sub states of every node except the root, node by node
+        nodes = np.arange(1, lexicon.num_nodes)
+        node_phonemes = lexicon.node_phonemes[nodes].astype(np.int64)
+        sizes = phoneme_sizes[node_phonemes]
+        node_first = np.zeros(lexicon.num_nodes, dtype=np.int64) # First network state of every node
+        node_first[nodes] = np.cumsum(sizes) - sizes
+        self.num_states = int(sizes.sum())
+        self.node_first = node_first
+        self.state_nodes = np.repeat(nodes, sizes)
+        positions = np.arange(self.num_states) - np.repeat(node_first[nodes], sizes)
+        self.hmm_states = np.repeat(first_states[node_phonemes], sizes) + positions
+        self.is_last = positions == np.repeat(sizes, sizes) - 1
+
+        # 3. Stay & move on log probs of every network state
+        self_loops = _self_loop_log_probs(hmm)
+        with np.errstate(divide="ignore"):
+            leave = np.log1p(-np.minimum(np.exp(self_loops), 1.0))
+        self.stay_log_probs = self_loops[self.hmm_states]
+        self.leave_log_probs = leave[self.hmm_states]
+        self.entry_log_probs = np.asarray(hmm.log_pi, dtype=np.float64)[self.hmm_states] # Start of the utterance
+
+        # 4. Word ends - the last sub state of the nodes that end words
+        # Homophones share the node, the first word of the node is the one put in the transcript
+        end_nodes = np.flatnonzero(np.diff(lexicon.word_indptr) > 0)
+        self.state_words = np.full(self.num_states, -1, dtype=np.int64)
+        end_nodes = end_nodes[end_nodes != ROOT]
+        self.state_words[node_first[end_nodes] + sizes[end_nodes - 1] - 1] = lexicon.word_ids[lexicon.word_indptr[end_nodes]]
+
+        # 5. Where tokens start a word - the first sub state of the children of the root
+        self.start_states = node_first[lexicon.children(ROOT)]
+        self.silence_word = -1 # Dropped from the transcripts
+        silence_node = lexicon.child(ROOT, lexicon.phonemes.index("SIL")) if "SIL" in lexicon.phonemes else None
+        if silence_node is not None:
+            for word_id in lexicon.word_ids[lexicon.word_indptr[silence_node]:lexicon.word_indptr[silence_node + 1]]:
+                if lexicon.word(word_id) == SILENCE_WORD:
+                    self.silence_word = int(word_id)
+
+        # 6. Language model id of every lexicon word - the silence word has none & doesn't change the history
+        self.language_model = language_model
+        if language_model is not None:
+            self.lm_words = np.array([language_model.word_id(word) for word in lexicon.words()], dtype=np.int64)
+
+    def successors(self, states):
+        # Network states a token can move to out of each state except itself
+        # Returns (destinations, index of the source in states) - the next sub state, or the first sub
+        # state of every child node when leaving a node
+        inner = np.flatnonzero(~self.is_last[states])
+        last = np.flatnonzero(self.is_last[states])
+        nodes = self.state_nodes[states[last]]
+        child_starts = self.lexicon.child_indptr[nodes].astype(np.int64)
+        child_counts = self.lexicon.child_indptr[nodes + 1] - child_starts
+        children = _ragged_arange(child_starts, child_counts)
+        destinations = np.concatenate([states[inner] + 1, self.node_first[children]])
+        sources = np.concatenate([inner, np.repeat(last, child_counts)])
+        return destinations, sources
+
+
+class WordDecoder:
+    # Incremental token passing decoder for one utterance or stream
+    # push() decodes frames as they arrive, stable_words() returns the words no later frame can change &
+    # finish() the rest of the best transcript. Words are (word, first frame, last frame)
+    def __init__(self, hmm, network, beam=WORD_BEAM, max_active=MAX_ACTIVE_TOKENS, word_penalty=WORD_PENALTY,
+                 lm_weight=LM_WEIGHT):
+        self.hmm = hmm
+        self.network = network
+        self.beam = beam
+        self.max_active = max_active
+        self.word_penalty = word_penalty
+        self.lm_weight = lm_weight
+        self.reset()
+
+    def reset(self):
+        self.frame = 0
+        # Active tokens
+        self.states = np.empty(0, dtype=np.int64)
+        self.scores = np.empty(0)
+        self.links = np.empty(0, dtype=np.int64)
+        self.starts = np.empty(0, dtype=np.int64)
+        # The token at the word boundary - best word finished on the last frame
+        self.boundary_score = 0.0
+        self.boundary_link = -1
+        # Word links - a tree of the word histories, -1 is the start of the utterance
+        self.link_words, self.link_prev, self.link_starts, self.link_ends, self.link_depths = [], [], [], [], []
+        self.link_histories = [] # Language model history after the word of every link
+        lm = self.network.language_model
+        self.start_history = lm.begin_history if lm is not None else ()
+        self.emitted_link = -1 # Last link returned by stable_words
+        self.compact_at = COMPACT_LINKS # Number of links that triggers the next _compact
+
+    def _history(self, link):
+        return self.link_histories[link] if link >= 0 else self.start_history
+
+    def _add_link(self, word, prev, start, end, history=()):
+        self.link_words.append(word)
+        self.link_histories.append(history)
+        self.link_prev.append(prev)
+        self.link_starts.append(start)
+        self.link_ends.append(end)
+        self.link_depths.append(self.link_depths[prev] + 1 if prev >= 0 else 1)
+        return len(self.link_words) - 1
+
+    def _step(self, log_b):
+        net = self.network
+        t = self.frame
+        indexes = np.arange(len(self.states))
+
+        # 1. Candidates - stay, move on inside the tree & start a word from the boundary token
+        destinations, sources = net.successors(self.states)
+        candidate_states = [self.states, destinations]
+        candidate_scores = [self.scores + net.stay_log_probs[self.states],
+                            self.scores[sources] + net.leave_log_probs[self.states[sources]]]
+        candidate_sources = [indexes, sources]
+        if self.boundary_score > LOG_ZERO:
+            start_scores = np.full(len(net.start_states), self.boundary_score)
+            if t == 0:
+                start_scores += net.entry_log_probs[net.start_states]
+            candidate_states.append(net.start_states)
+            candidate_scores.append(start_scores)
+            candidate_sources.append(np.full(len(net.start_states), -1))
+        states = np.concatenate(candidate_states)
+        scores = np.concatenate(candidate_scores) + log_b[net.hmm_states[states]]
+        sources = np.concatenate(candidate_sources)
+
+        # 2. Beam - before the dedup so the sort only sees the tokens that can survive
+        if len(scores) == 0:
+            self.states, self.scores = states, scores
+            return
+        keep = np.flatnonzero(scores >= scores.max() - self.beam) if self.beam is not None else np.arange(len(scores))
+        states, scores, sources = states[keep], scores[keep], sources[keep]
+
+        # 3. One token per state - the best one
+        order = np.lexsort((-scores, states))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = states[order[1:]] != states[order[:-1]]
+        best = order[first]
+        if self.max_active is not None and len(best) > self.max_active:
+            best = best[np.argpartition(-scores[best], self.max_active - 1)[:self.max_active]]
+        states, scores, sources = states[best], scores[best], sources[best]
+
+        from_boundary = sources < 0
+        safe_sources = np.maximum(sources, 0)
+        links = np.where(from_boundary, self.boundary_link, self.links[safe_sources] if len(self.links) else -1)
+        starts = np.where(from_boundary, t, self.starts[safe_sources] if len(self.starts) else t)
+        self.states, self.scores, self.links, self.starts = states, scores, links, starts
+
+        # 4. Word ends - the best token leaving a word end node becomes the boundary token of the next frame
+        ends = np.flatnonzero(net.state_words[states] >= 0)
+        self.boundary_score = LOG_ZERO
+        if len(ends):
+            end_scores = scores[ends] + net.leave_log_probs[states[ends]] + self.word_penalty
+            if net.language_model is None:
+                i = ends[np.argmax(end_scores)]
+                self.boundary_score = end_scores.max()
+                self.boundary_link = self._add_link(int(net.state_words[states[i]]), int(links[i]), int(starts[i]), t)
+            else:
+                self._score_word_ends(ends, end_scores)
+
+    def _score_word_ends(self, ends, end_scores):
+        # Best word end with its language model score - every word of the node (homophones) given the
+        # history of the token. In order of the acoustic score so the tokens that can't win with any
+        # language model score are never looked up
+        net = self.network
+        lm = net.language_model
+        lexicon = net.lexicon
+        best = None
+        for i in np.argsort(-end_scores):
+            if best is not None and end_scores[i] <= best[0]: # log probs <= 0 - the rest can't do better
+                break
+            token = ends[i]
+            link = int(self.links[token])
+            history = self._history(link)
+            node = net.state_nodes[self.states[token]]
+            for word in lexicon.word_ids[lexicon.word_indptr[node]:lexicon.word_indptr[node + 1]]:
+                if word == net.silence_word:
+                    log_prob, next_history = 0.0, history
+                else:
+                    log_prob, next_history = lm.score(history, int(net.lm_words[word]))
+                score = end_scores[i] + self.lm_weight * log_prob
+                if best is None or score > best[0]:
+                    best = (score, int(word), link, int(self.starts[token]), next_history)
+        score, word, link, start, history = best
+        self.boundary_score = score
+        self.boundary_link = self._add_link(word, link, start, self.frame, history)
+
+    def push(self, observations, log_B=None):
+        # Decodes (T, D) more frames - log_B is their emission table when the caller already has it
+        if len(observations) == 0:
+            return
+        if log_B is None:
+            log_B = self.hmm._log_emission_matrix(np.asarray(observations, dtype=np.float64))
+        for frame_log_b in log_B:
+            self._step(frame_log_b)
+            self.frame += 1
+        if len(self.link_words) >= self.compact_at:
+            self._compact()
+
+    def _compact(self):
+        # Drops the links no hypothesis can reach anymore - the pruned histories & everything before
+        # emitted_link, whose words were returned - & renumbers the rest keeping their order
+        prev = np.array(self.link_prev, dtype=np.int64)
+        if self.emitted_link >= 0:
+            prev[self.emitted_link] = -1 # The emitted link becomes the first one
+        roots = [self.links, [self.emitted_link]]
+        if self.boundary_score > LOG_ZERO:
+            roots.append([self.boundary_link])
+        live = np.zeros(len(prev), dtype=bool)
+        frontier = np.unique(np.concatenate(roots).astype(np.int64))
+        frontier = frontier[frontier >= 0]
+        while len(frontier):
+            frontier = frontier[~live[frontier]]
+            live[frontier] = True
+            frontier = np.unique(prev[frontier])
+            frontier = frontier[frontier >= 0]
+
+        # Old link -> new link, -1 for the dropped ones
+        kept = np.flatnonzero(live)
+        renumber = np.full(len(prev) + 1, -1, dtype=np.int64) # The extra last entry maps -1 to -1
+        renumber[kept] = np.arange(len(kept))
+        self.link_words = [self.link_words[i] for i in kept]
+        self.link_histories = [self.link_histories[i] for i in kept]
+        self.link_starts = [self.link_starts[i] for i in kept]
+        self.link_ends = [self.link_ends[i] for i in kept]
+        self.link_depths = [self.link_depths[i] for i in kept] # Only compared with each other - no need to shift
+        self.link_prev = renumber[prev[kept]].tolist()
+        self.links = renumber[self.links]
+        self.boundary_link = int(renumber[self.boundary_link])
+        self.emitted_link = int(renumber[self.emitted_link])
+        self.compact_at = max(COMPACT_LINKS, 2 * len(kept))
+
+    def _chain(self, link, stop=-1):
+        # Words of the links from after `stop` up to `link`, oldest first
+        words = []
+        while link != stop and link >= 0:
+            if self.link_words[link] != self.network.silence_word:
+                words.append((self.network.lexicon.word(self.link_words[link]),
+                              self.link_starts[link], self.link_ends[link]))
+            link = self.link_prev[link]
+        return words[::-1]
+
+    def stable_words(self):
+        # Words every surviving hypothesis agrees on that weren't returned yet - the common ancestor of
+        # the word histories of all the active tokens
+        histories = set(self.links.tolist())
+        if self.boundary_score > LOG_ZERO:
+            histories.add(self.boundary_link)
+        if not histories:
+            return []
+        depths = {link: self.link_depths[link] if link >= 0 else 0 for link in histories}
+        while len(depths) > 1:
+            deepest = max(depths.values())
+            depths = {(self.link_prev[link] if depth == deepest else link):
+                      (depth - 1 if depth == deepest else depth) for link, depth in depths.items()}
+        ancestor = next(iter(depths))
+        if ancestor < 0 or self.link_depths[ancestor] <= (self.link_depths[self.emitted_link] if self.emitted_link >= 0 else 0):
+            return []
+        words = self._chain(ancestor, self.emitted_link)
+        self.emitted_link = ancestor
+        return words
+
+    def best_link(self):
+        # Last word link of the best hypothesis - the best finished word if any, otherwise the history
+        # of the best token (its unfinished word is dropped)
+        if self.boundary_score > LOG_ZERO:
+            return self.boundary_link
+        if len(self.scores):
+            return int(self.links[np.argmax(self.scores)])
+        return -1
+
+    def partial_words(self):
+        # The best transcript after the words stable_words returned - may still change with the next frames
+        return self._chain(self.best_link(), self.emitted_link)
+
+    def finish(self):
+        # End of the utterance - the words of the best hypothesis not returned by stable_words yet
+        words = self._chain(self.best_link(), self.emitted_link)
+        self.reset()
+        return words
+
+    def decode(self, observations, log_B=None):
+        # Whole utterance at once
+        self.reset()
+        self.push(observations, log_B)
+        return self.finish()